@@ -7,7 +7,6 @@ import xlb.experimental
 from xlb.experimental.multigrid_elastostatics.solid_stepper import SolidsStepper
 import xlb.velocity_set
 import warp as wp
-import numpy as np
 from typing import Any
 import sympy
 import csv
@@ -16,7 +15,7 @@ import xlb.experimental.multigrid_elastostatics.solid_utils as utils
 from xlb.experimental.multigrid_elastostatics.kernel_provider import KernelProvider
 import xlb.experimental.multigrid_elastostatics.solid_boundary as bc
 from xlb.utils import save_fields_vtk, save_image
-from xlb.experimental.multigrid_elastostatics.solid_simulation_params import SimulationParams
+from xlb.experimental.multigrid_elastostatics.solid_simulation_params import ParameterContext
 from xlb.experimental.multigrid_elastostatics.multigrid_solver import MultigridSolver
 
 
@@ -55,8 +54,7 @@ if __name__ == "__main__":
     dt = dx * dx
     E = 0.5
     nu = 0.8
-    solid_simulation = SimulationParams()
-    solid_simulation.set_all_parameters(
+    params = ParameterContext.from_material(
         E=E, nu=nu, dx=dx, dt=dt, L=dx, T=dt, kappa=1.0, theta=1.0 / 3.0
     )
 
@@ -65,30 +63,30 @@ if __name__ == "__main__":
     x, y = sympy.symbols("x y")
     manufactured_u = sympy.cos(2 * sympy.pi * y) * sympy.sin(2 * sympy.pi * x)
     manufactured_v = sympy.cos(2 * sympy.pi * x) * sympy.sin(2 * sympy.pi * y)
-    expected_displacement = np.array([
-        utils.get_function_on_grid(manufactured_u, x, y, dx, grid),
-        utils.get_function_on_grid(manufactured_v, x, y, dx, grid),
-    ])
-    force_load = utils.get_force_load((manufactured_u, manufactured_v), x, y)
+    force_load = utils.get_force_load((manufactured_u, manufactured_v), x, y, params=params)
 
-    # get expected stress
-    s_xx, s_yy, s_xy = utils.get_expected_stress((manufactured_u, manufactured_v), x, y)
-    expected_stress = np.array([
-        utils.get_function_on_grid(s_xx, x, y, dx, grid),
-        utils.get_function_on_grid(s_yy, x, y, dx, grid),
-        utils.get_function_on_grid(s_xy, x, y, dx, grid),
-    ])
+    # get expected displacement and stress (evaluated on the device)
+    expected_macroscopics = utils.get_expected_macroscopics(
+        (manufactured_u, manufactured_v), x, y, dx, grid, params=params
+    )
 
     # ------------ set boundary conditions on a circular domain matching manufactured solution-----------
     potential_sympy = (0.5 - x) ** 2 + (0.5 - y) ** 2 - 0.05
     potential = sympy.lambdify([x, y], potential_sympy)
     indicator = lambda x, y: -1
     boundary_array, boundary_values = bc.init_bc_from_lambda(
-        potential_sympy, grid, dx, velocity_set, (manufactured_u, manufactured_v), indicator, x, y
+        potential_sympy,
+        grid,
+        dx,
+        velocity_set,
+        (manufactured_u, manufactured_v),
+        indicator,
+        x,
+        y,
+        params=params,
     )
 
     # ---------------- adjust expected solution by newly defined boundary conditions-----------
-    expected_macroscopics = np.concatenate((expected_displacement, expected_stress), axis=0)
     macroscopics = grid.create_field(cardinality=9, dtype=precision_policy.store_precision)
 
     norms_over_time = list()
@@ -108,6 +106,13 @@ if __name__ == "__main__":
         boundary_values=boundary_values,
         potential=potential_sympy,
         coarsest_level_iter=0,
+        skip_ghost_nodes=True,
+        params=params,
+    )
+    print(
+        "Kernels defined at start-up: {} ({} kernel providers built)".format(
+            multigrid_solver.startup_kernels, multigrid_solver.startup_provider_builds
+        )
     )
 
     for i in range(iterations):
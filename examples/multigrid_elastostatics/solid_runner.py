@@ -7,7 +7,6 @@ import xlb.experimental
 from xlb.experimental.multigrid_elastostatics.solid_stepper import SolidsStepper
 import xlb.velocity_set
 import warp as wp
-import numpy as np
 from typing import Any
 import sympy
 import csv
@@ -15,7 +14,7 @@ import math
 import xlb.experimental.multigrid_elastostatics.solid_utils as utils
 import xlb.experimental.multigrid_elastostatics.solid_boundary as bc
 from xlb.utils import save_fields_vtk, save_image
-from xlb.experimental.multigrid_elastostatics.solid_simulation_params import SimulationParams
+from xlb.experimental.multigrid_elastostatics.solid_simulation_params import ParameterContext
 
 
 def write_results(norms_over_time, name):
@@ -60,8 +59,7 @@ if __name__ == "__main__":
     dt = 0.001
     E = 0.085 * 2.5
     nu = 0.8
-    solid_simulation = SimulationParams()
-    solid_simulation.set_all_parameters(
+    params = ParameterContext.from_material(
         E=E, nu=nu, dx=dx, dt=dt, L=dx, T=dt, kappa=1, theta=1.0 / 3.0
     )
 
@@ -70,35 +68,39 @@ if __name__ == "__main__":
     x, y = sympy.symbols("x y")
     manufactured_u = 3 * sympy.sin(2 * sympy.pi * x) * sympy.sin(2 * sympy.pi * y)
     manufactured_v = 3 * sympy.sin(2 * sympy.pi * y) * sympy.sin(2 * sympy.pi * x)
-    expected_displacement = np.array([
-        utils.get_function_on_grid(manufactured_u, x, y, dx, grid),
-        utils.get_function_on_grid(manufactured_v, x, y, dx, grid),
-    ])
-    force_load = utils.get_force_load((manufactured_u, manufactured_v), x, y)
-
-    # get expected stress
-    s_xx, s_yy, s_xy = utils.get_expected_stress((manufactured_u, manufactured_v), x, y)
-    expected_stress = np.array([
-        utils.get_function_on_grid(s_xx, x, y, dx, grid),
-        utils.get_function_on_grid(s_yy, x, y, dx, grid),
-        utils.get_function_on_grid(s_xy, x, y, dx, grid),
-    ])
+    force_load = utils.get_force_load((manufactured_u, manufactured_v), x, y, params=params)
+
+    # get expected displacement and stress (evaluated on the device)
+    expected_macroscopics = utils.get_expected_macroscopics(
+        (manufactured_u, manufactured_v), x, y, dx, grid, params=params
+    )
 
     # ------------ set boundary conditions on a circular domain matching manufactured solution-----------
     potential_sympy = (0.5 - x) ** 2 + (0.5 - y) ** 2 - 0.25
     potential = sympy.lambdify([x, y], potential_sympy)
     indicator = lambda x, y: -1
     boundary_array, boundary_values = bc.init_bc_from_lambda(
-        potential_sympy, grid, dx, velocity_set, (manufactured_u, manufactured_v), indicator, x, y
+        potential_sympy,
+        grid,
+        dx,
+        velocity_set,
+        (manufactured_u, manufactured_v),
+        indicator,
+        x,
+        y,
+        params=params,
     )
 
     # ---------------- adjust expected solution by newly defined boundary conditions-----------
-    expected_macroscopics = np.concatenate((expected_displacement, expected_stress), axis=0)
     expected_macroscopics = utils.restrict_solution_to_domain(expected_macroscopics, potential, dx)
 
     # ---------- create stepper -----------
     stepper = SolidsStepper(
-        grid, force_load, boundary_conditions=boundary_array, boundary_values=boundary_values
+        grid,
+        force_load,
+        boundary_conditions=boundary_array,
+        boundary_values=boundary_values,
+        params=params,
     )
 
     # ---------- create fields and arrays to track error -----------
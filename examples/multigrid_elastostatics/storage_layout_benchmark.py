@@ -0,0 +1,105 @@
+import xlb
+import sys
+import time
+from xlb.compute_backend import ComputeBackend
+from xlb.precision_policy import PrecisionPolicy
+import xlb.velocity_set
+import warp as wp
+import sympy
+import math
+import xlb.experimental.multigrid_elastostatics.solid_utils as utils
+from xlb.experimental.multigrid_elastostatics.solid_simulation_params import ParameterContext
+from xlb.experimental.multigrid_elastostatics.multigrid_solver import MultigridSolver
+
+
+def benchmark_layout(layout, nodes_x, cycles, force_load, params):
+    """
+    Times cycles multigrid cycles for one storage layout of the pre-collision fields
+
+    layout: "populations" or "moments"
+    nodes_x: number of nodes in x and y direction
+    cycles: number of timed cycles
+    force_load: force load of the manufactured solution
+    params: ParameterContext of the material and resolution
+
+    returns:
+        mean time per cycle in seconds and residual after the last cycle
+    """
+    length_x = 1.0
+    dx = length_x / float(nodes_x)
+    dt = dx * dx
+    multigrid_solver = MultigridSolver(
+        nodes_x=nodes_x,
+        nodes_y=nodes_x,
+        length_x=length_x,
+        length_y=length_x,
+        dt=dt,
+        force_load=force_load,
+        gamma=0.8,
+        v1=2,
+        v2=2,
+        fused_smoothing=True,
+        moment_storage=(layout == "moments"),
+        params=params,
+    )
+    multigrid_solver.compile_cycle()
+
+    # warm-up cycle (kernel compilation)
+    multigrid_solver.start_cycle()
+    wp.synchronize()
+
+    start = time.perf_counter()
+    for i in range(cycles):
+        multigrid_solver.start_cycle()
+    wp.synchronize()
+    elapsed = (time.perf_counter() - start) / cycles
+
+    residual = multigrid_solver.start_cycle(return_residual=True)
+    multigrid_solver.free()
+    return elapsed, residual
+
+
+if __name__ == "__main__":
+    # usage: python storage_layout_benchmark.py [nodes_x] [cycles]
+    nodes_x = int(sys.argv[1]) if len(sys.argv) > 1 else 256
+    cycles = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+
+    # ----------- initialize xlb -----------
+    compute_backend = ComputeBackend.WARP
+    precision_policy = PrecisionPolicy.FP64FP64
+    velocity_set = xlb.velocity_set.D2Q9(
+        precision_policy=precision_policy, compute_backend=compute_backend
+    )
+    xlb.init(
+        velocity_set=velocity_set,
+        default_backend=compute_backend,
+        default_precision_policy=precision_policy,
+    )
+
+    # ----------- set resolution and material params -----------
+    dx = 1.0 / float(nodes_x)
+    dt = dx * dx
+    params = ParameterContext.from_material(
+        E=0.5, nu=0.8, dx=dx, dt=dt, L=dx, T=dt, kappa=1.0, theta=1.0 / 3.0
+    )
+
+    # ----------- periodic manufactured solution -----------
+    x, y = sympy.symbols("x y")
+    manufactured_u = sympy.cos(2 * sympy.pi * y) * sympy.sin(2 * sympy.pi * x)
+    manufactured_v = sympy.cos(2 * sympy.pi * x) * sympy.sin(2 * sympy.pi * y)
+    force_load = utils.get_force_load((manufactured_u, manufactured_v), x, y, params=params)
+
+    results = dict()
+    for layout in ("populations", "moments"):
+        results[layout] = benchmark_layout(layout, nodes_x, cycles, force_load, params)
+        print(
+            "{:<12} {:.3f} ms/cycle, residual {:.6e}".format(
+                layout, 1000.0 * results[layout][0], results[layout][1]
+            )
+        )
+    assert math.isclose(results["populations"][1], results["moments"][1], rel_tol=1e-6)
+    print(
+        "speedup moments/populations: {:.3f}".format(
+            results["populations"][0] / results["moments"][0]
+        )
+    )
@@ -0,0 +1,66 @@
+import argparse
+import time
+import xlb
+from xlb.compute_backend import ComputeBackend
+from xlb.precision_policy import PrecisionPolicy
+from xlb.operator import Operator
+
+
+# Micro-benchmark of the per-call overhead of Operator.__call__, i.e. of resolving the backend
+# method, for an operator whose backend method does no work.
+
+
+class NoOp(Operator):
+    """
+    Operator whose warp implementation returns immediately
+    """
+
+    @Operator.register_backend(ComputeBackend.WARP)
+    def warp_implementation(self, f, f_out, omega=1.0, theta=None):
+        return f_out
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description="Per-call overhead of Operator.__call__")
+    parser.add_argument("--calls", type=int, default=100000, help="Number of timed calls")
+    return parser.parse_args()
+
+
+def time_calls(operator, calls, cached):
+    """
+    Times calls to operator with the dispatch cache enabled or cleared before every call
+
+    returns:
+        mean time per call in microseconds
+    """
+    start = time.perf_counter()
+    if cached:
+        for i in range(calls):
+            operator(None, None, omega=0.5)
+    else:
+        # forces the full resolution (candidate scan and signature binding) of every call,
+        # the behaviour without the cache
+        for i in range(calls):
+            operator._dispatch_cache.clear()
+            operator(None, None, omega=0.5)
+    return (time.perf_counter() - start) / calls * 1e6
+
+
+if __name__ == "__main__":
+    args = parse_arguments()
+    precision_policy = PrecisionPolicy.FP32FP32
+    xlb.init(
+        velocity_set=xlb.velocity_set.D2Q9(
+            precision_policy=precision_policy, compute_backend=ComputeBackend.WARP
+        ),
+        default_backend=ComputeBackend.WARP,
+        default_precision_policy=precision_policy,
+    )
+    operator = NoOp()
+    operator(None, None, omega=0.5)
+
+    uncached = time_calls(operator, args.calls, cached=False)
+    cached = time_calls(operator, args.calls, cached=True)
+    print("Per-call overhead without dispatch cache: {:.2f} us".format(uncached))
+    print("Per-call overhead with dispatch cache:    {:.2f} us".format(cached))
+    print("Speedup: {:.1f}x".format(uncached / cached))
@@ -30,6 +30,8 @@ do
     E=$base_E
     for ((k=0; k<num_E; k++))
     do
+        # compile the kernels for this E and nu once, so no run pays for the JIT compilation
+        python3 -m xlb.experimental.multigrid_elastostatics.warmup --precision fp64 --bc none --E $E --nu $nu
         echo "dim,vcycle_converged_with_allocation,vcycle_time_with_allocation,vcycle_iterations_with_allocation,wcycle_converged_with_allocation,wcycle_time_with_allocation,wcycle_iterations_with_allocation,standard_converged_with_allocation,standard_time_with_allocation,standard_iterations_with_allocation,vcycle_converged_no_allocation,vcycle_time_no_allocation,vcycle_iterations_no_allocation,wcycle_converged_no_allocation,wcycle_time_no_allocation,wcycle_iterations_no_allocation,standard_converged_no_allocation,standard_time_no_allocation,standard_iterations_no_allocation,vcycle_wu,wcycle_wu,standard_wu" > $results_file
         for ((j=0; j<repeat_iterations; j++))
         do
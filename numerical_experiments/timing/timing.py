@@ -6,7 +6,6 @@ from xlb.grid import grid_factory
 from xlb.experimental.multigrid_elastostatics.solid_stepper import SolidsStepper
 import xlb.velocity_set
 import warp as wp
-import numpy as np
 import sympy
 import csv
 import math
@@ -87,24 +86,16 @@ if __name__ == "__main__":
     x, y = sympy.symbols("x y")
     manufactured_u = 3 * sympy.cos(6 * sympy.pi * x) * sympy.sin(4 * sympy.pi * y)
     manufactured_v = 2 * sympy.cos(8 * sympy.pi * y) * sympy.sin(2 * sympy.pi * x)
-    expected_displacement = np.array([
-        utils.get_function_on_grid(manufactured_u, x, y, dx, grid),
-        utils.get_function_on_grid(manufactured_v, x, y, dx, grid),
-    ])
     force_load = utils.get_force_load((manufactured_u, manufactured_v), x, y)
 
-    # get expected stress
-    s_xx, s_yy, s_xy = utils.get_expected_stress((manufactured_u, manufactured_v), x, y)
-    expected_stress = np.array([
-        utils.get_function_on_grid(s_xx, x, y, dx, grid),
-        utils.get_function_on_grid(s_yy, x, y, dx, grid),
-        utils.get_function_on_grid(s_xy, x, y, dx, grid),
-    ])
+    # get expected displacement and stress (evaluated on the device)
+    expected_macroscopics = utils.get_expected_macroscopics(
+        (manufactured_u, manufactured_v), x, y, dx, grid
+    )
 
     potential, boundary_array, boundary_values = None, None, None
 
     # adjust expected solution
-    expected_macroscopics = np.concatenate((expected_displacement, expected_stress), axis=0)
     expected_macroscopics = utils.restrict_solution_to_domain(expected_macroscopics, potential, dx)
 
     tol = 1e-8
@@ -165,10 +156,6 @@ if __name__ == "__main__":
         print("VCycle_Iterations_With_Allocation: {}".format(i))
         print("VCycle_WU: {}".format(benchmark_data.wu))
 
-        multigrid_solver.free()
-        del multigrid_solver
-        wp.synchronize()
-
         # -------------------------------------- collect data for V-Cycle with no allocation----------------------------
         converged = 0
         runtime = 0.0
@@ -176,19 +163,9 @@ if __name__ == "__main__":
         timesteps = args.max_timesteps_multi
         benchmark_data = BenchmarkData()
         benchmark_data.wu = 0.0
-        multigrid_solver = MultigridSolver(
-            nodes_x=nodes_x,
-            nodes_y=nodes_y,
-            length_x=length_x,
-            length_y=length_y,
-            dt=dt,
-            force_load=force_load,
-            gamma=gamma,
-            v1=3,
-            v2=3,
-            max_levels=None,
-            error_correction_iterations=1,
-        )
+        # reuse the hierarchy of the previous run, only the force load is set again
+        multigrid_solver.set_force(force_load)
+        wp.synchronize()
         start = time.time()
         for i in range(timesteps):
             residual_norm = multigrid_solver.start_cycle(return_residual=True)
@@ -242,10 +219,6 @@ if __name__ == "__main__":
         print("WCycle_Iterations_With_Allocation: {}".format(i))
         print("WCycle_WU: {}".format(benchmark_data.wu))
 
-        multigrid_solver.free()
-        del multigrid_solver
-        wp.synchronize()
-
         # -------------------------------------- collect data for W-Cycle with no allocation----------------------------
         converged = 0
         runtime = 0.0
@@ -253,19 +226,9 @@ if __name__ == "__main__":
         timesteps = args.max_timesteps_multi
         benchmark_data = BenchmarkData()
         benchmark_data.wu = 0.0
-        multigrid_solver = MultigridSolver(
-            nodes_x=nodes_x,
-            nodes_y=nodes_y,
-            length_x=length_x,
-            length_y=length_y,
-            dt=dt,
-            force_load=force_load,
-            gamma=gamma,
-            v1=3,
-            v2=3,
-            max_levels=None,
-            error_correction_iterations=2,
-        )
+        # reuse the hierarchy of the previous run, only the force load is set again
+        multigrid_solver.set_force(force_load)
+        wp.synchronize()
         start = time.time()
         for i in range(timesteps):
             residual_norm = multigrid_solver.start_cycle(return_residual=True)
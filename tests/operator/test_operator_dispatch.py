@@ -0,0 +1,83 @@
+import pytest
+import xlb
+from xlb.compute_backend import ComputeBackend
+from xlb.operator import Operator
+
+
+def init_xlb_env():
+    vel_set = xlb.velocity_set.D2Q9(
+        precision_policy=xlb.PrecisionPolicy.FP32FP32, compute_backend=ComputeBackend.WARP
+    )
+    xlb.init(
+        default_precision_policy=xlb.PrecisionPolicy.FP32FP32,
+        default_backend=ComputeBackend.WARP,
+        velocity_set=vel_set,
+    )
+
+
+class CountingOperator(Operator):
+    """
+    Operator counting the calls of its backend method, which fails for f == "fail"
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.calls = 0
+
+    @Operator.register_backend(ComputeBackend.WARP)
+    def warp_implementation(self, f, f_out):
+        self.calls += 1
+        if f == "fail":
+            raise ValueError("failure in the backend method")
+        return f_out
+
+
+class OverloadedOperator(Operator):
+    """
+    Operator with two backend methods taking two positional arguments
+    """
+
+    @Operator.register_backend(ComputeBackend.WARP)
+    def warp_implementation(self, f, f_out):
+        if not isinstance(f, int):
+            raise ValueError("first overload takes integers")
+        return "int"
+
+    @Operator.register_backend(ComputeBackend.WARP)
+    def warp_implementation_str(self, s, s_out):
+        return "str"
+
+
+@pytest.mark.parametrize("warm_cache", [False, True])
+def test_method_errors_propagate(warm_cache):
+    init_xlb_env()
+    operator = CountingOperator()
+    if warm_cache:
+        assert operator(1, 2) == 2
+        assert operator._dispatch_cache, "call shape was not cached"
+    calls = operator.calls
+    with pytest.raises(ValueError, match="failure in the backend method"):
+        operator("fail", 2)
+    assert operator.calls == calls + 1, "backend method was executed again after failing"
+    assert operator(1, 3) == 3
+
+
+def test_ambiguous_call_shape_is_not_cached():
+    init_xlb_env()
+    operator = OverloadedOperator()
+    assert operator(1, 2) == "int"
+    assert operator("a", "b") == "str"
+    assert operator(1, 2) == "int"
+    assert not operator._dispatch_cache, "ambiguous call shape was cached"
+
+
+def test_binding_failure_raises():
+    init_xlb_env()
+    operator = CountingOperator()
+    with pytest.raises(Exception, match="Error captured"):
+        operator(1, 2, 3)
+    assert operator.calls == 0
+
+
+if __name__ == "__main__":
+    pytest.main()
@@ -1,3 +1,8 @@
+import contextlib
+import functools
+import io
+import sys
+import threading
 import warp as wp
 from xlb.precision_policy import PrecisionPolicy
 from typing import Any
@@ -33,59 +38,306 @@ from xlb import DefaultConfig
 #    0  0   |   8 (irrelevant)
 
 
+@functools.lru_cache(maxsize=None)
+def get_boundary_values_struct(store_dtype):
+    """
+    Returns the warp struct holding compact boundary values in store_dtype
+        (one struct type per dtype, so that values and kernels created by different
+        KernelProviders agree, see solid_boundary.py for the layout)
+    """
+
+    @wp.struct
+    class BoundaryValues:
+        # sorted linear indices i * nodes_y + j of the boundary nodes
+        nodes: wp.array1d(dtype=wp.int32)
+        # links of node n are offsets[n] to offsets[n + 1] - 1
+        offsets: wp.array1d(dtype=wp.int32)
+        # direction of every link (population leaving the domain), ascending per node
+        directions: wp.array1d(dtype=wp.int8)
+        # values of every link: Dirichlet u_x, u_y, -, -, q_ij; VN n_x, n_y, T_x, T_y, q_ij
+        values: wp.array2d(dtype=store_dtype)
+
+    return BoundaryValues
+
+
+def _provider_key(precision_policy, params):
+    """
+    Returns the key of the KernelProvider for precision_policy and the ParameterContext params:
+        everything baked into its functions and kernels (precision policy, velocity set, K, theta
+        and lambda)
+    """
+    if precision_policy is None:
+        precision_policy = DefaultConfig.default_precision_policy
+    if params is None:
+        params = SimulationParams()
+    return (precision_policy, DefaultConfig.velocity_set, params.K, params.theta, params.lamb)
+
+
+# serializes the definition of warp kernels and the loading of their modules, neither of which is
+# thread safe in warp (see defines_kernels)
+kernel_lock = threading.RLock()
+
+
+def get_kernel_modules():
+    """
+    Returns the warp modules of this package that currently define kernels
+    """
+    prefix = __name__.rsplit(".", 1)[0]
+    return [
+        module
+        for name, module in wp.context.user_modules.items()
+        if name.startswith(prefix) and module.live_kernels
+    ]
+
+
+def count_kernels():
+    """
+    Returns the number of warp kernels currently defined by the modules of this package
+        (each of them is compiled when its module is first launched)
+    """
+    return sum(len(module.live_kernels) for module in get_kernel_modules())
+
+
+def is_module_cached(module, device=None):
+    """
+    Loads a warp module on device and checks whether that needed no compilation, i.e. whether
+        warp's kernel cache held a binary of the module with its current kernels (or it was
+        loaded before). Whether warp compiled the module is read from the message it prints
+        when loading a module ("... (compiled)" or "... (cached)"); a module that had to be
+        compiled is in the cache afterwards
+
+    module: warp module (see get_kernel_modules)
+    device: warp device (defaults to the current device)
+    """
+    wp.init()
+    log = io.StringIO()
+    quiet = wp.config.quiet
+    with kernel_lock:
+        wp.config.quiet = False
+        try:
+            with contextlib.redirect_stdout(log):
+                wp.load_module(module, device=wp.get_device(device))
+        finally:
+            wp.config.quiet = quiet
+    messages = log.getvalue()
+    if not quiet:
+        sys.stdout.write(messages)
+    if "(compiled)" in messages:
+        return False
+    if messages and "(cached)" not in messages:
+        raise RuntimeError(
+            "Unexpected message of warp loading module {}: {}".format(module.name, messages.strip())
+        )
+    return True
+
+
+def load_kernel_modules(device=None):
+    """
+    Compiles (or loads from the cache) all warp modules of this package that define kernels
+    """
+    with kernel_lock:
+        for module in get_kernel_modules():
+            wp.load_module(module, device=wp.get_device(device))
+
+
+def defines_kernels(function):
+    """
+    Decorator for functions defining warp kernels (e.g. solver constructors): holds kernel_lock
+        while function runs and loads the modules of the defined kernels before releasing it,
+        so several solvers can be set up in parallel threads, and kernels launched by other
+        threads afterwards find their modules loaded
+    """
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        with kernel_lock:
+            result = function(*args, **kwargs)
+            load_kernel_modules()
+        return result
+
+    return wrapper
+
+
+def get_uncached_modules(device=None):
+    """
+    Returns the names of the warp modules of this package whose current kernels were not in
+        warp's kernel cache for device (loads all of them, see is_module_cached and warmup.py)
+    """
+    return [module.name for module in get_kernel_modules() if not is_module_cached(module, device)]
+
+
 class KernelProvider:
-    def __init__(self, precision_policy=None):
-        self._initialized = True
+    """
+    Process-wide cache of the warp functions and kernels shared by all operators
+
+    KernelProvider(precision_policy, params) returns the provider built for the same precision
+        policy, velocity set and baked material constants of the ParameterContext params (see
+        _provider_key) if there is one, so the functions and kernels are only defined (and
+        hashed/compiled by warp) once per key. Without params, the constants are taken from
+        SimulationParams. Other parameters or another default velocity set lead to a new key;
+        use clear_cache to drop the providers built so far.
+    Providers can be requested from several threads (the first request of a key builds it,
+        the others wait for it, see kernel_lock).
+    """
+
+    # built providers by key
+    _instances = {}
+    # number of providers built since the start of the process
+    num_builds = 0
+
+    def __new__(cls, precision_policy=None, params=None):
+        key = _provider_key(precision_policy, params)
+        with kernel_lock:
+            instance = cls._instances.get(key)
+            if instance is None:
+                instance = super().__new__(cls)
+                instance._initialized = False
+                cls._instances[key] = instance
+        return instance
+
+    @classmethod
+    def clear_cache(cls):
+        """
+        Drops all cached providers, so the next KernelProvider(...) defines its functions and
+            kernels anew (operators constructed before keep the kernels they hold)
+        """
+        with kernel_lock:
+            cls._instances.clear()
+
+    def __init__(self, precision_policy=None, params=None):
+        """
+        precision_policy: precision of the functions and kernels (defaults to DefaultConfig's)
+        params: ParameterContext with the material constants to bake in
+            (defaults to the current SimulationParams)
+        """
+        with kernel_lock:
+            if self._initialized:
+                return
+            self._build(precision_policy, params)
+            self._initialized = True
+            KernelProvider.num_builds += 1
+
+    def _build(self, precision_policy, params):
         # compile all kernels
 
         if precision_policy == None:
             precision_policy = DefaultConfig.default_precision_policy
 
         velocity_set = DefaultConfig.velocity_set
+        _c = velocity_set.c
 
         compute_dtype = precision_policy.compute_precision.wp_dtype
         store_dtype = precision_policy.store_precision.wp_dtype
 
-        params = SimulationParams()
+        if params is None:
+            params = SimulationParams()
         K_scaled = compute_dtype(params.K)
         theta = compute_dtype(params.theta)
         lamb = compute_dtype(params.lamb)
 
         vec = wp.vec(9, dtype=compute_dtype)
-        bc_info_vec = wp.vec(10, dtype=wp.int8)
-        bc_val_vec = wp.vec(9 * 7, dtype=compute_dtype)
+        boundary_values_struct = get_boundary_values_struct(store_dtype)
 
         self.vec = vec
-        self.bc_info_vec = bc_info_vec
-        self.bc_val_vec = bc_val_vec
+        self.boundary_values_struct = boundary_values_struct
+
+        # Fields can be stored in a compact layout with only 8 entries per node, leaving out
+        # population 0 (rest population, always zero) or moment 8 (irrelevant), see
+        # storage_offset. All kernels reading/writing fields through the helpers below
+        # work with both layouts.
+        # The last index k of a field is its load case: batched fields hold the populations of
+        # several independent problems (same geometry, different force loads) side by side,
+        # kernels handle load case k in the threads with the third thread index k (see
+        # MultigridSolver, batch_size). Node type and boundary arrays are shared (k = 0).
+        @wp.func
+        def storage_offset(f: wp.array4d(dtype=store_dtype)):
+            """
+            Returns index of first stored entry (1 for compact 8-entry layout, else 0)
+            """
+            return 9 - f.shape[0]
+
+        @wp.func
+        def read_local_population(
+            f: wp.array4d(dtype=store_dtype), x: wp.int32, y: wp.int32, k: wp.int32
+        ):
+            f_local = vec()
+            offset = storage_offset(f)
+            for i in range(9):
+                if i >= offset:
+                    f_local[i] = compute_dtype(f[i - offset, x, y, k])
+            return f_local
 
         @wp.func
-        def read_local_population(f: wp.array4d(dtype=store_dtype), x: wp.int32, y: wp.int32):
+        def pull_population(
+            f: wp.array4d(dtype=store_dtype), x: wp.int32, y: wp.int32, k: wp.int32
+        ):
+            """
+            Streaming step (pull scheme, periodic BC) for lattice point (x,y) of load case k
+
+            returns:
+                vector of populations streamed to lattice point
+            """
             f_local = vec()
+            offset = storage_offset(f)
+            nodes_x = f.shape[1]
+            nodes_y = f.shape[2]
             for i in range(9):
-                f_local[i] = compute_dtype(f[i, x, y, 0])
+                if i >= offset:
+                    pull_x = wp.mod(x - _c[0, i] + nodes_x, nodes_x)
+                    pull_y = wp.mod(y - _c[1, i] + nodes_y, nodes_y)
+                    f_local[i] = compute_dtype(f[i - offset, pull_x, pull_y, k])
             return f_local
 
         @wp.func
-        def read_bc_info(bc_info: wp.array4d(dtype=wp.int8), i: wp.int32, j: wp.int32):
-            info = bc_info_vec()
-            for l in range(10):
-                info[l] = bc_info[l, i, j, 0]
-            return info
+        def find_boundary_node(
+            bc_vals: boundary_values_struct, i: wp.int32, j: wp.int32, nodes_y: wp.int32
+        ):
+            """
+            Binary search for boundary node (i,j) in the compact boundary values
+
+            returns:
+                index of the node in bc_vals.nodes (its links are offsets[n] to offsets[n + 1] - 1),
+                -1 if (i,j) is no boundary node
+            """
+            key = i * nodes_y + j
+            lower = wp.int32(0)
+            upper = bc_vals.nodes.shape[0]
+            while lower < upper:
+                middle = (lower + upper) // 2
+                if bc_vals.nodes[middle] < key:
+                    lower = middle + 1
+                else:
+                    upper = middle
+            if lower < bc_vals.nodes.shape[0]:
+                if bc_vals.nodes[lower] == key:
+                    return lower
+            return -1
 
         @wp.func
-        def read_bc_vals(bc_vals: wp.array4d(dtype=store_dtype), i: wp.int32, j: wp.int32):
-            vals = bc_val_vec()
-            for l in range(9 * 7):
-                vals[l] = bc_vals[l, i, j, 0]
-            return vals
+        def active_node(row_spans: wp.array2d(dtype=wp.int32), i: wp.int32, t: wp.int32):
+            """
+            Index j of the t-th node of the active span of row i (see ActiveCells)
+
+            returns:
+                row_spans[i, 0] + t, -1 if this is beyond the end of the span
+            """
+            j = row_spans[i, 0] + t
+            if j >= row_spans[i, 1]:
+                return -1
+            return j
 
         @wp.func
         def write_population_to_global(
-            f: wp.array4d(dtype=store_dtype), f_local: vec, x: wp.int32, y: wp.int32
+            f: wp.array4d(dtype=store_dtype), f_local: vec, x: wp.int32, y: wp.int32, k: wp.int32
         ):
+            offset = storage_offset(f)
             for i in range(9):
-                f[i, x, y, 0] = store_dtype(f_local[i])
+                if i >= offset:
+                    f[i - offset, x, y, k] = store_dtype(f_local[i])
+
+        @wp.func
+        def identity(v: vec):
+            return v
 
         @wp.func
         def zero_vec():
@@ -100,10 +352,11 @@ class KernelProvider:
             array_local: Any,
             x: wp.int32,
             y: wp.int32,
+            k: wp.int32,
             dim: wp.int32,
         ):
             for i in range(dim):
-                array[i, x, y, 0] = store_dtype(array_local[i])
+                array[i, x, y, k] = store_dtype(array_local[i])
 
         @wp.func
         def calc_moments(f: vec):
@@ -142,13 +395,13 @@ class KernelProvider:
         ):
             i, j, k = wp.tid()
             for l in range(dim):
-                dest[l, i, j, 0] = origin[l, i, j, 0]
+                dest[l, i, j, k] = origin[l, i, j, k]
 
         @wp.kernel
         def set_population_to_zero(f: wp.array4d(dtype=store_dtype), dim: Any):
             i, j, k = wp.tid()
             for l in range(dim):
-                f[l, i, j, 0] = store_dtype(0.0)
+                f[l, i, j, k] = store_dtype(0.0)
 
         @wp.kernel
         def multiply_populations(
@@ -156,7 +409,7 @@ class KernelProvider:
         ):
             i, j, k = wp.tid()
             for l in range(dim):
-                f[l, i, j, 0] = store_dtype(factor * compute_dtype(f[l, i, j, 0]))
+                f[l, i, j, k] = store_dtype(factor * compute_dtype(f[l, i, j, k]))
 
         @wp.kernel
         def subtract_populations(
@@ -167,8 +420,8 @@ class KernelProvider:
         ):
             i, j, k = wp.tid()
             for l in range(dim):
-                c[l, i, j, 0] = store_dtype(
-                    compute_dtype(a[l, i, j, 0]) - compute_dtype(b[l, i, j, 0])
+                c[l, i, j, k] = store_dtype(
+                    compute_dtype(a[l, i, j, k]) - compute_dtype(b[l, i, j, k])
                 )
 
         @wp.kernel
@@ -180,8 +433,8 @@ class KernelProvider:
         ):
             i, j, k = wp.tid()
             for l in range(dim):
-                c[l, i, j, 0] = store_dtype(
-                    compute_dtype(a[l, i, j, 0]) + compute_dtype(b[l, i, j, 0])
+                c[l, i, j, k] = store_dtype(
+                    compute_dtype(a[l, i, j, k]) + compute_dtype(b[l, i, j, k])
                 )
 
         @wp.kernel
@@ -193,13 +446,13 @@ class KernelProvider:
         ):
             i, j, k = wp.tid()
             for l in range(dim):
-                a_val = compute_dtype(a[l, i, j, 0])
-                b_val = compute_dtype(b[l, i, j, 0])
+                a_val = compute_dtype(a[l, i, j, k])
+                b_val = compute_dtype(b[l, i, j, k])
                 if a_val == compute_dtype(wp.nan):
                     a_val = compute_dtype(0.0)
                 if b_val == compute_dtype(wp.nan):
                     b_val = compute_dtype(0.0)
-                c[l, i, j, 0] = store_dtype(a_val + b_val)
+                c[l, i, j, k] = store_dtype(a_val + b_val)
 
         @wp.func
         def calc_populations(m: vec):
@@ -250,13 +503,13 @@ class KernelProvider:
         ):
             i, j, k = wp.tid()
             for l in range(dim):
-                f_destination[l, i, j, 0] = store_dtype(
+                f_destination[l, i, j, k] = store_dtype(
                     gamma
                     * (
-                        compute_dtype(f_after_stream[l, i, j, 0])
-                        - compute_dtype(defect_correction[l, i, j, 0])
+                        compute_dtype(f_after_stream[l, i, j, k])
+                        - compute_dtype(defect_correction[l, i, j, k])
                     )
-                    + (compute_dtype(1.0) - gamma) * compute_dtype(f_previous[l, i, j, 0])
+                    + (compute_dtype(1.0) - gamma) * compute_dtype(f_previous[l, i, j, k])
                 )
 
         @wp.kernel
@@ -269,9 +522,9 @@ class KernelProvider:
         ):
             i, j, k = wp.tid()
             for l in range(dim):
-                f_destination[l, i, j, 0] = store_dtype(
-                    gamma * (compute_dtype(f_after_stream[l, i, j, 0]))
-                    + (compute_dtype(1.0) - gamma) * compute_dtype(f_previous[l, i, j, 0])
+                f_destination[l, i, j, k] = store_dtype(
+                    gamma * (compute_dtype(f_after_stream[l, i, j, k]))
+                    + (compute_dtype(1.0) - gamma) * compute_dtype(f_previous[l, i, j, k])
                 )
 
         @wp.func
@@ -298,7 +551,7 @@ class KernelProvider:
             res_i = i - coarse_i * 2
             res_j = j - coarse_j * 2
 
-            macr_a = read_local_population(macroscopics_coarse, coarse_i, coarse_j)
+            macr_a = read_local_population(macroscopics_coarse, coarse_i, coarse_j, k)
             macr_b = macr_a
             macr_c = macr_a
             macr_d = macr_a
@@ -327,16 +580,19 @@ class KernelProvider:
                 macroscopics_coarse,
                 wp.mod(coarse_i + shift_x + coarse_nodes_x, coarse_nodes_x),
                 coarse_j,
+                k,
             )
             macr_c = read_local_population(
                 macroscopics_coarse,
                 coarse_i,
                 wp.mod(coarse_j + shift_y + coarse_nodes_y, coarse_nodes_y),
+                k,
             )
             macr_d = read_local_population(
                 macroscopics_coarse,
                 wp.mod(coarse_i + shift_x + coarse_nodes_x, coarse_nodes_x),
                 wp.mod(coarse_j + shift_y + coarse_nodes_y, coarse_nodes_y),
+                k,
             )
 
             macr = compute_dtype(0.0625) * (
@@ -378,7 +634,7 @@ class KernelProvider:
             m_fine[8] = compute_dtype(0.0) * compute_dtype(0)
 
             f_local_fine = calc_populations(m_fine)
-            write_population_to_global(fine, f_local_fine, i, j)
+            write_population_to_global(fine, f_local_fine, i, j, k)
 
         @wp.kernel
         def interpolate_through_moments_no_boundaries(
@@ -395,7 +651,7 @@ class KernelProvider:
             res_i = i - coarse_i * 2
             res_j = j - coarse_j * 2
 
-            f_a = read_local_population(coarse, coarse_i, coarse_j)
+            f_a = read_local_population(coarse, coarse_i, coarse_j, k)
             f_b = f_a
             f_c = f_a
             f_d = f_a
@@ -421,15 +677,16 @@ class KernelProvider:
                 shift_y = 1
 
             f_b = read_local_population(
-                coarse, wp.mod(coarse_i + shift_x + coarse_nodes_x, coarse_nodes_x), coarse_j
+                coarse, wp.mod(coarse_i + shift_x + coarse_nodes_x, coarse_nodes_x), coarse_j, k
             )
             f_c = read_local_population(
-                coarse, coarse_i, wp.mod(coarse_j + shift_y + coarse_nodes_y, coarse_nodes_y)
+                coarse, coarse_i, wp.mod(coarse_j + shift_y + coarse_nodes_y, coarse_nodes_y), k
             )
             f_d = read_local_population(
                 coarse,
                 wp.mod(coarse_i + shift_x + coarse_nodes_x, coarse_nodes_x),
                 wp.mod(coarse_j + shift_y + coarse_nodes_y, coarse_nodes_y),
+                k,
             )
 
             m_a = calc_moments(f_a)
@@ -456,7 +713,7 @@ class KernelProvider:
             m_fine[8] = compute_dtype(1) * m_fine[8]
 
             f_local_fine = calc_populations(m_fine)
-            write_population_to_global(fine, f_local_fine, i, j)
+            write_population_to_global(fine, f_local_fine, i, j, k)
 
         @wp.kernel
         def interpolate_through_moments_with_boundaries(
@@ -474,7 +731,7 @@ class KernelProvider:
             res_i = i - coarse_i * 2
             res_j = j - coarse_j * 2
 
-            f_a = read_local_population(coarse, coarse_i, coarse_j)
+            f_a = read_local_population(coarse, coarse_i, coarse_j, k)
             f_b = f_a
             f_c = f_a
             f_d = f_a
@@ -500,15 +757,16 @@ class KernelProvider:
                 shift_y = 1
 
             f_b = read_local_population(
-                coarse, wp.mod(coarse_i + shift_x + coarse_nodes_x, coarse_nodes_x), coarse_j
+                coarse, wp.mod(coarse_i + shift_x + coarse_nodes_x, coarse_nodes_x), coarse_j, k
             )
             f_c = read_local_population(
-                coarse, coarse_i, wp.mod(coarse_j + shift_y + coarse_nodes_y, coarse_nodes_y)
+                coarse, coarse_i, wp.mod(coarse_j + shift_y + coarse_nodes_y, coarse_nodes_y), k
             )
             f_d = read_local_population(
                 coarse,
                 wp.mod(coarse_i + shift_x + coarse_nodes_x, coarse_nodes_x),
                 wp.mod(coarse_j + shift_y + coarse_nodes_y, coarse_nodes_y),
+                k,
             )
 
             m_a = calc_moments(f_a)
@@ -569,7 +827,7 @@ class KernelProvider:
             m_fine[8] = compute_dtype(1) * m_fine[8]
 
             f_local_fine = calc_populations(m_fine)
-            write_population_to_global(fine, f_local_fine, i, j)
+            write_population_to_global(fine, f_local_fine, i, j, k)
 
         @wp.kernel
         def interpolate(
@@ -582,14 +840,14 @@ class KernelProvider:
             coarse_j = j / 2  # check if really rounds down!
 
             for l in range(dim):
-                fine[l, i, j, 0] = coarse[l, coarse_i, coarse_j, 0]
+                fine[l, i, j, k] = coarse[l, coarse_i, coarse_j, k]
 
         @wp.kernel
         def check_for_nans(
             f: wp.array4d(dtype=store_dtype), boundary_array: wp.array4d(dtype=wp.int8)
         ):
             i, j, k = wp.tid()
-            f_local = read_local_population(f, i, j)
+            f_local = read_local_population(f, i, j, k)
             if boundary_array[0, i, j, 0] != wp.int8(0):
                 for l in range(velocity_set.q):
                     assert not wp.isnan(f_local[l])
@@ -600,14 +858,14 @@ class KernelProvider:
         ):
             i, j, k = wp.tid()
 
-            f_a = read_local_population(fine, 2 * i, 2 * j)
-            f_b = read_local_population(fine, 2 * i + 1, 2 * j)
-            f_c = read_local_population(fine, 2 * i, 2 * j + 1)
-            f_d = read_local_population(fine, 2 * i + 1, 2 * j + 1)
+            f_a = read_local_population(fine, 2 * i, 2 * j, k)
+            f_b = read_local_population(fine, 2 * i + 1, 2 * j, k)
+            f_c = read_local_population(fine, 2 * i, 2 * j + 1, k)
+            f_d = read_local_population(fine, 2 * i + 1, 2 * j + 1, k)
 
             coarse_f = compute_dtype(0.25) * (f_a + f_b + f_c + f_d)
 
-            write_population_to_global(coarse, coarse_f, i, j)
+            write_population_to_global(coarse, coarse_f, i, j, k)
 
         @wp.kernel
         def restrict_with_boundaries(
@@ -617,10 +875,10 @@ class KernelProvider:
         ):
             i, j, k = wp.tid()
 
-            f_a = read_local_population(fine, 2 * i, 2 * j)
-            f_b = read_local_population(fine, 2 * i + 1, 2 * j)
-            f_c = read_local_population(fine, 2 * i, 2 * j + 1)
-            f_d = read_local_population(fine, 2 * i + 1, 2 * j + 1)
+            f_a = read_local_population(fine, 2 * i, 2 * j, k)
+            f_b = read_local_population(fine, 2 * i + 1, 2 * j, k)
+            f_c = read_local_population(fine, 2 * i, 2 * j + 1, k)
+            f_d = read_local_population(fine, 2 * i + 1, 2 * j + 1, k)
 
             domain_a = True
             domain_b = True
@@ -660,7 +918,7 @@ class KernelProvider:
                 for l in range(velocity_set.q):
                     coarse_f[l] = compute_dtype(wp.nan)
 
-            write_population_to_global(coarse, coarse_f, i, j)
+            write_population_to_global(coarse, coarse_f, i, j, k)
 
         @wp.kernel
         def restrict_through_moments(
@@ -668,10 +926,10 @@ class KernelProvider:
         ):
             i, j, k = wp.tid()
 
-            f_local_fine_a = read_local_population(fine, 2 * i, 2 * j)
-            f_local_fine_b = read_local_population(fine, 2 * i + 1, 2 * j)
-            f_local_fine_c = read_local_population(fine, 2 * i, 2 * j + 1)
-            f_local_fine_d = read_local_population(fine, 2 * i + 1, 2 * j + 1)
+            f_local_fine_a = read_local_population(fine, 2 * i, 2 * j, k)
+            f_local_fine_b = read_local_population(fine, 2 * i + 1, 2 * j, k)
+            f_local_fine_c = read_local_population(fine, 2 * i, 2 * j + 1, k)
+            f_local_fine_d = read_local_population(fine, 2 * i + 1, 2 * j + 1, k)
             m_fine_a = calc_moments(f_local_fine_a)
             m_fine_b = calc_moments(f_local_fine_b)
             m_fine_c = calc_moments(f_local_fine_c)
@@ -686,13 +944,13 @@ class KernelProvider:
             # m_coarse[7] = compute_dtype(0.125) * m_coarse[7]
 
             f_local_coarse = calc_populations(m_coarse)
-            write_population_to_global(coarse, f_local_coarse, i, j)
+            write_population_to_global(coarse, f_local_coarse, i, j, k)
 
         @wp.kernel
         def l2_norm(f: wp.array4d(dtype=store_dtype), sq_norm: wp.array(dtype=compute_dtype)):
             i, j, k = wp.tid()
 
-            f_local = read_local_population(f, i, j)
+            f_local = read_local_population(f, i, j, k)
 
             local_norm = compute_dtype(0.0)
             for l in range(velocity_set.q):
@@ -706,9 +964,9 @@ class KernelProvider:
         ):
             i, j, k = wp.tid()
 
-            m_local = read_local_population(m, i, j)
+            m_local = read_local_population(m, i, j, k)
             f_local = calc_populations(m_local)
-            write_population_to_global(f, f_local, i, j)
+            write_population_to_global(f, f_local, i, j, k)
 
         @wp.kernel
         def convert_populations_to_moments(
@@ -716,9 +974,9 @@ class KernelProvider:
         ):
             i, j, k = wp.tid()
 
-            f_local = read_local_population(f, i, j)
+            f_local = read_local_population(f, i, j, k)
             m_local = calc_moments(f_local)
-            write_population_to_global(m, m_local, i, j)
+            write_population_to_global(m, m_local, i, j, k)
 
         @wp.kernel
         def set_zero_outside_boundary(
@@ -727,11 +985,47 @@ class KernelProvider:
         ):
             i, j, k = wp.tid()  # for 2d k will equal 1
             if boundary_array[0, i, j, 0] == wp.int8(0):  # if outside domain, just set to 0
-                for l in range(velocity_set.q):
-                    f[l, i, j, 0] = store_dtype(wp.nan)
+                for l in range(f.shape[0]):
+                    f[l, i, j, k] = store_dtype(wp.nan)
+
+        @wp.kernel
+        def stream(f: wp.array4d(dtype=store_dtype), f_out: wp.array4d(dtype=store_dtype)):
+            i, j, k = wp.tid()
+            write_population_to_global(f_out, pull_population(f, i, j, k), i, j, k)
+
+        @wp.kernel
+        def scatter_to_nodes(
+            values: wp.array4d(dtype=store_dtype),
+            nodes: wp.array1d(dtype=wp.int32),
+            f: wp.array4d(dtype=store_dtype),
+        ):
+            """
+            Writes populations listed per node back to a grid
+
+            values: populations of the listed nodes, shape (9, number of nodes, 1, load cases)
+            nodes: linear indices i * nodes_y + j of the nodes
+            f: grid to write to
+
+            Exits with:
+                populations of entry b of values written to node nodes[b] of f
+                (launched with dim (number of nodes, load cases))
+            """
+            b, k = wp.tid()
+            nodes_y = f.shape[2]
+            write_population_to_global(
+                f,
+                read_local_population(values, b, 0, k),
+                nodes[b] // nodes_y,
+                nodes[b] % nodes_y,
+                k,
+            )
 
         # Set all declared functions as properties of the class
+        self.storage_offset = storage_offset
         self.read_local_population = read_local_population
+        self.pull_population = pull_population
+        self.stream = stream
+        self.scatter_to_nodes = scatter_to_nodes
         self.write_population_to_global = write_population_to_global
         self.write_vec_to_global = write_vec_to_global
         self.calc_moments = calc_moments
@@ -758,6 +1052,7 @@ class KernelProvider:
         self.convert_populations_to_moments = convert_populations_to_moments
         self.set_zero_outside_boundary = set_zero_outside_boundary
         self.check_for_nans = check_for_nans
-        self.read_bc_info = read_bc_info
-        self.read_bc_vals = read_bc_vals
+        self.find_boundary_node = find_boundary_node
+        self.active_node = active_node
         self.zero_vec = zero_vec
+        self.identity = identity
@@ -0,0 +1,52 @@
+import numpy as np
+import warp as wp
+
+
+class ActiveCells:
+    """
+    Index of the active cells (all nodes but ghost nodes) of a grid, stored as per-row spans
+
+    Row i of the grid is represented by the span of nodes j = row_spans[i, 0], ...,
+        row_spans[i, 1] - 1 from its first to its last active node. Kernels taking row_spans are
+        launched with dim, i.e. one thread per node of the widest span, and threads beyond the
+        span of their row return immediately (see active_node in kernel_provider.py). Ghost nodes
+        between active nodes of a row (holes, concave parts) stay in the span.
+    Without boundary info, all nodes are active and the spans cover the full rows.
+    The spans are shared by all load cases of a batch, which are covered by the last launch
+        dimension.
+    """
+
+    def __init__(self, nodes_x, nodes_y, boundary_info=None, device=None, batch_size=1):
+        """
+        nodes_x, nodes_y: number of nodes in x and y direction
+        boundary_info: 4d warp array with the node types (see solid_boundary.py),
+            None if all nodes are active
+        device: device of the spans (defaults to the device of boundary_info)
+        batch_size: number of load cases stored along the last index of the fields
+        """
+        spans = np.zeros((nodes_x, 2), dtype=np.int32)
+        spans[:, 1] = nodes_y
+        if boundary_info is not None:
+            active = boundary_info.numpy()[0, :, :, 0] != 0
+            first = np.argmax(active, axis=1)
+            last = nodes_y - np.argmax(active[:, ::-1], axis=1)
+            any_active = active.any(axis=1)
+            spans[:, 0] = np.where(any_active, first, 0)
+            spans[:, 1] = np.where(any_active, last, 0)
+            device = device or boundary_info.device
+
+        self.nodes_x = nodes_x
+        self.nodes_y = nodes_y
+        self.host_row_spans = spans
+        self.row_spans = wp.array(spans, dtype=wp.int32, device=device)
+        widths = spans[:, 1] - spans[:, 0]
+        self.width = int(widths.max()) if nodes_x > 0 else 0
+        # number of nodes in the spans (the nodes kernels do work for)
+        self.num_nodes = int(widths.sum())
+        self.dim = (nodes_x, self.width, batch_size)
+
+    def contains(self, i, j):
+        """
+        Returns boolean array telling whether the nodes (i, j) (arrays) lie within the spans
+        """
+        return (j >= self.host_row_spans[i, 0]) & (j < self.host_row_spans[i, 1])
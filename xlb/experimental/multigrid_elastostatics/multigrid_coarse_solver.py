@@ -0,0 +1,164 @@
+import math
+import numpy as np
+import warp as wp
+from xlb.experimental.multigrid_elastostatics.multigrid_krylov import MultigridLinearOperator
+from xlb.experimental.multigrid_elastostatics.multigrid_launch_plan import host_call
+
+try:
+    import scipy.sparse
+    import scipy.sparse.linalg
+except ImportError:
+    scipy = None
+
+
+def coloring_stride(nodes):
+    """
+    Returns the smallest divisor of nodes which is at least 3 (nodes if there is none)
+
+    Nodes whose indices agree modulo the stride are more than one node apart, also across the
+        periodic boundary, so they can be probed at once (streaming only couples neighbors).
+    """
+    for stride in range(3, nodes):
+        if nodes % stride == 0:
+            return stride
+    return nodes
+
+
+class CoarseDirectSolver:
+    """
+    Exact solver for the steady state of a level (used on the coarsest level of a MultigridSolver)
+
+    The LB iteration matrix A of the level (see MultigridLinearOperator) is assembled once by
+        probing the matrix-free operator with unit vectors. Unit vectors of the same population
+        and of nodes with the same coloring_stride residue are probed at once, so assembly takes
+        at most 9 * 16 applications on power of two grids. A is factorized with SciPy's sparse
+        LU (SuperLU) and the factorization is kept.
+    Without BC (periodic domain), A is singular: the rigid translations are steady states of the
+        homogeneous iteration. As A is translation invariant, its right and left null spaces N and
+        Y consist of fields that are the same at every node, and they are found from the action of
+        A on such fields (a small dense matrix). The bordered system [[A, Y], [N^T, 0]] is
+        regular and factorized instead, its solution is the one without rigid translation.
+    Every solve copies the defect correction d of the level to the host, solves
+        d + f - S(f) = 0, i.e. A f = b - d, and copies f back to the device.
+    With BC, the previous post-collision populations are set to the post-collision populations
+        of f (steady state).
+    """
+
+    def __init__(self, multigrid, level):
+        """
+        multigrid: MultigridSolver the level belongs to
+        level: level to solve on
+        """
+        if scipy is None:
+            raise ImportError("CoarseDirectSolver requires scipy")
+        self.level = level
+        self.linear_operator = MultigridLinearOperator(multigrid, level)
+        self.field_shape = self.linear_operator.field_shape
+        self.matrix = None
+        self.lu = None
+        self._rhs = None
+        self._ghost_rows = None
+
+    def assemble(self):
+        """
+        Assembles A (as scipy.sparse.csc_matrix) and factorizes it
+            (uses the ParameterContext of the level, see Level)
+        """
+        linear_operator = self.linear_operator
+        field_shape = self.field_shape
+        cardinality, nodes_x, nodes_y = field_shape[0], field_shape[1], field_shape[2]
+        stride_x, stride_y = coloring_stride(nodes_x), coloring_stride(nodes_y)
+        index = np.arange(linear_operator.shape[0]).reshape(field_shape)
+        node_x, node_y = np.meshgrid(np.arange(nodes_x), np.arange(nodes_y), indexing="ij")
+
+        probe = np.zeros(field_shape)
+        x = linear_operator.create_vector()
+        column = linear_operator.create_vector()
+        rows, columns, values = list(), list(), list()
+        for l in range(cardinality):
+            for color_x in range(stride_x):
+                for color_y in range(stride_y):
+                    probe[:] = 0.0
+                    probe[l, (node_x % stride_x == color_x) & (node_y % stride_y == color_y)] = 1.0
+                    x.assign(probe.astype(wp.types.warp_type_to_np_dtype[x.dtype]))
+                    linear_operator.matvec(x, column)
+                    result = column.numpy().astype(np.float64)
+
+                    # every entry of the result stems from the probed node next to it
+                    l_out, i_out, j_out, k_out = np.nonzero(result)
+                    offset_x = (color_x - i_out) % stride_x
+                    offset_x[offset_x > stride_x // 2] -= stride_x
+                    offset_y = (color_y - j_out) % stride_y
+                    offset_y[offset_y > stride_y // 2] -= stride_y
+                    i_in = (i_out + offset_x) % nodes_x
+                    j_in = (j_out + offset_y) % nodes_y
+                    rows.append(index[l_out, i_out, j_out, k_out])
+                    columns.append(index[l, i_in, j_in, k_out])
+                    values.append(result[l_out, i_out, j_out, k_out])
+
+        self.matrix = scipy.sparse.csc_matrix(
+            (np.concatenate(values), (np.concatenate(rows), np.concatenate(columns))),
+            shape=linear_operator.shape,
+        )
+        self._rhs = linear_operator.rhs().numpy().astype(np.float64).ravel()
+        if self.level.boundary_conditions is not None:
+            ghost_nodes = self.level.boundary_conditions.numpy()[0] == 0
+            self._ghost_rows = np.broadcast_to(ghost_nodes, field_shape).ravel()
+            self.lu = scipy.sparse.linalg.splu(self.matrix)
+        else:
+            self.lu = scipy.sparse.linalg.splu(self._bordered_matrix(index))
+
+    def _bordered_matrix(self, index):
+        """
+        Returns the bordered matrix [[A, Y], [N^T, 0]] of the periodic level (see class description)
+        """
+        cardinality = self.field_shape[0]
+        num_nodes = self.matrix.shape[0] // cardinality
+        # action of A on fields that are the same at every node, read at the first node
+        uniform_fields = np.zeros((self.matrix.shape[0], cardinality))
+        for l in range(cardinality):
+            uniform_fields[index[l].ravel(), l] = 1.0
+        node_matrix = (self.matrix @ uniform_fields)[index[:, 0, 0, 0]]
+        u, singular_values, vt = np.linalg.svd(node_matrix)
+        null = singular_values < 1e-10 * singular_values[0]
+        if not np.any(null):
+            return self.matrix
+        right_null = uniform_fields @ vt[null].T / math.sqrt(num_nodes)
+        left_null = uniform_fields @ u[:, null] / math.sqrt(num_nodes)
+        return scipy.sparse.bmat(
+            [[self.matrix, scipy.sparse.csc_matrix(left_null)], [right_null.T, None]],
+            format="csc",
+        )
+
+    def __call__(self):
+        """
+        Solves for the steady state of the level given its defect correction
+            (recorded as a host call if a LaunchPlan is active)
+
+        Exits with:
+            solution written to f_1 of the level
+            (and its post-collision populations written to f_4 with BC)
+        """
+        assert self.lu is not None, "assemble has to be called first"
+        level = self.level
+        host_call(self.solve, inputs=[level.f_1, level.defect_correction, level.f_4])
+
+    def solve(self, f, defect_correction, f_previous_post_collision=None):
+        """
+        f: grid with arbitrary values
+        defect_correction: grid with values for external forcing
+        f_previous_post_collision: grid with arbitrary values (None without BC)
+
+        Exits with:
+            steady state populations written to f
+            their post-collision populations written to f_previous_post_collision
+        """
+        rhs = self._rhs - defect_correction.numpy().astype(np.float64).ravel()
+        if self._ghost_rows is not None:
+            rhs[self._ghost_rows] = 0.0
+        if self.lu.shape[0] > rhs.shape[0]:
+            rhs = np.concatenate((rhs, np.zeros(self.lu.shape[0] - rhs.shape[0])))
+        solution = self.lu.solve(rhs)[: self.matrix.shape[0]].reshape(self.field_shape)
+        f.assign(solution.astype(wp.types.warp_type_to_np_dtype[f.dtype]))
+        if f_previous_post_collision is not None:
+            self.level.stepper.collide(f, f_previous_post_collision)
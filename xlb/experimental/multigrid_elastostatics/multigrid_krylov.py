@@ -0,0 +1,396 @@
+import math
+import numpy as np
+import warp as wp
+from xlb.experimental.multigrid_elastostatics.multigrid_launch_plan import launch
+
+
+class MultigridLinearOperator:
+    """
+    Matrix-free linear operator of a level of a MultigridSolver (the finest by default)
+
+    The LB iteration of the level is affine, S(f) = L f + c (c holds the force load and the
+        boundary values), and its steady state solves the linear system A f = b with
+        A = I - L and b = c. A is applied through the level's Residual operator,
+        A x = (x - S(x)) + b, where b = S(0) is computed once.
+    With BC, S is evaluated with the post-collision populations of x itself as previous
+        post-collision populations (steady state). The residual of ghost nodes is zero, so their
+        rows of A are replaced by the identity (the smoothing steps drive ghost nodes to zero).
+    Vectors are warp arrays with the shape of the level's fields; the interface follows
+        scipy.sparse.linalg.LinearOperator (shape, dtype, matvec). The vector operations the
+        Krylov drivers need (dot, axpby, ...) are done on the device as well.
+    """
+
+    def __init__(self, multigrid, level=None):
+        """
+        multigrid: MultigridSolver whose finest level defines the operator
+        level: level of multigrid defining the operator instead of the finest one
+        """
+        self.multigrid = multigrid
+        self.level = multigrid.get_finest_level() if level is None else level
+        self.field_shape = self.level.f_1.shape
+        self.shape = (math.prod(self.field_shape), math.prod(self.field_shape))
+        self.dtype = np.dtype(wp.types.warp_type_to_np_dtype[self.level.f_1.dtype])
+        self._zero = self.create_vector()
+        self._rhs = None
+        self._dot_output = wp.zeros(shape=1, dtype=self.level.f_1.dtype)
+
+        compute_dtype = self.level.compute_dtype
+        store_dtype = self.level.store_dtype
+
+        @wp.kernel
+        def axpby_kernel(
+            a: compute_dtype,
+            x: wp.array1d(dtype=store_dtype),
+            b: compute_dtype,
+            y: wp.array1d(dtype=store_dtype),
+            out: wp.array1d(dtype=store_dtype),
+        ):
+            """
+            Exits with:
+                a * x + b * y written to out (out may be x or y)
+            """
+            n = wp.tid()
+            out[n] = store_dtype(a * compute_dtype(x[n]) + b * compute_dtype(y[n]))
+
+        @wp.kernel
+        def ghost_rows_kernel(
+            x: wp.array4d(dtype=store_dtype),
+            out: wp.array4d(dtype=store_dtype),
+            boundary_info: wp.array4d(dtype=wp.int8),
+        ):
+            """
+            Exits with:
+                x copied to out at ghost nodes
+            """
+            i, j, k = wp.tid()
+            if boundary_info[0, i, j, 0] == wp.int8(0):
+                for l in range(x.shape[0]):
+                    out[l, i, j, k] = x[l, i, j, k]
+
+        self.axpby_kernel = axpby_kernel
+        self.ghost_rows_kernel = ghost_rows_kernel
+
+    def create_vector(self):
+        """
+        Allocates a vector (field of the level) filled with zeros
+        """
+        return self.level.grid.create_field(
+            cardinality=self.field_shape[0], dtype=self.level.precision_policy.store_precision
+        )
+
+    def axpby(self, a, x, b, y, out):
+        """
+        Computes out = a * x + b * y on the device (out may be x or y)
+        """
+        launch(
+            self.axpby_kernel,
+            inputs=[a, x.flatten(), b, y.flatten(), out.flatten()],
+            dim=self.shape[0],
+        )
+        return out
+
+    def copy(self, x, out):
+        """
+        Copies x to out on the device
+        """
+        return self.axpby(1.0, x, 0.0, x, out)
+
+    def dot(self, x, y):
+        """
+        Returns the inner product of x and y (synchronizes with the device)
+        """
+        wp.utils.array_inner(x.flatten(), y.flatten(), out=self._dot_output)
+        return float(self._dot_output.numpy()[0])
+
+    def norm(self, x):
+        """
+        Returns the Euclidean norm of x (synchronizes with the device)
+        """
+        return math.sqrt(max(self.dot(x, x), 0.0))
+
+    def residual(self, x, out):
+        """
+        Computes x - S(x) on the device (see class description)
+        """
+        level = self.level
+        if level.f_4 is not None:
+            level.stepper.collide(x, level.f_4)
+        level.residual(
+            f=x,
+            defect_correction=self._zero,
+            f_previous_post_collision=level.f_4,
+            residual=out,
+        )
+        if level.boundary_conditions is not None:
+            launch(
+                self.ghost_rows_kernel,
+                inputs=[x, out, level.boundary_conditions],
+                dim=self.field_shape[1:],
+            )
+        return out
+
+    def rhs(self):
+        """
+        Returns right hand side b = S(0) of the linear system (computed on first call)
+        """
+        if self._rhs is None:
+            self._rhs = self.create_vector()
+            self.residual(self._zero, self._rhs)
+            self.axpby(0.0, self._rhs, -1.0, self._rhs, self._rhs)
+        return self._rhs
+
+    def matvec(self, x, out=None):
+        """
+        Computes A x on the device
+
+        x: vector
+        out: vector to write the result to (allocated if None, must not be x)
+
+        returns:
+            out
+        """
+        if out is None:
+            out = self.create_vector()
+        self.residual(x, out)
+        return self.axpby(1.0, out, 1.0, self.rhs(), out)
+
+
+class MultigridPreconditioner:
+    """
+    Preconditioner applying multigrid cycles of a MultigridSolver to A e = v
+
+    The finest level solves for its defect correction d: d + e - S(e) = 0, i.e. A e = b - d.
+        Starting from e = 0 with d = b - v, cycles of the solver approximate e = A^-1 v.
+    With BC, the previous post-collision populations of all levels are reset as well, so that
+        every application starts from the same state.
+    The undamped step before the coarse grid correction advances f without defect correction,
+        i.e. with b instead of v, so the cycles are affine in v. Their result for v = 0 is
+        computed once and subtracted, which leaves the linear part, i.e. M is linear.
+    The solution and defect correction of the finest level are overwritten.
+    """
+
+    def __init__(self, multigrid, linear_operator, cycles=1):
+        """
+        multigrid: MultigridSolver whose cycles are used (may be compiled, see compile_cycle)
+        linear_operator: MultigridLinearOperator of multigrid
+        cycles: number of cycles per application
+        """
+        self.multigrid = multigrid
+        self.linear_operator = linear_operator
+        self.cycles = cycles
+        self.shape = linear_operator.shape
+        self.dtype = linear_operator.dtype
+        self._offset = None
+
+    def matvec(self, v, out=None):
+        """
+        Computes M^-1 v on the device
+
+        v: vector
+        out: vector to write the result to (allocated if None)
+
+        returns:
+            out
+        """
+        linear_operator = self.linear_operator
+        if out is None:
+            out = linear_operator.create_vector()
+        if self._offset is None:
+            self._offset = linear_operator.create_vector()
+            self._apply_cycles(linear_operator._zero, self._offset)
+        self._apply_cycles(v, out)
+        return linear_operator.axpby(1.0, out, -1.0, self._offset, out)
+
+    def _apply_cycles(self, v, out):
+        """
+        Runs the cycles on A e = v starting from e = 0 and copies e to out
+        """
+        linear_operator = self.linear_operator
+        level = self.multigrid.get_finest_level()
+        linear_operator.axpby(1.0, linear_operator.rhs(), -1.0, v, level.defect_correction)
+        shape = level.f_1.shape
+        launch(level.set_population_zero, inputs=[level.f_1, shape[0]], dim=shape[1:])
+        self.reset()
+        for i in range(self.cycles):
+            self.multigrid.start_cycle()
+        return linear_operator.copy(level.f_1, out)
+
+    def reset(self):
+        """
+        Sets the previous post-collision populations of the finest level to those of its
+            current solution, and those of the coarser levels (coarse grid corrections) to zero
+        """
+        finest_level = self.multigrid.get_finest_level()
+        if finest_level.f_4 is None:
+            return
+        finest_level.stepper.collide(finest_level.f_1, finest_level.f_4)
+        for level in self.multigrid.levels[1:]:
+            shape = level.f_4.shape
+            launch(level.set_population_zero, inputs=[level.f_4, shape[0]], dim=shape[1:])
+
+
+def gmres(A, b, x0=None, rtol=1e-5, atol=0.0, restart=20, maxiter=None, M=None, callback=None):
+    """
+    Restarted flexible GMRES with right preconditioning (vectors stay on the device)
+
+    A: linear operator (see MultigridLinearOperator)
+    b: right hand side
+    x0: initial guess (zero if None, not modified)
+    rtol, atol: converged if norm(b - A x) <= max(rtol * norm(b), atol)
+    restart: number of iterations between restarts
+    maxiter: maximum number of iterations, i.e. applications of the preconditioner
+        (defaults to 10 * restart)
+    M: preconditioner (see MultigridPreconditioner), flexible, so it may change between
+        applications (e.g. with BC)
+    callback: called with the residual norm estimate after every iteration
+
+    returns:
+        x: approximate solution
+        info: 0 if converged, else the number of iterations performed
+    """
+    if maxiter is None:
+        maxiter = 10 * restart
+    x = A.create_vector()
+    if x0 is not None:
+        A.copy(x0, x)
+    r = A.create_vector()
+    basis = [A.create_vector() for i in range(restart + 1)]
+    preconditioned = [A.create_vector() for i in range(restart)] if M is not None else basis
+    target = max(rtol * A.norm(b), atol)
+
+    iterations = 0
+    while True:
+        A.matvec(x, r)
+        A.axpby(1.0, b, -1.0, r, r)
+        beta = A.norm(r)
+        if beta <= target:
+            return x, 0
+        if iterations >= maxiter:
+            return x, iterations
+        A.axpby(1.0 / beta, r, 0.0, r, basis[0])
+
+        hessenberg = np.zeros((restart + 1, restart))
+        cs = np.zeros(restart)
+        sn = np.zeros(restart)
+        g = np.zeros(restart + 1)
+        g[0] = beta
+        num_vectors = 0
+        for j in range(restart):
+            if M is not None:
+                M.matvec(basis[j], preconditioned[j])
+            w = basis[j + 1]
+            A.matvec(preconditioned[j], w)
+            # modified Gram-Schmidt
+            for i in range(j + 1):
+                hessenberg[i, j] = A.dot(w, basis[i])
+                A.axpby(1.0, w, -hessenberg[i, j], basis[i], w)
+            hessenberg[j + 1, j] = A.norm(w)
+            if hessenberg[j + 1, j] > 0.0:
+                A.axpby(1.0 / hessenberg[j + 1, j], w, 0.0, w, w)
+
+            # Givens rotations of the Hessenberg matrix
+            for i in range(j):
+                h_i = hessenberg[i, j]
+                hessenberg[i, j] = cs[i] * h_i + sn[i] * hessenberg[i + 1, j]
+                hessenberg[i + 1, j] = -sn[i] * h_i + cs[i] * hessenberg[i + 1, j]
+            denominator = math.hypot(hessenberg[j, j], hessenberg[j + 1, j])
+            cs[j] = hessenberg[j, j] / denominator
+            sn[j] = hessenberg[j + 1, j] / denominator
+            hessenberg[j, j] = denominator
+            hessenberg[j + 1, j] = 0.0
+            g[j + 1] = -sn[j] * g[j]
+            g[j] = cs[j] * g[j]
+
+            num_vectors = j + 1
+            iterations += 1
+            if callback is not None:
+                callback(abs(g[j + 1]))
+            if abs(g[j + 1]) <= target or iterations >= maxiter:
+                break
+
+        # update solution with the preconditioned basis vectors
+        y = np.linalg.solve(hessenberg[:num_vectors, :num_vectors], g[:num_vectors])
+        for i in range(num_vectors):
+            A.axpby(1.0, x, y[i], preconditioned[i], x)
+
+
+def bicgstab(A, b, x0=None, rtol=1e-5, atol=0.0, maxiter=None, M=None, callback=None):
+    """
+    BiCGStab with right preconditioning (vectors stay on the device)
+
+    A: linear operator (see MultigridLinearOperator)
+    b: right hand side
+    x0: initial guess (zero if None, not modified)
+    rtol, atol: converged if norm(b - A x) <= max(rtol * norm(b), atol)
+    maxiter: maximum number of iterations (two applications of the preconditioner each),
+        defaults to 100
+    M: preconditioner (see MultigridPreconditioner)
+    callback: called with the residual norm after every iteration
+
+    returns:
+        x: approximate solution
+        info: 0 if converged, else the number of iterations performed
+        (-1 on breakdown)
+    """
+    if maxiter is None:
+        maxiter = 100
+    x = A.create_vector()
+    if x0 is not None:
+        A.copy(x0, x)
+    r = A.create_vector()
+    A.matvec(x, r)
+    A.axpby(1.0, b, -1.0, r, r)
+    r_hat = A.create_vector()
+    A.copy(r, r_hat)
+    p = A.create_vector()
+    v = A.create_vector()
+    s = A.create_vector()
+    t = A.create_vector()
+    p_hat = A.create_vector()
+    s_hat = A.create_vector()
+    target = max(rtol * A.norm(b), atol)
+
+    if A.norm(r) <= target:
+        return x, 0
+    rho = alpha = omega = 1.0
+    for iteration in range(maxiter):
+        rho_new = A.dot(r_hat, r)
+        if rho_new == 0.0:
+            return x, -1
+        beta = (rho_new / rho) * (alpha / omega)
+        rho = rho_new
+        # p = r + beta * (p - omega * v)
+        A.axpby(1.0, p, -omega, v, p)
+        A.axpby(1.0, r, beta, p, p)
+        if M is not None:
+            M.matvec(p, p_hat)
+        else:
+            A.copy(p, p_hat)
+        A.matvec(p_hat, v)
+        alpha = rho / A.dot(r_hat, v)
+        A.axpby(1.0, r, -alpha, v, s)
+        if A.norm(s) <= target:
+            A.axpby(1.0, x, alpha, p_hat, x)
+            if callback is not None:
+                callback(A.norm(s))
+            return x, 0
+        if M is not None:
+            M.matvec(s, s_hat)
+        else:
+            A.copy(s, s_hat)
+        A.matvec(s_hat, t)
+        t_norm_sq = A.dot(t, t)
+        if t_norm_sq == 0.0:
+            return x, -1
+        omega = A.dot(t, s) / t_norm_sq
+        A.axpby(1.0, x, alpha, p_hat, x)
+        A.axpby(1.0, x, omega, s_hat, x)
+        A.axpby(1.0, s, -omega, t, r)
+        r_norm = A.norm(r)
+        if callback is not None:
+            callback(r_norm)
+        if r_norm <= target:
+            return x, 0
+        if omega == 0.0:
+            return x, -1
+    return x, maxiter
@@ -0,0 +1,84 @@
+import threading
+import warp as wp
+
+
+class LaunchPlan:
+    """
+    Recorded sequence of kernel launches (e.g. one multigrid cycle)
+
+    While a plan is active (inside a with block), all launches issued through launch() are recorded
+        as warp launch commands instead of being executed. Replaying the plan executes the recorded
+        commands in order, without any Python dispatch through the operators.
+    The recorded commands hold pointers to the arrays they were recorded with, so a plan has
+        to be recorded again if any of these arrays are reallocated.
+    Host-side steps issued through host_call() are recorded with their arguments and called
+        in order with the launches.
+    The active plan is per thread, so solvers running in other threads are not recorded.
+    """
+
+    _local = threading.local()
+
+    def __init__(self):
+        self.commands = list()
+        self.wu = 0.0  # work units of the recorded launches (see BenchmarkData)
+
+    def __enter__(self):
+        assert get_active_plan() is None, "Launch plans can not be nested"
+        LaunchPlan._local.plan = self
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        LaunchPlan._local.plan = None
+
+    def __len__(self):
+        return len(self.commands)
+
+    def replay(self):
+        """
+        Executes all recorded launches in order
+        """
+        for command in self.commands:
+            command.launch()
+
+
+def get_active_plan():
+    """
+    Returns the LaunchPlan active in the calling thread, or None
+    """
+    return getattr(LaunchPlan._local, "plan", None)
+
+
+def launch(kernel, inputs, dim):
+    """
+    Launches kernel, or records the launch if a LaunchPlan is active
+    """
+    plan = get_active_plan()
+    if plan is None:
+        wp.launch(kernel, inputs=inputs, dim=dim)
+    else:
+        plan.commands.append(wp.launch(kernel, inputs=inputs, dim=dim, record_cmd=True))
+
+
+class HostCall:
+    """
+    Recorded call of a host function (see host_call), replayed like a recorded launch
+    """
+
+    def __init__(self, function, inputs):
+        self.function = function
+        self.inputs = inputs
+
+    def launch(self):
+        self.function(*self.inputs)
+
+
+def host_call(function, inputs):
+    """
+    Calls function(*inputs), or records the call if a LaunchPlan is active
+    (for host-side steps of a cycle, e.g. copying a small field to the host and back)
+    """
+    plan = get_active_plan()
+    if plan is None:
+        function(*inputs)
+    else:
+        plan.commands.append(HostCall(function, inputs))
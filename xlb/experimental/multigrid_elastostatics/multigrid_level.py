@@ -1,5 +1,5 @@
 import warp as wp
-from xlb.experimental.multigrid_elastostatics.solid_simulation_params import SimulationParams
+from xlb.experimental.multigrid_elastostatics.solid_simulation_params import get_context
 import xlb
 from xlb.compute_backend import ComputeBackend
 from xlb.precision_policy import PrecisionPolicy
@@ -15,7 +15,9 @@ from typing import Any
 import sympy
 from xlb.operator import Operator
 from xlb.experimental.multigrid_elastostatics.multigrid_prolongation import Prolongation
-from xlb.experimental.multigrid_elastostatics.multigrid_restriction import Restriction
+from xlb.experimental.multigrid_elastostatics.multigrid_residual import Residual
+from xlb.experimental.multigrid_elastostatics.multigrid_workspace import Workspace
+from xlb.experimental.multigrid_elastostatics.multigrid_launch_plan import launch
 
 
 class Level(Operator):
@@ -42,6 +44,14 @@ class Level(Operator):
         precision_policy,
         coarsest_level_iter=0,
         error_correction_iterations=1,  # by default do V-cycle
+        fused_smoothing=False,
+        workspace=None,
+        compact_storage=False,
+        moment_storage=False,
+        split_boundary=False,
+        skip_ghost_nodes=False,
+        params=None,
+        batch_size=1,
     ):
         """
         nodes_x, nodes_y: number of nodes in x and y direction
@@ -56,7 +66,24 @@ class Level(Operator):
         coarsest_level_iter: number of iterations to perform on coarsest level for direct solving
         error_correction_iterations: number of recursive calls to coarse level per MG iteration
             1 = V-cycle, 2 = W-cycle, etc.
+        fused_smoothing: if True, smoothing steps use a single fused collide-stream-relax kernel
+        workspace: Workspace to borrow scratch fields from (shared with the other levels);
+            if None, the level creates its own
+        compact_storage: if True, fields only store the 8 populations 1-8 per node
+            (population 0 is always zero, see storage_offset in kernel_provider.py)
+        moment_storage: if True, f_1, the defect correction and the residual hold moments instead
+            of populations (see MultigridStepper), so inter-grid transfers need no transforms
+        split_boundary: if True, smoothing steps with BC apply the BC in a separate kernel over the
+            boundary and ghost nodes only (see MultigridStepper)
+        skip_ghost_nodes: if True, kernels with BC are only launched over the active cells of the
+            level, skipping the ghost nodes outside the domain (see MultigridStepper)
+        params: ParameterContext of the material (defaults to the current SimulationParams),
+            the level uses it at its resolution dx, dt
+        batch_size: number of load cases solved at once, stored along the last index of all
+            fields (force_load is then a sequence of force loads, see MultigridStepper)
         """
+        assert not (compact_storage and moment_storage), "Compact storage needs populations"
+        self.params = get_context(params).with_resolution(dx, dt)
         super().__init__(
             velocity_set=velocity_set,
             precision_policy=precision_policy,
@@ -69,51 +96,64 @@ class Level(Operator):
         self.gamma = gamma
         self.dx = dx
         self.dt = dt
-        self.set_params()
         self.boundary_conditions = None
         # setup grids
-        self.f_1 = self.grid.create_field(
-            cardinality=velocity_set.q, dtype=precision_policy.store_precision
-        )
-        self.f_2 = self.grid.create_field(
-            cardinality=velocity_set.q, dtype=precision_policy.store_precision
-        )
-        self.f_3 = self.grid.create_field(
-            cardinality=velocity_set.q, dtype=precision_policy.store_precision
-        )
-        self.f_4 = self.grid.create_field(
-            cardinality=velocity_set.q, dtype=precision_policy.store_precision
-        )
-        self.defect_correction = self.grid.create_field(
-            cardinality=velocity_set.q, dtype=precision_policy.store_precision
-        )
+        self.cardinality = velocity_set.q - 1 if compact_storage else velocity_set.q
+        self.batch_size = batch_size
+        shape = (self.cardinality, nodes_x, nodes_y, batch_size)
+        self.field_shape = shape
+        if workspace is None:
+            workspace = Workspace(math.prod(shape), precision_policy.store_precision.wp_dtype)
+        self.workspace = workspace
+        self.f_1 = self.create_field()
+        if fused_smoothing:
+            # f_1 and f_2 are swapped after every smoothing step, so both hold the solution
+            self.f_2 = self.create_field()
+        else:
+            # only a temporary within a smoothing step / residual norm evaluation
+            self.f_2 = workspace.get_field("smoothing", shape)
+        # only a temporary of get_residual (which does not use f_2)
+        self.f_3 = workspace.get_field("smoothing", shape)
+        # only needed with BC, allocated in add_boundary_conditions
+        self.f_4 = None
+        self.defect_correction = self.create_field()
         # setup stepper
-        self.stepper = MultigridStepper(self.grid, force_load, self.gamma)
+        self.stepper = MultigridStepper(
+            self.grid,
+            force_load,
+            self.gamma,
+            fused_smoothing=fused_smoothing,
+            moment_storage=moment_storage,
+            split_boundary=split_boundary,
+            skip_ghost_nodes=skip_ghost_nodes,
+            precision_policy=precision_policy,
+            params=self.params,
+            batch_size=batch_size,
+        )
         self.v1 = v1
         self.v2 = v2
         self.error_correction_iterations = error_correction_iterations
         self.level_num = level_num
         self.coarsest_level_iter = coarsest_level_iter
+        # exact solver for the coarsest level (see CoarseDirectSolver), set by MultigridSolver
+        self.coarse_solver = None
 
         self.prolongation = Prolongation(
+            moment_storage=moment_storage,
             velocity_set=self.velocity_set,
             precision_policy=self.precision_policy,
             compute_backend=self.compute_backend,
+            params=self.params,
         )
-        self.restriction = Restriction(
+        self.residual = Residual(
+            stepper=self.stepper,
             velocity_set=self.velocity_set,
             precision_policy=self.precision_policy,
             compute_backend=self.compute_backend,
         )
 
     def _construct_warp(self):
-        kernel_provider = KernelProvider()
-        vec = kernel_provider.vec
-        read_local_population = kernel_provider.read_local_population
-        calc_moments = kernel_provider.calc_moments
-        calc_equilibrium = kernel_provider.calc_equilibrium
-        calc_populations = kernel_provider.calc_populations
-        write_population_to_global = kernel_provider.write_population_to_global
+        kernel_provider = KernelProvider(self.precision_policy, self.params)
         self.set_population_zero = kernel_provider.set_population_to_zero
         self.copy_populations = kernel_provider.copy_populations
         self.subtract_populations = kernel_provider.subtract_populations
@@ -121,133 +161,129 @@ class Level(Operator):
         self.convert_moments_to_populations = kernel_provider.convert_moments_to_populations
         self.set_zero_outside_boundary = kernel_provider.set_zero_outside_boundary
 
-        """
-        The warp kernel and functional of Level are only used to calculate the residual
-        """
-
-        @wp.func
-        def functional(f_previous_pre_collision: vec, f_pre_collision: vec, defect_correction: vec):
-            _f_out = defect_correction
-            for l in range(self.velocity_set.q):
-                _f_out[l] += f_previous_pre_collision[l] - f_pre_collision[l]
+        return None, None
 
-            return _f_out
-
-        @wp.kernel
-        def kernel(
-            f_1: wp.array4d(dtype=self.store_dtype),
-            f_2: wp.array4d(dtype=self.store_dtype),
-            defect_correction: wp.array4d(dtype=self.store_dtype),
-        ):
-            """
-            Kernel to compute the residual at iteration i
-
-            f_1: grid with pre-collision populations at iteration i
-            f_2: grid with pre-collision populations at iteration i+1
-            defect_correction: grid with values for external forcing
-
-            Exits with:
-                residual at iteration i written to f_1
-            """
-            i, j, k = wp.tid()
-
-            _f_previous_pre_collision = read_local_population(f_1, i, j)
-            _f_pre_collision = read_local_population(f_2, i, j)
-            _defect_correction = read_local_population(defect_correction, i, j)
-
-            _f_out = functional(
-                f_previous_pre_collision=_f_previous_pre_collision,
-                f_pre_collision=_f_pre_collision,
-                defect_correction=_defect_correction,
-            )
-
-            write_population_to_global(f=f_1, f_local=_f_out, x=i, y=j)
-
-        return functional, kernel
-
-    def get_residual(self, f_1, f_2, f_3, defect_correction):
+    def get_residual(self, f_1, f_3, defect_correction):
         """
         Computes the residual at iteration i
 
         f_1: grid with pre-collision populations at iteration i
-        f_2: grid with arbitrary values
         f_3: grid with arbitrary values
         defect_correction: grid with values for external forcing
 
         Exits with:
-            residual at iteration i written to f_3
+            residual at iteration i written to f_3 (f_1 is left unchanged)
         """
-        wp.launch(self.copy_populations, inputs=[f_1, f_3, 9], dim=f_1.shape[1:])
-        self.stepper(f_1, f_2, self.f_4, defect_correction, gamma=1.0, defect_factor=0.0)
-        wp.launch(self.warp_kernel, inputs=[f_3, f_1, defect_correction], dim=f_1.shape[1:])
+        self.residual(
+            f=f_1,
+            defect_correction=defect_correction,
+            f_previous_post_collision=self.f_4,
+            residual=f_3,
+        )
 
-    def set_params(self):
+    def smooth(self, f_3_uninitialized=False, gamma=None, defect_factor=1.0):
         """
-        Sets the simulation parameters based on the level's dx and dt
+        Performs one smoothing step on the level's fields
+
+        f_3_uninitialized: set to True if f_4 holds no previous post-collision populations
+        gamma: relaxation parameter (defaults to the level's gamma)
+        defect_factor: multiplicative factor for defect correction
+
+        Exits with:
+            updated pre-collision populations in self.f_1
+            (with fused smoothing the stepper writes to f_2, so f_1 and f_2 are swapped)
+        """
+        f_out = self.stepper(
+            self.f_1,
+            self.f_2,
+            self.f_4,
+            self.defect_correction,
+            f_3_uninitialized=f_3_uninitialized,
+            gamma=gamma,
+            defect_factor=defect_factor,
+        )
+        if f_out is self.f_2:
+            self.f_1, self.f_2 = self.f_2, self.f_1
+
+    def create_field(self):
+        """
+        Allocates a zero-initialized field of the level, shape (cardinality, nx, ny, batch_size)
         """
-        simulation_params = SimulationParams()
-        simulation_params.set_dx_dt(self.dx, self.dt)
+        return wp.zeros(self.field_shape, dtype=self.store_dtype)
+
+    def reset(self):
+        """
+        Sets the solution (f_1, and f_2 with fused smoothing), the previous post-collision
+            populations (f_4) and the defect correction to zero, as after initialization
+        """
+        fields = [self.f_1, self.f_4, self.defect_correction]
+        if self.stepper.fused_smoothing:
+            fields.append(self.f_2)
+        for f in fields:
+            if f is not None:
+                launch(self.set_population_zero, inputs=[f, f.shape[0]], dim=f.shape[1:])
 
     def add_boundary_conditions(self, boundary_conditions, boundary_values):
         """
         Manually add boundary conditions to the level's stepper
+        (also allocates f_4 for the previous post-collision populations needed by the BC)
         """
+        if self.f_4 is None:
+            self.f_4 = self.create_field()
         self.boundary_conditions = boundary_conditions
         self.stepper.add_boundary_conditions(boundary_conditions, boundary_values)
 
     @Operator.register_backend(ComputeBackend.WARP)
-    def warp_implementation(self, multigrid, return_residual=False, timestep=0):
+    def warp_implementation(
+        self, multigrid, return_residual=False, timestep=0, residual_norms=None, slot=0
+    ):
         """
         multigrid: instance of MultigridSolver which can give the next coarse level
         self.f_1: grid with current pre-collision populations
             (current approximation of steady-state populations)
         self.f_2: grid with arbitrary values
-            (used as temp grid in smoothing steps)
+            (used as temp grid in smoothing steps, borrowed from the workspace if not fused)
         self.f_3: grid with arbitrary values
-            (used to store residual)
+            (used to store residual in get_residual, borrowed from the workspace)
         self.f_4: grid with previous post-collision populations
-            (only needed if Dirichlet BC applicable)
+            (only allocated if Dirichlet BC applicable)
         self.defect_correction: grid with values for external forcing
 
+        return_residual: if True, return current L2 norm of residual (synchronizes with the device)
+        residual_norms: optional device buffer (see NormReduction.create_output) to record the
+            residual norms in without synchronizing with the device
+        slot: entry of residual_norms to write to
+
         exits with:
             one iteration of mu-cycle scheme performed
             self.f_1 contains updated pre-collision populations
             return current norm of residual if return_residual is set to True
         """
-        # set new dx, dt
-        self.set_params()
-        params = SimulationParams()
-        theta = params.theta
-
         # pre-smooth
         for i in range(self.v1):
-            self.stepper(self.f_1, self.f_2, self.f_4, self.defect_correction)
+            self.smooth()
 
         coarse = multigrid.get_next_level(self.level_num)
 
         # start MG iteration on coarse grid
         if coarse is not None:
-            self.get_residual(
-                self.f_1, self.f_2, self.f_3, self.defect_correction
-            )  # f_3 now contains the residual
-
-            if self.boundary_conditions is None:
-                self.restriction(
-                    fine=self.f_3,
-                    coarse=coarse.defect_correction,
-                    fine_nodes_x=self.nodes_x,
-                    fine_nodes_y=self.nodes_y,
-                )  # restrict residual to defect correction of coarser grid
-            else:
-                self.restriction(
-                    fine=self.f_3,
-                    coarse=coarse.defect_correction,
-                    fine_nodes_x=self.nodes_x,
-                    fine_nodes_y=self.nodes_y,
-                    fine_boundary_array=self.boundary_conditions,
-                )
-
-            wp.launch(self.set_population_zero, inputs=[coarse.f_1, 9], dim=coarse.f_1.shape[1:])
+            # compute residual and restrict it to defect correction of coarser grid in one launch
+            self.residual(
+                f=self.f_1,
+                defect_correction=self.defect_correction,
+                f_previous_post_collision=self.f_4,
+                coarse=coarse.defect_correction,
+                coarse_active_cells=coarse.stepper.active_cells,
+            )
+            # the residual kernel leaves f_1 unchanged, advance it by the undamped step
+            # without defect correction the residual was formed from
+            self.smooth(gamma=1.0, defect_factor=0.0)
+
+            launch(
+                self.set_population_zero,
+                inputs=[coarse.f_1, coarse.f_1.shape[0]],
+                dim=coarse.f_1.shape[1:],
+            )
 
             # recursive calls to MG on coarse grid
             for i in range(self.error_correction_iterations):
@@ -262,21 +298,18 @@ class Level(Operator):
                     fine=self.f_1,
                     coarse=coarse.f_1,
                     coarse_boundary_array=coarse.boundary_conditions,
+                    active_cells=self.stepper.active_cells,
                 )
-            self.set_params()
         # or solve directly
         else:
+            if self.coarse_solver is not None:
+                self.coarse_solver()
             for i in range(self.coarsest_level_iter):
-                self.stepper(self.f_1, self.f_2, self.f_4, self.defect_correction)
+                self.smooth()
 
         # post-smooth
         for i in range(self.v2):
-            if i == 0:
-                self.stepper(
-                    self.f_1, self.f_2, self.f_4, self.defect_correction, f_3_uninitialized=True
-                )
-            else:
-                self.stepper(self.f_1, self.f_2, self.f_4, self.defect_correction)
+            self.smooth(f_3_uninitialized=(i == 0))
 
         # for calculating WUs
         benchmark_data = BenchmarkData()
@@ -284,5 +317,7 @@ class Level(Operator):
         if coarse is None:
             benchmark_data.wu += self.coarsest_level_iter * 0.25**self.level_num
 
+        if residual_norms is not None:
+            self.stepper.get_residual_norms(self.f_1, self.f_2, residual_norms, slot)
         if return_residual:
             return self.stepper.get_residual_norm(self.f_1, self.f_2)
@@ -0,0 +1,199 @@
+import warp as wp
+from xlb.experimental.multigrid_elastostatics.kernel_provider import defines_kernels
+from xlb.experimental.multigrid_elastostatics.multigrid_launch_plan import launch
+
+
+class LoadSteppingSolver:
+    """
+    Driver for quasi-static load stepping with a MultigridSolver
+
+    A sequence of problems whose force loads depend smoothly on a load parameter s (e.g. the load
+        factor of incremental loading, or a design parameter) is solved on one hierarchy of
+        levels (see MultigridSolver.set_force). The converged solutions of the last order + 1
+        steps are kept on the device, and every step starts from the polynomial extrapolation of
+        them to its load parameter (Lagrange interpolation in s, of degree order or lower while
+        fewer steps are available) instead of from zero populations.
+    The populations depend linearly on the force load, so for loads linear (quadratic) in s,
+        linear (quadratic) extrapolation already reproduces the solution up to the tolerance of
+        the previous solves.
+    The boundary conditions of the solver stay the same for all steps.
+    """
+
+    @defines_kernels
+    def __init__(self, solver, order=2, baseline_cycles=None):
+        """
+        solver: MultigridSolver the steps are solved with
+        order: degree of the extrapolation (0: previous solution, 1: linear, 2: quadratic)
+        baseline_cycles: number of cycles a solve from zero populations needs, the cycles saved
+            by a step are reported relative to it (defaults to the cycles of the first step,
+            which starts from zero populations)
+        """
+        self.solver = solver
+        self.order = order
+        self.baseline_cycles = baseline_cycles
+        # converged solutions of the last steps (oldest first), with their load parameters
+        self.history = list()
+        self.load_parameters = list()
+        # fields of dropped solutions, reused for the next ones
+        self._free_fields = list()
+
+        level = solver.get_finest_level()
+        store_dtype = level.store_dtype
+        compute_dtype = level.compute_dtype
+
+        @wp.kernel
+        def extrapolate_kernel(
+            w_0: compute_dtype,
+            f_0: wp.array1d(dtype=store_dtype),
+            w_1: compute_dtype,
+            f_1: wp.array1d(dtype=store_dtype),
+            w_2: compute_dtype,
+            f_2: wp.array1d(dtype=store_dtype),
+            out: wp.array1d(dtype=store_dtype),
+        ):
+            """
+            Exits with:
+                w_0 * f_0 + w_1 * f_1 + w_2 * f_2 written to out
+            """
+            n = wp.tid()
+            out[n] = store_dtype(
+                w_0 * compute_dtype(f_0[n])
+                + w_1 * compute_dtype(f_1[n])
+                + w_2 * compute_dtype(f_2[n])
+            )
+
+        self.extrapolate_kernel = extrapolate_kernel
+
+    def get_weights(self, load_parameter):
+        """
+        Returns the weights of the stored solutions in the extrapolation to load_parameter
+            (Lagrange basis polynomials of the stored load parameters)
+        """
+        weights = list()
+        for i, s_i in enumerate(self.load_parameters):
+            weight = 1.0
+            for j, s_j in enumerate(self.load_parameters):
+                if j != i:
+                    assert s_i != s_j, "load parameters of stored solutions have to differ"
+                    weight *= (load_parameter - s_j) / (s_i - s_j)
+            weights.append(weight)
+        return weights
+
+    def predict(self, load_parameter):
+        """
+        Writes the initial guess of the step with load parameter load_parameter to f_1 of the
+            finest level (f_1 is left unchanged if no solution is stored yet)
+
+        returns:
+            number of stored solutions the initial guess was extrapolated from
+        """
+        if not self.history:
+            return 0
+        level = self.solver.get_finest_level()
+        f = level.f_1
+        fields = [field.flatten() for field in self.history]
+        weights = self.get_weights(load_parameter)
+        # unused terms of the three-term kernel
+        while len(fields) < 3:
+            fields.append(fields[0])
+            weights.append(0.0)
+        launch(
+            self.extrapolate_kernel,
+            inputs=[
+                weights[0],
+                fields[0],
+                weights[1],
+                fields[1],
+                weights[2],
+                fields[2],
+                f.flatten(),
+            ],
+            dim=f.size,
+        )
+        if level.f_4 is not None:
+            # the BC of the first smoothing step read the previous post-collision populations,
+            # which have to belong to the initial guess (as the zero ones to zero populations)
+            level.stepper.collide(f, level.f_4)
+        return len(self.history)
+
+    def record(self, load_parameter):
+        """
+        Stores the solution in f_1 of the finest level as converged solution of load parameter
+            load_parameter (drops the oldest one if order + 1 solutions are stored)
+        """
+        level = self.solver.get_finest_level()
+        if len(self.history) == self.order + 1:
+            self._free_fields.append(self.history.pop(0))
+            self.load_parameters.pop(0)
+        field = self._free_fields.pop() if self._free_fields else level.create_field()
+        launch(
+            level.copy_populations,
+            inputs=[level.f_1, field, field.shape[0]],
+            dim=field.shape[1:],
+        )
+        self.history.append(field)
+        self.load_parameters.append(load_parameter)
+
+    def step(self, load_parameter, force_load, tol, max_cycles, check_every=1):
+        """
+        Solves the problem with force load force_load, starting from the extrapolated solutions of
+            the previous steps
+
+        load_parameter: load parameter s of the step
+        force_load: force load of the step (see MultigridSolver.set_force)
+        tol, max_cycles, check_every: see MultigridSolver.solve (check_every defaults to 1, so
+            the cycles saved are not hidden by cycles performed after convergence)
+
+        Exits with:
+            solution of the step written to f_1 of the finest level and stored for the next steps
+
+        returns:
+            dict of MultigridSolver.solve with additionally
+            "load_parameter": load parameter of the step
+            "extrapolated_from": number of previous solutions the initial guess was extrapolated
+                from (0: zero populations)
+            "cycles_saved": cycles saved with respect to the baseline (see __init__),
+                None while no baseline is known
+        """
+        self.solver.set_force(force_load)
+        extrapolated_from = self.predict(load_parameter)
+        result = self.solver.solve(tol, max_cycles, check_every=check_every)
+        self.record(load_parameter)
+
+        if extrapolated_from == 0 and self.baseline_cycles is None and result["converged"]:
+            self.baseline_cycles = result["cycles"]
+        result["load_parameter"] = load_parameter
+        result["extrapolated_from"] = extrapolated_from
+        result["cycles_saved"] = (
+            None if self.baseline_cycles is None else self.baseline_cycles - result["cycles"]
+        )
+        return result
+
+    def run(self, load_parameters, get_force_load, tol, max_cycles, check_every=1):
+        """
+        Performs a step for every load parameter in load_parameters
+
+        get_force_load: callable returning the force load of a load parameter
+
+        returns:
+            list with the results of the steps (see step)
+        """
+        return [
+            self.step(s, get_force_load(s), tol, max_cycles, check_every) for s in load_parameters
+        ]
+
+    def reset(self):
+        """
+        Forgets the stored solutions, the next step starts from zero populations again
+        """
+        self._free_fields += self.history
+        self.history = list()
+        self.load_parameters = list()
+
+    def free(self):
+        """
+        Free device memory of the stored solutions (the solver is not freed)
+        """
+        self.history = list()
+        self.load_parameters = list()
+        self._free_fields = list()
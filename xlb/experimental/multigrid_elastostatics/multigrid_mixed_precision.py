@@ -0,0 +1,199 @@
+import warp as wp
+from xlb.precision_policy import PrecisionPolicy
+from xlb.experimental.multigrid_elastostatics.multigrid_solver import MultigridSolver
+from xlb.experimental.multigrid_elastostatics.multigrid_launch_plan import launch
+
+
+class MixedPrecisionSolver:
+    """
+    Multigrid solver using mixed-precision iterative refinement
+
+    Two hierarchies of levels are set up: an outer solver in high precision (e.g. FP64) holding
+        the solution, and a homogeneous inner solver in low precision (e.g. FP32 or FP32FP16)
+        solving for corrections. One refinement step
+        1. computes the residual of the solution in high precision (with BC, the residual of the
+            steady state, using the post-collision populations of the solution as previous ones),
+        2. scales it by its Linf norm and hands it to the inner solver as defect correction,
+        3. performs inner_cycles low precision cycles on the correction, starting from zero,
+        4. adds the rescaled correction to the solution in high precision,
+        5. performs one high precision smoothing step (updates the previous post-collision
+            populations needed by the BC)
+    The scaling keeps the correction in the range of the low precision format, so the solution
+        converges to high precision accuracy although all cycles run in low precision.
+    solve switches to high precision cycles if a refinement step stagnates.
+    """
+
+    def __init__(
+        self,
+        inner_precision_policy=PrecisionPolicy.FP32FP32,
+        precision_policy=PrecisionPolicy.FP64FP64,
+        **solver_kwargs,
+    ):
+        """
+        inner_precision_policy: precision of the inner solver (cycles on the correction)
+        precision_policy: precision of the outer solver (residual, solution update)
+        solver_kwargs: arguments of MultigridSolver (see there), used for both solvers
+        """
+        self.outer = MultigridSolver(precision_policy=precision_policy, **solver_kwargs)
+        self.inner = MultigridSolver(
+            precision_policy=inner_precision_policy, homogeneous=True, **solver_kwargs
+        )
+        self.dt = self.outer.dt
+
+        outer_store_dtype = precision_policy.store_precision.wp_dtype
+        inner_store_dtype = inner_precision_policy.store_precision.wp_dtype
+        norm_reduction = self.outer.get_finest_level().stepper.norm_reduction
+        self.norm_reduction = norm_reduction
+        self._residual_norms = norm_reduction.create_output()
+
+        @wp.kernel
+        def scatter_residual(
+            residual: wp.array4d(dtype=outer_store_dtype),
+            norms: wp.array2d(dtype=norm_reduction.stats_vec),
+            defect_correction: wp.array4d(dtype=inner_store_dtype),
+        ):
+            """
+            Hands the residual to the inner solver
+
+            residual: grid with high precision residual
+            norms: norms of residual (see NormReduction)
+            defect_correction: grid with arbitrary values
+
+            Exits with:
+                residual divided by its Linf norm written to defect_correction
+            """
+            i, j, k = wp.tid()
+            scale = norms[0, k][1]
+            for l in range(residual.shape[0]):
+                if scale > outer_store_dtype(0.0):
+                    defect_correction[l, i, j, k] = inner_store_dtype(residual[l, i, j, k] / scale)
+                else:
+                    defect_correction[l, i, j, k] = inner_store_dtype(0.0)
+
+        @wp.kernel
+        def add_correction(
+            f: wp.array4d(dtype=outer_store_dtype),
+            correction: wp.array4d(dtype=inner_store_dtype),
+            norms: wp.array2d(dtype=norm_reduction.stats_vec),
+        ):
+            """
+            Adds the correction of the inner solver to the solution
+
+            f: grid with high precision pre-collision populations
+            correction: grid with correction computed by inner solver
+            norms: norms of residual the correction was computed for (see NormReduction)
+
+            Exits with:
+                correction multiplied by Linf norm of residual added to f
+            """
+            i, j, k = wp.tid()
+            scale = norms[0, k][1]
+            for l in range(f.shape[0]):
+                f[l, i, j, k] += outer_store_dtype(correction[l, i, j, k]) * scale
+
+        self.scatter_residual = scatter_residual
+        self.add_correction = add_correction
+
+    def refine(self, inner_cycles=1):
+        """
+        Performs one refinement step (see class description) with inner_cycles low precision cycles
+        """
+        finest_level = self.outer.get_finest_level()
+        inner_level = self.inner.get_finest_level()
+
+        if finest_level.f_4 is not None:
+            # residual of the steady state, where the previous post-collision populations
+            # are the post-collision populations of the solution itself
+            finest_level.stepper.collide(finest_level.f_1, finest_level.f_4)
+        finest_level.get_residual(
+            finest_level.f_1, finest_level.f_3, finest_level.defect_correction
+        )
+        self.norm_reduction.field_norms(finest_level.f_3, self._residual_norms)
+        launch(
+            self.scatter_residual,
+            inputs=[finest_level.f_3, self._residual_norms, inner_level.defect_correction],
+            dim=inner_level.f_1.shape[1:],
+        )
+        # the correction starts from zero (as do its previous post-collision populations)
+        for f in (inner_level.f_1, inner_level.f_4):
+            if f is not None:
+                launch(inner_level.set_population_zero, inputs=[f, f.shape[0]], dim=f.shape[1:])
+        for i in range(inner_cycles):
+            self.inner.start_cycle()
+        launch(
+            self.add_correction,
+            inputs=[finest_level.f_1, inner_level.f_1, self._residual_norms],
+            dim=finest_level.f_1.shape[1:],
+        )
+        finest_level.smooth(f_3_uninitialized=True)
+
+    def get_residual_norm(self):
+        """
+        Returns L2 norm of the high precision residual (synchronizes with the device)
+        """
+        finest_level = self.outer.get_finest_level()
+        return finest_level.stepper.get_residual_norm(finest_level.f_1, finest_level.f_2)
+
+    def get_macroscopics(self, output_array):
+        """
+        Get macroscopic quantities of the high precision solution (see MultigridSolver)
+        """
+        self.outer.get_macroscopics(output_array)
+
+    def solve(self, tol, max_cycles, inner_cycles=2, stagnation_factor=0.5):
+        """
+        Performs refinement steps until the residual is converged or max_cycles is reached
+
+        As long as every refinement step reduces the residual by at least stagnation_factor,
+            the cycles run in low precision. Once a step stagnates, the remaining cycles are
+            performed by the high precision solver.
+
+        tol: tolerance for L2 norm of residual divided by dt (as in MultigridSolver.solve)
+        max_cycles: maximum number of cycles (low and high precision)
+        inner_cycles: number of low precision cycles per refinement step
+        stagnation_factor: minimum residual reduction of a refinement step
+
+        returns:
+            dict with
+            "converged": True if the residual reached tol
+            "low_precision_cycles", "high_precision_cycles": number of cycles performed
+            "residual_norms": L2 norm of residual after every refinement step / high precision cycle
+        """
+        threshold = tol * self.dt
+        low_precision_cycles = 0
+        high_precision_cycles = 0
+        residual_norms = list()
+        low_precision = True
+        converged = False
+        while low_precision_cycles + high_precision_cycles < max_cycles:
+            if low_precision:
+                self.refine(inner_cycles)
+                low_precision_cycles += inner_cycles
+            else:
+                self.outer.start_cycle()
+                high_precision_cycles += 1
+            residual_norms.append(self.get_residual_norm())
+
+            if residual_norms[-1] < threshold:
+                converged = True
+                break
+            if (
+                low_precision
+                and len(residual_norms) > 1
+                and residual_norms[-1] > stagnation_factor * residual_norms[-2]
+            ):
+                low_precision = False
+
+        return {
+            "converged": converged,
+            "low_precision_cycles": low_precision_cycles,
+            "high_precision_cycles": high_precision_cycles,
+            "residual_norms": residual_norms,
+        }
+
+    def free(self):
+        """
+        Free device memory of both solvers
+        """
+        self.outer.free()
+        self.inner.free()
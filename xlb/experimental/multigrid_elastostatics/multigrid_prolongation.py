@@ -1,16 +1,27 @@
 from xlb.operator import Operator
 from xlb.experimental.multigrid_elastostatics.kernel_provider import KernelProvider
+from xlb.experimental.multigrid_elastostatics.solid_simulation_params import get_context
 from xlb.compute_backend import ComputeBackend
+from xlb.experimental.multigrid_elastostatics.multigrid_launch_plan import launch
 import warp as wp
 
 
 class Prolongation(Operator):
     def __init__(
         self,
+        moment_storage=False,
         velocity_set=None,
         precision_policy=None,
         compute_backend=None,
+        params=None,
     ):
+        """
+        moment_storage: if True, fine and coarse grids hold moments instead of populations,
+            so the interpolation is done without transforms
+        params: ParameterContext of the material (defaults to the current SimulationParams)
+        """
+        self.moment_storage = moment_storage
+        self.params = get_context(params)
         super().__init__(
             velocity_set=velocity_set,
             precision_policy=precision_policy,
@@ -18,7 +29,7 @@ class Prolongation(Operator):
         )
 
     def _construct_warp(self):
-        kernel_provider = KernelProvider()
+        kernel_provider = KernelProvider(self.precision_policy, self.params)
         vec = kernel_provider.vec
         calc_moments = kernel_provider.calc_moments
         calc_equilibrium = kernel_provider.calc_equilibrium
@@ -26,13 +37,22 @@ class Prolongation(Operator):
         write_population_to_global = kernel_provider.write_population_to_global
         read_local_population = kernel_provider.read_local_population
         zero_vec = kernel_provider.zero_vec
+        active_node = kernel_provider.active_node
+
+        # interpolation is done on moments
+        if self.moment_storage:
+            to_moments = kernel_provider.identity
+            from_moments = kernel_provider.identity
+        else:
+            to_moments = calc_moments
+            from_moments = calc_populations
 
         @wp.func
         def functional(f_a: vec, f_b: vec, f_c: vec, f_d: vec):
-            m_a = calc_moments(f_a)
-            m_b = calc_moments(f_b)
-            m_c = calc_moments(f_c)
-            m_d = calc_moments(f_d)
+            m_a = to_moments(f_a)
+            m_b = to_moments(f_b)
+            m_c = to_moments(f_c)
+            m_d = to_moments(f_d)
 
             m_out = self.compute_dtype(0.25) * (m_a + m_b + m_c + m_d)
 
@@ -47,7 +67,7 @@ class Prolongation(Operator):
             m_out[7] = self.compute_dtype(0.5) * m_out[7]
             m_out[8] = self.compute_dtype(1) * m_out[8]
 
-            f_out = calc_populations(m_out)
+            f_out = from_moments(m_out)
 
             return f_out
 
@@ -66,17 +86,18 @@ class Prolongation(Operator):
             res_i = i - coarse_i * 2
             res_j = j - coarse_j * 2
 
-            _f_a = read_local_population(coarse, coarse_i, coarse_j)
+            _f_a = read_local_population(coarse, coarse_i, coarse_j, k)
             _f_b = read_local_population(
-                coarse, wp.mod(coarse_i + 1 + coarse_nodes_x, coarse_nodes_x), coarse_j
+                coarse, wp.mod(coarse_i + 1 + coarse_nodes_x, coarse_nodes_x), coarse_j, k
             )
             _f_c = read_local_population(
-                coarse, coarse_i, wp.mod(coarse_j + 1 + coarse_nodes_y, coarse_nodes_y)
+                coarse, coarse_i, wp.mod(coarse_j + 1 + coarse_nodes_y, coarse_nodes_y), k
             )
             _f_d = read_local_population(
                 coarse,
                 wp.mod(coarse_i + 1 + coarse_nodes_x, coarse_nodes_x),
                 wp.mod(coarse_j + 1 + coarse_nodes_y, coarse_nodes_y),
+                k,
             )
 
             if res_i == 0 and res_j == 0:
@@ -88,12 +109,12 @@ class Prolongation(Operator):
             else:
                 _error_approx = functional(f_a=_f_a, f_b=_f_b, f_c=_f_c, f_d=_f_d)
 
-            _f_old = read_local_population(fine, i, j)
+            _f_old = read_local_population(fine, i, j, k)
             _f_out = vec()
             for l in range(self.velocity_set.q):
                 _f_out[l] = _f_old[l] + _error_approx[l]
 
-            write_population_to_global(fine, _f_out, i, j)
+            write_population_to_global(fine, _f_out, i, j, k)
 
         @wp.kernel
         def kernel_with_bc(
@@ -102,8 +123,12 @@ class Prolongation(Operator):
             coarse_nodes_x: wp.int32,
             coarse_nodes_y: wp.int32,
             coarse_boundary_array: wp.array4d(dtype=wp.int8),
+            row_spans: wp.array2d(dtype=wp.int32),
         ):
-            i, j, k = wp.tid()
+            i, t, k = wp.tid()
+            j = active_node(row_spans, i, t)
+            if j < 0:
+                return
 
             coarse_i = i / 2
             coarse_j = j / 2  # rounds down
@@ -111,17 +136,18 @@ class Prolongation(Operator):
             res_i = i - coarse_i * 2
             res_j = j - coarse_j * 2
 
-            _f_a = read_local_population(coarse, coarse_i, coarse_j)
+            _f_a = read_local_population(coarse, coarse_i, coarse_j, k)
             _f_b = read_local_population(
-                coarse, wp.mod(coarse_i + 1 + coarse_nodes_x, coarse_nodes_x), coarse_j
+                coarse, wp.mod(coarse_i + 1 + coarse_nodes_x, coarse_nodes_x), coarse_j, k
             )
             _f_c = read_local_population(
-                coarse, coarse_i, wp.mod(coarse_j + 1 + coarse_nodes_y, coarse_nodes_y)
+                coarse, coarse_i, wp.mod(coarse_j + 1 + coarse_nodes_y, coarse_nodes_y), k
             )
             _f_d = read_local_population(
                 coarse,
                 wp.mod(coarse_i + 1 + coarse_nodes_x, coarse_nodes_x),
                 wp.mod(coarse_j + 1 + coarse_nodes_y, coarse_nodes_y),
+                k,
             )
 
             # check for boundary
@@ -152,28 +178,43 @@ class Prolongation(Operator):
             else:
                 _error_approx = functional(f_a=_f_a, f_b=_f_b, f_c=_f_c, f_d=_f_d)
 
-            _f_old = read_local_population(fine, i, j)
+            _f_old = read_local_population(fine, i, j, k)
             _f_out = vec()
             for l in range(self.velocity_set.q):
                 _f_out[l] = _f_old[l] + _error_approx[l]
 
-            write_population_to_global(fine, _f_out, i, j)
+            write_population_to_global(fine, _f_out, i, j, k)
 
         return functional, (kernel_no_bc, kernel_with_bc)
 
     @Operator.register_backend(ComputeBackend.WARP)
-    def warp_implementation(self, fine, coarse, coarse_boundary_array=None):
+    def warp_implementation(self, fine, coarse, coarse_boundary_array=None, active_cells=None):
+        """
+        Prolongates the error approximation on coarse and adds it to fine
+
+        fine: fine grid with pre-collision populations
+        coarse: coarse grid with the error approximation
+        coarse_boundary_array: boundary info of coarse (only for BC)
+        active_cells: ActiveCells of the fine grid, the nodes to update (only for BC)
+        """
         coarse_nodes_x = coarse.shape[1]
         coarse_nodes_y = coarse.shape[2]
         if coarse_boundary_array is None:
-            wp.launch(
+            launch(
                 self.warp_kernel[0],
                 inputs=[fine, coarse, coarse_nodes_x, coarse_nodes_y],
                 dim=fine.shape[1:],
             )
         else:
-            wp.launch(
+            launch(
                 self.warp_kernel[1],
-                inputs=[fine, coarse, coarse_nodes_x, coarse_nodes_y, coarse_boundary_array],
-                dim=fine.shape[1:],
+                inputs=[
+                    fine,
+                    coarse,
+                    coarse_nodes_x,
+                    coarse_nodes_y,
+                    coarse_boundary_array,
+                    active_cells.row_spans,
+                ],
+                dim=active_cells.dim,
             )
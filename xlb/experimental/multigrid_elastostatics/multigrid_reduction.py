@@ -0,0 +1,286 @@
+from xlb.operator import Operator
+from xlb.experimental.multigrid_elastostatics.kernel_provider import KernelProvider
+from xlb.experimental.multigrid_elastostatics.solid_simulation_params import get_context
+from xlb.compute_backend import ComputeBackend
+from xlb.experimental.multigrid_elastostatics.multigrid_launch_plan import launch
+import warp as wp
+
+
+class NormReduction(Operator):
+    """
+    Operator for computing norms of population fields (e.g. residuals) on the device
+
+    The reduction is done in two stages without atomics:
+        1. every thread of a first-pass kernel accumulates the statistics of block_size
+            consecutive lattice nodes into one entry of a partials array
+            (see field_kernel, or the residual norm kernels of MultigridStepper)
+        2. the partials are combined block-wise in a tree of launches until one entry is left,
+            which is normalised and written to a slot of a device output buffer
+    One entry of the statistics/output vector holds
+        [0]: L2 norm of populations (normalised by number of populations and nodes)
+        [1]: Linf norm of populations
+        [2:]: L2 norm of each moment (normalised by number of nodes, see kernel_provider.py)
+    The output buffer is never read back by the reduction itself, so norms of several cycles can be
+    recorded before the host reads them (see read)
+    Fields holding a batch of load cases along their last index k are reduced per load case: the
+    partials, the reduction tree and the output buffer get a batch axis, and all load cases are
+    reduced by the same launches
+    """
+
+    def __init__(
+        self,
+        block_size=256,
+        velocity_set=None,
+        precision_policy=None,
+        compute_backend=None,
+        params=None,
+    ):
+        """
+        block_size: number of lattice nodes / partials combined by one thread
+        params: ParameterContext of the material (defaults to the current SimulationParams)
+        """
+        self.block_size = block_size
+        self.params = get_context(params)
+        super().__init__(
+            velocity_set=velocity_set,
+            precision_policy=precision_policy,
+            compute_backend=compute_backend,
+        )
+        self.num_stats = self.velocity_set.q + 2
+        self._scratch = {}
+
+    def _construct_warp(self):
+        kernel_provider = KernelProvider(self.precision_policy, self.params)
+        vec = kernel_provider.vec
+        read_local_population = kernel_provider.read_local_population
+        calc_moments = kernel_provider.calc_moments
+
+        q = self.compute_dtype(self.velocity_set.q)
+        stats_vec = wp.vec(self.velocity_set.q + 2, dtype=self.compute_dtype)
+        self.stats_vec = stats_vec
+
+        @wp.func
+        def functional(stats: stats_vec, r: vec):
+            """
+            Adds the populations r of one lattice node to the statistics stats
+
+            returns:
+                updated statistics
+            """
+            _m = calc_moments(r)
+            _stats = stats
+            for l in range(self.velocity_set.q):
+                _stats[0] += r[l] * r[l]
+                _stats[1] = wp.max(_stats[1], wp.abs(r[l]))
+                _stats[l + 2] += _m[l] * _m[l]
+            return _stats
+
+        @wp.func
+        def combine(a: stats_vec, b: stats_vec):
+            _stats = a + b
+            _stats[1] = wp.max(a[1], b[1])
+            return _stats
+
+        @wp.kernel
+        def field_kernel(
+            f: wp.array4d(dtype=self.store_dtype),
+            partials: wp.array2d(dtype=stats_vec),
+            block_size: wp.int32,
+        ):
+            """
+            First pass of the reduction for a population field
+
+            f: grid with populations
+            partials: array with arbitrary values, one row per load case and one entry per block
+                of nodes
+            block_size: number of nodes per block
+
+            Exits with:
+                statistics of each block of load case k written to partials[k]
+            """
+            k, b = wp.tid()
+            nodes_y = f.shape[2]
+            num_nodes = f.shape[1] * nodes_y
+
+            _stats = stats_vec()
+            for n in range(b * block_size, wp.min((b + 1) * block_size, num_nodes)):
+                _stats = functional(_stats, read_local_population(f, n // nodes_y, n % nodes_y, k))
+            partials[k, b] = _stats
+
+        @wp.kernel
+        def combine_kernel(
+            partials_in: wp.array2d(dtype=stats_vec),
+            partials_out: wp.array2d(dtype=stats_vec),
+            num_partials: wp.int32,
+            block_size: wp.int32,
+        ):
+            """
+            One stage of the reduction tree
+
+            Exits with:
+                each block of block_size entries of a row of partials_in combined into the same
+                row of partials_out
+            """
+            k, b = wp.tid()
+            _stats = stats_vec()
+            for n in range(b * block_size, wp.min((b + 1) * block_size, num_partials)):
+                _stats = combine(_stats, partials_in[k, n])
+            partials_out[k, b] = _stats
+
+        @wp.kernel
+        def finalize_kernel(
+            partials: wp.array2d(dtype=stats_vec),
+            output: wp.array2d(dtype=stats_vec),
+            slot: wp.int32,
+            num_nodes: wp.int32,
+        ):
+            """
+            Last stage of the reduction, turns the combined statistics into norms
+
+            Exits with:
+                norms of load case k written to output[slot, k]
+            """
+            k = wp.tid()
+            _stats = partials[k, 0]
+            _norms = stats_vec()
+            _norms[0] = wp.sqrt(_stats[0] / (q * self.compute_dtype(num_nodes)))
+            _norms[1] = _stats[1]
+            for l in range(self.velocity_set.q):
+                _norms[l + 2] = wp.sqrt(_stats[l + 2] / self.compute_dtype(num_nodes))
+            output[slot, k] = _norms
+
+        @wp.kernel
+        def convergence_kernel(
+            output: wp.array2d(dtype=stats_vec),
+            slot: wp.int32,
+            cycle: wp.int32,
+            threshold: self.compute_dtype,
+            converged_cycle: wp.array1d(dtype=wp.int32),
+        ):
+            """
+            Convergence check on the device
+
+            output: device buffer with norms
+            slot: entry of output to check
+            cycle: number of the cycle the norms in output[slot] belong to
+            threshold: L2 norm below which the residual counts as converged
+            converged_cycle: array with one entry per load case, negative if not yet converged
+
+            Exits with:
+                cycle written to converged_cycle[k] if this is the first converged cycle of load
+                case k
+            """
+            k = wp.tid()
+            if converged_cycle[k] < 0 and output[slot, k][0] < threshold:
+                converged_cycle[k] = cycle
+
+        self.field_kernel = field_kernel
+        self.combine_kernel = combine_kernel
+        self.finalize_kernel = finalize_kernel
+        self.convergence_kernel = convergence_kernel
+
+        return functional, (field_kernel, combine_kernel, finalize_kernel, convergence_kernel)
+
+    def get_num_partials(self, num_entries):
+        """
+        Number of partials produced by a pass over num_entries nodes / partials
+        """
+        return (num_entries + self.block_size - 1) // self.block_size
+
+    def get_partials(self, num_nodes, batch_size=1):
+        """
+        Returns the (cached) device array a first-pass kernel over num_nodes nodes of batch_size
+        load cases writes to (launched with dim partials.shape)
+        """
+        return self._get_scratch(batch_size, self.get_num_partials(num_nodes), 0)
+
+    def _get_scratch(self, batch_size, size, index):
+        key = (batch_size, size, index)
+        if key not in self._scratch:
+            self._scratch[key] = wp.zeros(shape=(batch_size, size), dtype=self.stats_vec)
+        return self._scratch[key]
+
+    def create_output(self, num_slots=1, batch_size=1):
+        """
+        Allocates a device buffer for num_slots sets of norms of batch_size load cases
+        """
+        return wp.zeros(shape=(num_slots, batch_size), dtype=self.stats_vec)
+
+    def field_norms(self, f, output, slot=0):
+        """
+        Computes the norms of a population field
+
+        f: grid with populations
+        output: device buffer created by create_output
+        slot: entry of output to write to
+
+        Exits with:
+            norms of f written to output[slot] (without synchronizing with the host)
+        """
+        num_nodes = f.shape[1] * f.shape[2]
+        partials = self.get_partials(num_nodes, f.shape[3])
+        launch(
+            self.field_kernel,
+            inputs=[f, partials, self.block_size],
+            dim=partials.shape,
+        )
+        return self(partials, num_nodes, output, slot)
+
+    @Operator.register_backend(ComputeBackend.WARP)
+    def warp_implementation(self, partials, num_nodes, output, slot=0):
+        """
+        Combines the partials of a first-pass kernel into norms
+
+        partials: array filled by a first-pass kernel (see get_partials)
+        num_nodes: number of lattice nodes the first pass was launched for
+        output: device buffer created by create_output
+        slot: entry of output to write to
+
+        Exits with:
+            norms written to output[slot] (without synchronizing with the host)
+        """
+        stage = 1
+        batch_size, num_partials = partials.shape
+        while num_partials > 1:
+            num_out = self.get_num_partials(num_partials)
+            partials_out = self._get_scratch(batch_size, num_out, stage)
+            launch(
+                self.combine_kernel,
+                inputs=[partials, partials_out, num_partials, self.block_size],
+                dim=(batch_size, num_out),
+            )
+            partials = partials_out
+            num_partials = num_out
+            stage += 1
+        launch(self.finalize_kernel, inputs=[partials, output, slot, num_nodes], dim=batch_size)
+        return output
+
+    def check_convergence(self, output, slot, cycle, threshold, converged_cycle):
+        """
+        Queues a convergence check of output[slot] (see convergence_kernel),
+        without synchronizing with the host
+        """
+        launch(
+            self.convergence_kernel,
+            inputs=[output, slot, cycle, threshold, converged_cycle],
+            dim=converged_cycle.shape[0],
+        )
+
+    def read(self, output):
+        """
+        Copies norms from a device buffer to the host (synchronizes with the device)
+
+        returns:
+            dict with numpy arrays "l2", "linf" (one value per slot)
+            and "moments" (one row of moment norms per slot)
+            (for a batch of several load cases, with an additional axis over the load cases
+            after the slot axis)
+        """
+        host_output = output.numpy()
+        if host_output.shape[1] == 1:
+            host_output = host_output[:, 0]
+        return {
+            "l2": host_output[..., 0],
+            "linf": host_output[..., 1],
+            "moments": host_output[..., 2:],
+        }
@@ -0,0 +1,405 @@
+from xlb.operator import Operator
+from xlb.experimental.multigrid_elastostatics.kernel_provider import KernelProvider
+from xlb.compute_backend import ComputeBackend
+from xlb.experimental.multigrid_elastostatics.multigrid_launch_plan import launch
+import warp as wp
+
+
+class Residual(Operator):
+    """
+    Operator computing the residual of a multigrid level in a single kernel launch
+
+    The residual r = defect_correction + f - S(f), where S is one undamped smoothing step
+        without defect correction, is computed directly from f, the force and the
+        defect correction. Collision and streaming of S are done in registers
+        (see MultigridStepper.warp_functional), so f is left unchanged.
+    Optionally the residual is restricted to a coarser grid in the same kernel.
+    If the stepper stores moments (moment_storage), f, the defect correction and the residual
+        are moment fields.
+    """
+
+    def __init__(
+        self,
+        stepper,
+        velocity_set=None,
+        precision_policy=None,
+        compute_backend=None,
+    ):
+        """
+        stepper: MultigridStepper of the level, providing the collision, boundary
+            and bared moment functionals as well as omega and the force
+        """
+        self.stepper = stepper
+        super().__init__(
+            velocity_set=velocity_set,
+            precision_policy=precision_policy,
+            compute_backend=compute_backend,
+        )
+
+    def _construct_warp(self):
+        kernel_provider = KernelProvider(self.precision_policy, self.stepper.params)
+        boundary_values_struct = kernel_provider.boundary_values_struct
+        vec = kernel_provider.vec
+        read_local_population = kernel_provider.read_local_population
+        write_population_to_global = kernel_provider.write_population_to_global
+        zero_vec = kernel_provider.zero_vec
+        active_node = kernel_provider.active_node
+
+        pull_post_collision = self.stepper.warp_functional
+        collision = self.stepper.collision.functional_stored
+        to_state = self.stepper.to_state
+        to_populations = self.stepper.to_populations
+        boundaries = self.stepper.boundaries.warp_functional
+        bared_moments = self.stepper.bared_moments.warp_functional
+
+        @wp.func
+        def functional_no_bc(
+            f: wp.array4d(dtype=self.store_dtype),
+            defect_correction: wp.array4d(dtype=self.store_dtype),
+            force: wp.array4d(dtype=self.store_dtype),
+            i: wp.int32,
+            j: wp.int32,
+            k: wp.int32,
+            omega: vec,
+            theta: self.compute_dtype,
+        ):
+            """
+            Functional for computing the residual at lattice point (i,j,k) (with periodic BC)
+
+            f: grid with pre-collision populations
+            defect_correction: grid with defect correction populations
+            force: grid with forcing terms
+            i, j: indices of lattice point
+            k: index of load case
+            omega: vector of relaxation rates
+            theta: lattice parameter
+
+            returns:
+                vector with residual at lattice point
+            """
+            _f_pre_collision = read_local_population(f, i, j, k)
+            _f_post_stream = to_state(
+                pull_post_collision(f, force, wp.vec3i(i, j, k), omega, theta)
+            )
+            _f_out = read_local_population(defect_correction, i, j, k)
+            for l in range(self.velocity_set.q):
+                _f_out[l] += _f_pre_collision[l] - _f_post_stream[l]
+            return _f_out
+
+        @wp.func
+        def functional_with_bc(
+            f: wp.array4d(dtype=self.store_dtype),
+            f_previous_post_collision: wp.array4d(dtype=self.store_dtype),
+            defect_correction: wp.array4d(dtype=self.store_dtype),
+            force: wp.array4d(dtype=self.store_dtype),
+            boundary_info: wp.array4d(dtype=wp.int8),
+            boundary_vals: boundary_values_struct,
+            i: wp.int32,
+            j: wp.int32,
+            k: wp.int32,
+            omega: vec,
+            K: self.compute_dtype,
+            mu: self.compute_dtype,
+            theta: self.compute_dtype,
+        ):
+            """
+            Functional for computing the residual at lattice point (i,j,k) (with Dirichlet/VN BC)
+
+            f: grid with pre-collision populations
+            f_previous_post_collision: grid with post-collision populations of previous step
+            defect_correction: grid with defect correction populations
+            force: grid with forcing terms
+            boundary_info: array encoding node type and populations to reconstruct for BC
+                (see solid_boundary.py)
+            boundary_vals: array encoding boundary values for BC
+            i, j: indices of lattice point
+            k: index of load case
+            omega: vector of relaxation rates
+            K, mu: material parameters
+            theta: lattice parameter
+
+            returns:
+                vector with residual at lattice point (zero for ghost nodes)
+            """
+            if boundary_info[0, i, j, 0] == wp.int8(0):
+                return zero_vec()
+
+            force_x = self.compute_dtype(force[0, i, j, k])
+            force_y = self.compute_dtype(force[1, i, j, k])
+
+            _f_pre_collision = read_local_population(f, i, j, k)
+            _f_post_collision = collision(_f_pre_collision, force_x, force_y, omega, theta)
+            _f_previous_post_collision = read_local_population(f_previous_post_collision, i, j, k)
+            _f_post_stream = pull_post_collision(f, force, wp.vec3i(i, j, k), omega, theta)
+            _bared_m = bared_moments(
+                f_vec=to_populations(_f_pre_collision),
+                force_x=force_x,
+                force_y=force_y,
+                omega=omega,
+                theta=theta,
+            )
+            _f_post_stream = boundaries(
+                f_post_stream_vec=_f_post_stream,
+                f_post_collision_vec=_f_post_collision,
+                f_previous_post_collision_vec=_f_previous_post_collision,
+                i=i,
+                j=j,
+                boundary_info=boundary_info,
+                boundary_vals=boundary_vals,
+                force_x=force_x,
+                force_y=force_y,
+                bared_m_vec=_bared_m,
+                K=K,
+                mu=mu,
+                theta=theta,
+            )
+            _f_post_stream = to_state(_f_post_stream)
+
+            _f_out = read_local_population(defect_correction, i, j, k)
+            for l in range(self.velocity_set.q):
+                _f_out[l] += _f_pre_collision[l] - _f_post_stream[l]
+            return _f_out
+
+        @wp.kernel
+        def kernel_no_bc(
+            f: wp.array4d(dtype=self.store_dtype),
+            defect_correction: wp.array4d(dtype=self.store_dtype),
+            force: wp.array4d(dtype=self.store_dtype),
+            residual: wp.array4d(dtype=self.store_dtype),
+            omega: vec,
+            theta: self.compute_dtype,
+        ):
+            """
+            Kernel to compute the residual (with periodic BC)
+
+            f: grid with pre-collision populations
+            defect_correction: grid with defect correction populations
+            force: grid with forcing terms
+            residual: grid with arbitrary values (must not be the same array as f)
+
+            Exits with:
+                residual written to residual
+            """
+            i, j, k = wp.tid()
+            _r = functional_no_bc(f, defect_correction, force, i, j, k, omega, theta)
+            write_population_to_global(residual, _r, i, j, k)
+
+        @wp.kernel
+        def kernel_with_bc(
+            f: wp.array4d(dtype=self.store_dtype),
+            f_previous_post_collision: wp.array4d(dtype=self.store_dtype),
+            defect_correction: wp.array4d(dtype=self.store_dtype),
+            force: wp.array4d(dtype=self.store_dtype),
+            boundary_info: wp.array4d(dtype=wp.int8),
+            boundary_vals: boundary_values_struct,
+            residual: wp.array4d(dtype=self.store_dtype),
+            omega: vec,
+            K: self.compute_dtype,
+            mu: self.compute_dtype,
+            theta: self.compute_dtype,
+        ):
+            """
+            Kernel to compute the residual (with Dirichlet/VN BC)
+
+            f: grid with pre-collision populations
+            f_previous_post_collision: grid with post-collision populations of previous step
+            defect_correction: grid with defect correction populations
+            force: grid with forcing terms
+            boundary_info, boundary_vals: boundary arrays (see solid_boundary.py)
+            residual: grid with arbitrary values (must not be the same array as f)
+
+            Exits with:
+                residual written to residual
+            """
+            i, j, k = wp.tid()
+            _r = functional_with_bc(
+                f,
+                f_previous_post_collision,
+                defect_correction,
+                force,
+                boundary_info,
+                boundary_vals,
+                i,
+                j,
+                k,
+                omega,
+                K,
+                mu,
+                theta,
+            )
+            write_population_to_global(residual, _r, i, j, k)
+
+        @wp.func
+        def restriction_weight(di: wp.int32, dj: wp.int32):
+            # full weighting, same stencil as the functional of Restriction
+            return self.compute_dtype((2 - wp.abs(di)) * (2 - wp.abs(dj))) * self.compute_dtype(
+                0.25
+            )
+
+        @wp.kernel
+        def kernel_restrict_no_bc(
+            f: wp.array4d(dtype=self.store_dtype),
+            defect_correction: wp.array4d(dtype=self.store_dtype),
+            force: wp.array4d(dtype=self.store_dtype),
+            coarse: wp.array4d(dtype=self.store_dtype),
+            omega: vec,
+            theta: self.compute_dtype,
+        ):
+            """
+            Kernel to compute the residual and restrict it to the coarse grid (with periodic BC)
+            (launched over the coarse grid, the residual of the 9-point stencil is recomputed)
+
+            f: fine grid with pre-collision populations
+            defect_correction: fine grid with defect correction populations
+            force: fine grid with forcing terms
+            coarse: coarse grid (double the grid spacing of fine), with arbitrary values
+
+            Exits with:
+                restricted residual written to coarse
+            """
+            i, j, k = wp.tid()
+            nodes_x = f.shape[1]
+            nodes_y = f.shape[2]
+
+            _f_out = zero_vec()
+            for di in range(-1, 2):
+                for dj in range(-1, 2):
+                    x = wp.mod(2 * i + di + nodes_x, nodes_x)
+                    y = wp.mod(2 * j + dj + nodes_y, nodes_y)
+                    _r = functional_no_bc(f, defect_correction, force, x, y, k, omega, theta)
+                    _f_out += restriction_weight(di, dj) * _r
+
+            write_population_to_global(coarse, _f_out, i, j, k)
+
+        @wp.kernel
+        def kernel_restrict_with_bc(
+            f: wp.array4d(dtype=self.store_dtype),
+            f_previous_post_collision: wp.array4d(dtype=self.store_dtype),
+            defect_correction: wp.array4d(dtype=self.store_dtype),
+            force: wp.array4d(dtype=self.store_dtype),
+            boundary_info: wp.array4d(dtype=wp.int8),
+            boundary_vals: boundary_values_struct,
+            coarse: wp.array4d(dtype=self.store_dtype),
+            omega: vec,
+            K: self.compute_dtype,
+            mu: self.compute_dtype,
+            theta: self.compute_dtype,
+            row_spans: wp.array2d(dtype=wp.int32),
+        ):
+            """
+            Kernel to compute the residual and restrict it to the coarse grid (with Dirichlet/VN BC)
+            (launched over the coarse grid, the residual of the 9-point stencil is recomputed;
+            ghost nodes contribute a zero residual)
+
+            f: fine grid with pre-collision populations
+            f_previous_post_collision: fine grid with post-collision populations of previous step
+            defect_correction: fine grid with defect correction populations
+            force: fine grid with forcing terms
+            boundary_info, boundary_vals: boundary arrays of fine grid (see solid_boundary.py)
+            coarse: coarse grid (double the grid spacing of fine), with arbitrary values
+            row_spans: spans of the coarse nodes to update (see ActiveCells)
+
+            Exits with:
+                restricted residual written to coarse
+            """
+            i, t, k = wp.tid()
+            j = active_node(row_spans, i, t)
+            if j < 0:
+                return
+            nodes_x = f.shape[1]
+            nodes_y = f.shape[2]
+
+            _f_out = zero_vec()
+            for di in range(-1, 2):
+                for dj in range(-1, 2):
+                    x = wp.mod(2 * i + di + nodes_x, nodes_x)
+                    y = wp.mod(2 * j + dj + nodes_y, nodes_y)
+                    _r = functional_with_bc(
+                        f,
+                        f_previous_post_collision,
+                        defect_correction,
+                        force,
+                        boundary_info,
+                        boundary_vals,
+                        x,
+                        y,
+                        k,
+                        omega,
+                        K,
+                        mu,
+                        theta,
+                    )
+                    _f_out += restriction_weight(di, dj) * _r
+
+            write_population_to_global(coarse, _f_out, i, j, k)
+
+        return (functional_no_bc, functional_with_bc), (
+            kernel_no_bc,
+            kernel_with_bc,
+            kernel_restrict_no_bc,
+            kernel_restrict_with_bc,
+        )
+
+    @Operator.register_backend(ComputeBackend.WARP)
+    def warp_implementation(
+        self,
+        f,
+        defect_correction,
+        f_previous_post_collision=None,
+        residual=None,
+        coarse=None,
+        coarse_active_cells=None,
+    ):
+        """
+        Computes the residual of the level's stepper for pre-collision populations f
+
+        f: grid with pre-collision populations
+        defect_correction: grid with defect correction populations
+        f_previous_post_collision: grid with post-collision populations of previous smoothing
+            step (only needed for BC)
+        residual: grid to write the residual to (must not be the same array as f)
+        coarse: coarse grid to write the restricted residual to (instead of residual)
+        coarse_active_cells: ActiveCells of the coarse grid, the nodes to write the restricted
+            residual to (only needed for BC)
+
+        Exits with:
+            residual written to residual, or restricted residual written to coarse
+        """
+        assert (residual is None) != (coarse is None)
+        stepper = self.stepper
+        params = stepper.params
+        theta = params.theta
+        restrict = coarse is not None
+        out = coarse if restrict else residual
+        if stepper.boundary_conditions is None:
+            launch(
+                self.warp_kernel[2] if restrict else self.warp_kernel[0],
+                inputs=[f, defect_correction, stepper.force, out, stepper.omega, theta],
+                dim=out.shape[1:],
+            )
+        else:
+            K = params.K
+            mu = params.mu
+            inputs = [
+                f,
+                f_previous_post_collision,
+                defect_correction,
+                stepper.force,
+                stepper.boundary_conditions,
+                stepper.boundary_values,
+                out,
+                stepper.omega,
+                K,
+                mu,
+                theta,
+            ]
+            if restrict:
+                launch(
+                    self.warp_kernel[3],
+                    inputs=inputs + [coarse_active_cells.row_spans],
+                    dim=coarse_active_cells.dim,
+                )
+            else:
+                # the residual is needed at all nodes (ghost nodes included, see get_residual)
+                launch(self.warp_kernel[1], inputs=inputs, dim=out.shape[1:])
+        return out
@@ -1,13 +1,24 @@
 from xlb.operator import Operator
 from xlb.experimental.multigrid_elastostatics.kernel_provider import KernelProvider
+from xlb.experimental.multigrid_elastostatics.solid_simulation_params import get_context
 from xlb.compute_backend import ComputeBackend
+from xlb.experimental.multigrid_elastostatics.multigrid_launch_plan import launch
 import warp as wp
 
 
 class Restriction(Operator):
     def __init__(
-        self, velocity_set=None, precision_policy=None, compute_backend=None, with_boundary=False
+        self,
+        velocity_set=None,
+        precision_policy=None,
+        compute_backend=None,
+        with_boundary=False,
+        params=None,
     ):
+        """
+        params: ParameterContext of the material (defaults to the current SimulationParams)
+        """
+        self.params = get_context(params)
         super().__init__(
             velocity_set=velocity_set,
             precision_policy=precision_policy,
@@ -16,7 +27,7 @@ class Restriction(Operator):
         self.with_boundary = with_boundary
 
     def _construct_warp(self):
-        kernel_provider = KernelProvider()
+        kernel_provider = KernelProvider(self.precision_policy, self.params)
         vec = kernel_provider.vec
         calc_moments = kernel_provider.calc_moments
         calc_equilibrium = kernel_provider.calc_equilibrium
@@ -63,37 +74,43 @@ class Restriction(Operator):
             """
             i, j, k = wp.tid()
 
-            _center = read_local_population(fine, 2 * i, 2 * j)
-            _up = read_local_population(fine, 2 * i, wp.mod(2 * j + 1 + fine_nodes_y, fine_nodes_y))
+            _center = read_local_population(fine, 2 * i, 2 * j, k)
+            _up = read_local_population(
+                fine, 2 * i, wp.mod(2 * j + 1 + fine_nodes_y, fine_nodes_y), k
+            )
             _down = read_local_population(
-                fine, 2 * i, wp.mod(2 * j - 1 + fine_nodes_y, fine_nodes_y)
+                fine, 2 * i, wp.mod(2 * j - 1 + fine_nodes_y, fine_nodes_y), k
             )
             _right = read_local_population(
-                fine, wp.mod(2 * i + 1 + fine_nodes_x, fine_nodes_x), 2 * j
+                fine, wp.mod(2 * i + 1 + fine_nodes_x, fine_nodes_x), 2 * j, k
             )
             _left = read_local_population(
-                fine, wp.mod(2 * i - 1 + fine_nodes_x, fine_nodes_x), 2 * j
+                fine, wp.mod(2 * i - 1 + fine_nodes_x, fine_nodes_x), 2 * j, k
             )
 
             _dia_1 = read_local_population(
                 fine,
                 wp.mod(2 * i + 1 + fine_nodes_x, fine_nodes_x),
                 wp.mod(2 * j + 1 + fine_nodes_y, fine_nodes_y),
+                k,
             )
             _dia_2 = read_local_population(
                 fine,
                 wp.mod(2 * i + 1 + fine_nodes_x, fine_nodes_x),
                 wp.mod(2 * j - 1 + fine_nodes_y, fine_nodes_y),
+                k,
             )
             _dia_3 = read_local_population(
                 fine,
                 wp.mod(2 * i - 1 + fine_nodes_x, fine_nodes_x),
                 wp.mod(2 * j + 1 + fine_nodes_y, fine_nodes_y),
+                k,
             )
             _dia_4 = read_local_population(
                 fine,
                 wp.mod(2 * i - 1 + fine_nodes_x, fine_nodes_x),
-                wp.mod(2 * j + 1 + fine_nodes_y, fine_nodes_y),
+                wp.mod(2 * j - 1 + fine_nodes_y, fine_nodes_y),
+                k,
             )
 
             _f_out = functional(
@@ -108,7 +125,7 @@ class Restriction(Operator):
                 dia_4=_dia_4,
             )
 
-            write_population_to_global(coarse, _f_out, i, j)
+            write_population_to_global(coarse, _f_out, i, j, k)
 
         @wp.kernel
         def kernel_with_bc(
@@ -132,37 +149,43 @@ class Restriction(Operator):
             i, j, k = wp.tid()
 
             # Read populations of the 9-point stencil
-            _center = read_local_population(fine, 2 * i, 2 * j)
-            _up = read_local_population(fine, 2 * i, wp.mod(2 * j + 1 + fine_nodes_y, fine_nodes_y))
+            _center = read_local_population(fine, 2 * i, 2 * j, k)
+            _up = read_local_population(
+                fine, 2 * i, wp.mod(2 * j + 1 + fine_nodes_y, fine_nodes_y), k
+            )
             _down = read_local_population(
-                fine, 2 * i, wp.mod(2 * j - 1 + fine_nodes_y, fine_nodes_y)
+                fine, 2 * i, wp.mod(2 * j - 1 + fine_nodes_y, fine_nodes_y), k
             )
             _right = read_local_population(
-                fine, wp.mod(2 * i + 1 + fine_nodes_x, fine_nodes_x), 2 * j
+                fine, wp.mod(2 * i + 1 + fine_nodes_x, fine_nodes_x), 2 * j, k
             )
             _left = read_local_population(
-                fine, wp.mod(2 * i - 1 + fine_nodes_x, fine_nodes_x), 2 * j
+                fine, wp.mod(2 * i - 1 + fine_nodes_x, fine_nodes_x), 2 * j, k
             )
 
             _dia_1 = read_local_population(
                 fine,
                 wp.mod(2 * i + 1 + fine_nodes_x, fine_nodes_x),
                 wp.mod(2 * j + 1 + fine_nodes_y, fine_nodes_y),
+                k,
             )
             _dia_2 = read_local_population(
                 fine,
                 wp.mod(2 * i + 1 + fine_nodes_x, fine_nodes_x),
                 wp.mod(2 * j - 1 + fine_nodes_y, fine_nodes_y),
+                k,
             )
             _dia_3 = read_local_population(
                 fine,
                 wp.mod(2 * i - 1 + fine_nodes_x, fine_nodes_x),
                 wp.mod(2 * j + 1 + fine_nodes_y, fine_nodes_y),
+                k,
             )
             _dia_4 = read_local_population(
                 fine,
                 wp.mod(2 * i - 1 + fine_nodes_x, fine_nodes_x),
-                wp.mod(2 * j + 1 + fine_nodes_y, fine_nodes_y),
+                wp.mod(2 * j - 1 + fine_nodes_y, fine_nodes_y),
+                k,
             )
 
             # If one of the nodes is a ghost node, interpolate with zero population
@@ -228,7 +251,7 @@ class Restriction(Operator):
             )
 
             # Write to coarse grid
-            write_population_to_global(coarse, _f_out, i, j)
+            write_population_to_global(coarse, _f_out, i, j, k)
 
         return functional, (kernel_no_bc, kernel_with_bc)
 
@@ -237,13 +260,13 @@ class Restriction(Operator):
         self, fine, coarse, fine_nodes_x, fine_nodes_y, fine_boundary_array=None
     ):
         if fine_boundary_array is None:
-            wp.launch(
+            launch(
                 self.warp_kernel[0],
                 inputs=[fine, coarse, fine_nodes_x, fine_nodes_y],
                 dim=coarse.shape[1:],
             )
         else:
-            wp.launch(
+            launch(
                 self.warp_kernel[1],
                 inputs=[fine, coarse, fine_nodes_x, fine_nodes_y, fine_boundary_array],
                 dim=coarse.shape[1:],
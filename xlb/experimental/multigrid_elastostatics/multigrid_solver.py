@@ -1,6 +1,6 @@
 import numpy as np
 import warp as wp
-from xlb.experimental.multigrid_elastostatics.solid_simulation_params import SimulationParams
+from xlb.experimental.multigrid_elastostatics.solid_simulation_params import get_context
 import xlb
 from xlb.compute_backend import ComputeBackend
 from xlb.precision_policy import PrecisionPolicy
@@ -8,9 +8,24 @@ from xlb.grid import grid_factory
 from xlb.experimental.multigrid_elastostatics.solid_stepper import SolidsStepper
 import xlb.experimental.multigrid_elastostatics.solid_utils as utils
 from xlb.experimental.multigrid_elastostatics.benchmark_data import BenchmarkData
-from xlb.experimental.multigrid_elastostatics.kernel_provider import KernelProvider
+from xlb.experimental.multigrid_elastostatics.kernel_provider import (
+    KernelProvider,
+    count_kernels,
+    defines_kernels,
+    get_uncached_modules,
+)
 import xlb.experimental.multigrid_elastostatics.solid_boundary as bc
 from xlb.experimental.multigrid_elastostatics.multigrid_level import Level
+from xlb.experimental.multigrid_elastostatics.multigrid_restriction import Restriction
+from xlb.experimental.multigrid_elastostatics.multigrid_launch_plan import LaunchPlan, launch
+from xlb.experimental.multigrid_elastostatics.multigrid_workspace import Workspace
+from xlb.experimental.multigrid_elastostatics.multigrid_coarse_solver import CoarseDirectSolver
+from xlb.experimental.multigrid_elastostatics.multigrid_krylov import (
+    MultigridLinearOperator,
+    MultigridPreconditioner,
+    gmres,
+    bicgstab,
+)
 from xlb import DefaultConfig
 import math
 from typing import Any
@@ -25,8 +40,19 @@ class MultigridSolver:
     Each level contains its own grid, fields, and a stepper for
         performing smoothing steps.
     A multigrid iteration can then be started from the finest level.
+    Several solvers, each with its own ParameterContext (see params), can run concurrently in
+        threads. Setting up a solver defines and loads its warp kernels (one solver at a time, see
+        defines_kernels), which changes the warp modules shared by all solvers, so it must not
+        overlap with cycles of other solvers: set up the solvers first (from any thread), then
+        run them. The same holds for the first call of start_fmg and solve_krylov, which define
+        further kernels.
+    With batch_size B > 1, the solver solves B load cases with the same geometry at once: every
+        field holds the B cases along its last index, so one launch smooths, restricts and
+        prolongates all of them, and solve reports the residual norms and the convergence of
+        every case.
     """
 
+    @defines_kernels
     def __init__(
         self,
         nodes_x,
@@ -44,6 +70,17 @@ class MultigridSolver:
         boundary_values=None,
         potential=None,
         error_correction_iterations=1,  # by default do V-Cycle
+        fused_smoothing=False,
+        compact_storage=False,
+        moment_storage=False,
+        precision_policy=None,
+        homogeneous=False,
+        coarse_direct_solve=False,
+        split_boundary=False,
+        skip_ghost_nodes=False,
+        require_cached_kernels=False,
+        params=None,
+        batch_size=1,
     ):
         """
         Initializes multigrid solver
@@ -52,18 +89,60 @@ class MultigridSolver:
         length_x, length_y: physical dimensions of the domain
         dt: time step on finest grid
         force_load: lambda function (x,y) giving the force load at position (x,y)
+            (with batch_size > 1: sequence of the force loads of the load cases, None for zero
+            forces in all of them)
         gamma: relaxation parameter for smoothing step
         v1, v2: nr of pre- and post-smoothing steps
         max_levels: maximum number of levels to use (if None, use as many as possible)
         coarsest_level_iter: number of smoothing steps on coarsest level
         boundary_conditions: info array of boundary conditions on finest grid
             (if using Dirichlet or VN BC)
-        boundary_values: array of boundary values on finest grid
-        potential: sympy expression for boundary potential (if using Dirichlet or VN BC)
+        boundary_values: compact boundary values on finest grid (see solid_boundary.py)
+        potential: sympy expression for boundary potential (if using Dirichlet or VN BC),
+            or array of its values on the finest grid, e.g. a signed distance field
+            (see init_bc_from_signed_distance and solid_geometry.py)
         error_correction_iterations: number of recursive calls to
             multigrid stepper on coarser levels (1 -> V-cycle, 2 -> W-cycle, etc.)
+        fused_smoothing: if True, smoothing steps use a single fused collide-stream-relax kernel
+            (halves the global memory traffic of a smoothing step)
+        compact_storage: if True, fields store only the 8 non-zero populations per node
+            (saves 1/9 of memory and bandwidth)
+        moment_storage: if True, the pre-collision fields of all levels hold moments instead of
+            populations (populations are only formed when streaming), not combinable with
+            compact_storage
+        precision_policy: precision of fields and kernels of all levels
+            (defaults to DefaultConfig's)
+        homogeneous: if True, the force load is ignored and the boundary displacement is zero on
+            all levels, so the solver can be used to solve for corrections given a defect
+            correction on the finest level (see MixedPrecisionSolver)
+        coarse_direct_solve: if True, the coarsest level is solved exactly in every cycle with a
+            sparse LU factorization of its LB iteration matrix (assembled and factorized once on
+            the host, requires scipy, see CoarseDirectSolver); coarsest_level_iter smoothing steps
+            are performed in addition
+        split_boundary: if True, smoothing steps with BC run the kernel of the periodic case on all
+            nodes and apply the BC in a second kernel over the boundary and ghost nodes only
+            (see MultigridStepper)
+        skip_ghost_nodes: if True, the kernels with BC are launched over per-row spans of the
+            nodes inside the domain only (see ActiveCells), instead of over the full grid
+        require_cached_kernels: if True, raises a RuntimeError if the kernels of the levels are not
+            in warp's kernel cache yet, i.e. would be compiled when the solver is set up (fill the
+            cache with python -m xlb.experimental.multigrid_elastostatics.warmup)
+        params: ParameterContext with the material parameters (see ParameterContext.from_material,
+            defaults to a snapshot of the current SimulationParams). Every level derives its own
+            context at its resolution, so several solvers can be used concurrently (e.g. in a
+            thread pool) without touching the process-wide SimulationParams
+        batch_size: number of load cases solved at once (see above), not combinable with
+            coarse_direct_solve and solve_krylov
         """
-        precision_policy = DefaultConfig.default_precision_policy
+        assert batch_size == 1 or not coarse_direct_solve, "Batches need iterative coarse solves"
+        kernels_before = count_kernels()
+        provider_builds_before = KernelProvider.num_builds
+        self.dt = dt
+        self.batch_size = batch_size
+        self.params = get_context(params)
+        if precision_policy is None:
+            precision_policy = DefaultConfig.default_precision_policy
+        self.precision_policy = precision_policy
         compute_backend = DefaultConfig.default_backend
         velocity_set = DefaultConfig.velocity_set
 
@@ -75,6 +154,18 @@ class MultigridSolver:
         else:
             self.max_levels = min(max_levels, self.max_possible_levels)
 
+        # recorded launches of one cycle (see compile_cycle)
+        self.cycle_plan = None
+        # force loads restricted to the coarse levels (see start_fmg)
+        self.fmg_forces = None
+        self.force_restriction = None
+
+        # scratch fields shared by all levels, sized for the finest level
+        cardinality = velocity_set.q - 1 if compact_storage else velocity_set.q
+        self.workspace = Workspace(
+            cardinality * nodes_x * nodes_y * batch_size, precision_policy.store_precision.wp_dtype
+        )
+
         # setup levels
         self.levels = list()
         for i in range(self.max_levels):
@@ -87,7 +178,7 @@ class MultigridSolver:
             dt_level = dt * (4**i)
             assert math.isclose(dx, dy)
 
-            if i != 0:
+            if i != 0 or homogeneous:
                 force_load = None
 
             level = Level(
@@ -105,29 +196,73 @@ class MultigridSolver:
                 precision_policy=precision_policy,
                 coarsest_level_iter=coarsest_level_iter,
                 error_correction_iterations=error_correction_iterations,
+                fused_smoothing=fused_smoothing,
+                workspace=self.workspace,
+                compact_storage=compact_storage,
+                moment_storage=moment_storage,
+                split_boundary=split_boundary,
+                skip_ghost_nodes=skip_ghost_nodes,
+                params=self.params,
+                batch_size=batch_size,
             )
             if boundary_conditions != None:
-                if i == 0:
+                if i == 0 and not homogeneous:
                     level.add_boundary_conditions(boundary_conditions, boundary_values)
                 else:
                     # create zero displacement boundary for coarser meshes
                     x, y = sympy.symbols("x y")
                     displacement = [0 * x + 0 * y, 0 * x + 0 * y]
                     indicator = lambda x, y: -1
-                    boundary_conditions_level, boundary_values_level = bc.init_bc_from_lambda(
-                        potential_sympy=potential,
-                        grid=level.grid,
-                        dx=dx,
-                        velocity_set=velocity_set,
-                        manufactured_displacement=displacement,
-                        indicator=indicator,
-                        x=x,
-                        y=y,
-                        precision_policy=precision_policy,
-                    )
+                    if isinstance(potential, np.ndarray):
+                        # coarse nodes coincide with every 2^i-th fine node
+                        boundary_conditions_level, boundary_values_level = (
+                            bc.init_bc_from_signed_distance(
+                                signed_distance=potential[:: 2**i, :: 2**i],
+                                grid=level.grid,
+                                dx=dx,
+                                velocity_set=velocity_set,
+                                manufactured_displacement=displacement,
+                                indicator=indicator,
+                                x=x,
+                                y=y,
+                                precision_policy=precision_policy,
+                                params=level.params,
+                            )
+                        )
+                    else:
+                        boundary_conditions_level, boundary_values_level = bc.init_bc_from_lambda(
+                            potential_sympy=potential,
+                            grid=level.grid,
+                            dx=dx,
+                            velocity_set=velocity_set,
+                            manufactured_displacement=displacement,
+                            indicator=indicator,
+                            x=x,
+                            y=y,
+                            precision_policy=precision_policy,
+                            params=level.params,
+                        )
                     level.add_boundary_conditions(boundary_conditions_level, boundary_values_level)
             self.levels.append(level)
 
+        if coarse_direct_solve:
+            coarsest_level = self.levels[-1]
+            coarsest_level.coarse_solver = CoarseDirectSolver(self, coarsest_level)
+            coarsest_level.coarse_solver.assemble()
+
+        # start-up statistics: warp kernels defined by the levels and their operators (compiled on
+        # their first launch) and KernelProviders built (cached ones are reused, see KernelProvider)
+        self.startup_kernels = count_kernels() - kernels_before
+        self.startup_provider_builds = KernelProvider.num_builds - provider_builds_before
+        if require_cached_kernels:
+            uncached = get_uncached_modules()
+            if uncached:
+                raise RuntimeError(
+                    "Kernels of {} are not in warp's kernel cache, run "
+                    "python -m xlb.experimental.multigrid_elastostatics.warmup with the precision "
+                    "and material parameters of this solver".format(", ".join(uncached))
+                )
+
     def get_next_level(self, level_num):
         """
         Returns next coarser level if it exists, else None
@@ -153,13 +288,18 @@ class MultigridSolver:
             del level.f_3
             del level.f_4
             del level.defect_correction
+            level.coarse_solver = None
             del level
+        self.workspace.free()
+        self.cycle_plan = None
+        self.fmg_forces = None
+        self.force_restriction = None
 
     def get_macroscopics(self, output_array):
         """
         Get macroscopic quantities from the finest level and store them in the output array.
 
-        output_array: grid to store output
+        output_array: grid to store output (with batch_size extent in its last dimension)
 
         Exits with:
             macroscopics stored in output_array
@@ -167,9 +307,331 @@ class MultigridSolver:
         finest_level = self.get_finest_level()
         finest_level.stepper.get_macroscopics(f=finest_level.f_1, output_array=output_array)
 
-    def start_cycle(self, return_residual=False, timestep=0):
+    def start_cycle(self, return_residual=False, timestep=0, residual_norms=None, slot=0):
         """
         Start a multigrid cycle from the finest level.
+        (replays the recorded launches if the cycle was compiled, see compile_cycle)
+
+        return_residual: if True, return L2 norm of residual after the cycle
+            (synchronizes with the device every cycle)
+        residual_norms: optional device buffer (see create_residual_norm_buffer) to record the
+            L2, Linf and moment norms of the residual in, without synchronizing with the device
+        slot: entry of residual_norms to write to
+        """
+        finest_level = self.get_finest_level()
+        if self.cycle_plan is None:
+            return finest_level(self, return_residual, timestep, residual_norms, slot)
+
+        self.cycle_plan.replay()
+        benchmark_data = BenchmarkData()
+        benchmark_data.wu += self.cycle_plan.wu
+        stepper = finest_level.stepper
+        if residual_norms is not None:
+            stepper.get_residual_norms(finest_level.f_1, finest_level.f_2, residual_norms, slot)
+        if return_residual:
+            return stepper.get_residual_norm(finest_level.f_1, finest_level.f_2)
+
+    @defines_kernels
+    def restrict_force(self, forces=None):
+        """
+        Restricts the force load of the finest level down the hierarchy
+            (full weighting, see Restriction; the weights sum to 4, which is the ratio of the
+            time steps of two levels the dimensionless force is scaled with)
+
+        forces: list returned by an earlier call to restrict into (allocated if None)
+
+        returns:
+            list with the force of every level (the finest level's own force array first)
+        """
+        finest_level = self.get_finest_level()
+        if self.force_restriction is None:
+            self.force_restriction = Restriction(
+                precision_policy=self.precision_policy, params=self.params
+            )
+        if forces is None:
+            forces = [finest_level.stepper.force]
+            forces += [wp.zeros_like(level.stepper.force) for level in self.levels[1:]]
+        for fine_level, fine_force, coarse_force in zip(self.levels[:-1], forces[:-1], forces[1:]):
+            self.force_restriction(
+                fine=fine_force,
+                coarse=coarse_force,
+                fine_nodes_x=fine_level.nodes_x,
+                fine_nodes_y=fine_level.nodes_y,
+                fine_boundary_array=fine_level.boundary_conditions,
+            )
+        return forces
+
+    def set_force(self, force_load):
+        """
+        Replaces the force load and resets the solution of all levels, so the hierarchy (fields,
+            boundary arrays, kernels and a compiled cycle) can be reused for another problem
+            without reallocating anything (the force is scaled on the device, see
+            MultigridStepper.set_force)
+
+        force_load: force load as passed to __init__, or numpy or warp array with the force load
+            at the nodes of the finest grid, shape (2, nodes_x, nodes_y[, batch_size])
+
+        Exits with:
+            force load written to the finest level (and to the restricted forces of start_fmg),
+            solution and defect correction of all levels set to zero
+        """
+        self.get_finest_level().stepper.set_force(force_load)
+        if self.fmg_forces is not None:
+            self.restrict_force(self.fmg_forces)
+        for level in self.levels:
+            level.reset()
+
+    def start_fmg(self, cycles_per_level=1, return_residual=False):
+        """
+        Full multigrid (nested iteration): computes an initial solution on the finest level
+            from the solutions of the coarser levels
+
+        Starting from the coarsest level, every level solves the full problem with the restricted
+            force load by cycles_per_level cycles (using the levels below for coarse grid
+            correction). Its solution is then prolongated to the next finer level as initial
+            guess. With BC, coarse levels solve with their zero displacement boundaries, so the
+            initial guess is less accurate there.
+        The solution of the finest level is overwritten; further cycles can be started with
+            start_cycle as usual.
+
+        cycles_per_level: number of cycles performed on every level
+        return_residual: if True, return L2 norm of residual on the finest level
+            (synchronizes with the device)
+        """
+        if self.fmg_forces is None:
+            self.fmg_forces = self.restrict_force()
+
+        for level_num in reversed(range(self.max_levels)):
+            level = self.levels[level_num]
+            coarse = self.get_next_level(level_num)
+            shape = level.f_1.shape
+            launch(level.set_population_zero, inputs=[level.f_1, shape[0]], dim=shape[1:])
+            launch(
+                level.set_population_zero,
+                inputs=[level.defect_correction, shape[0]],
+                dim=shape[1:],
+            )
+            if coarse is not None:
+                # solution of the coarser level as initial guess
+                level.prolongation(
+                    fine=level.f_1,
+                    coarse=coarse.f_1,
+                    coarse_boundary_array=coarse.boundary_conditions,
+                    active_cells=level.stepper.active_cells,
+                )
+
+            # the force of a coarse level is only set while it is the top level of the cycles,
+            # as a coarse grid correction it has to be zero
+            force = level.stepper.force
+            if level_num != 0:
+                launch(
+                    level.copy_populations,
+                    inputs=[self.fmg_forces[level_num], force, 2],
+                    dim=shape[1:],
+                )
+            for i in range(cycles_per_level):
+                level(self)
+            if level_num != 0:
+                launch(level.set_population_zero, inputs=[force, 2], dim=shape[1:])
+
+        finest_level = self.get_finest_level()
+        if return_residual:
+            return finest_level.stepper.get_residual_norm(finest_level.f_1, finest_level.f_2)
+
+    def compile_cycle(self):
+        """
+        Records the kernel launches of one multigrid cycle, which start_cycle then replays
+            without walking through the hierarchy of levels and operators
+            (the cycle is only recorded, not performed)
+        The cycle has to be compiled again if fields of the levels are reallocated
+            or replaced, or parameters of the solver change
+
+        returns:
+            the recorded LaunchPlan
+        """
+        self.cycle_plan = None
+        benchmark_data = BenchmarkData()
+        wu = benchmark_data.wu
+        start_fields = [level.f_1 for level in self.levels]
+        with LaunchPlan() as plan:
+            self.start_cycle()
+            # with fused smoothing, f_1 and f_2 of a level can end up swapped after the cycle;
+            # the replayed cycle has to start from the same fields in every replay
+            for level, f_1 in zip(self.levels, start_fields):
+                if level.f_1 is not f_1:
+                    launch(
+                        level.copy_populations,
+                        inputs=[level.f_1, f_1, f_1.shape[0]],
+                        dim=f_1.shape[1:],
+                    )
+                    level.f_1, level.f_2 = level.f_2, level.f_1
+        plan.wu = benchmark_data.wu - wu
+        benchmark_data.wu = wu
+        self.cycle_plan = plan
+        return plan
+
+    def create_residual_norm_buffer(self, num_slots=1):
+        """
+        Allocates a device buffer for the residual norms of num_slots cycles (of all load cases)
+        """
+        return self.get_finest_level().stepper.norm_reduction.create_output(
+            num_slots, self.batch_size
+        )
+
+    def read_residual_norms(self, residual_norms):
+        """
+        Copies recorded residual norms to the host (synchronizes with the device)
+
+        returns:
+            dict with numpy arrays "l2", "linf" and "moments" (one entry / row per slot,
+            with batch_size > 1 one per slot and load case)
+        """
+        return self.get_finest_level().stepper.norm_reduction.read(residual_norms)
+
+    def solve(self, tol, max_cycles, check_every=10, history_size=None):
+        """
+        Performs multigrid cycles until the residual is converged or max_cycles is reached
+
+        Cycles are queued back to back; after every cycle the residual norms are written to
+            a device ring buffer and checked against tol on the device. The host only reads
+            the convergence flag every check_every cycles, so up to check_every - 1 cycles may be
+            performed after convergence (these only reduce the residual further).
+        With batch_size > 1, every load case has its own convergence flag, and the cycles stop
+            once all cases are converged (converged cases are cycled along with the others).
+
+        tol: tolerance for L2 norm of residual divided by dt (as in the drivers)
+        max_cycles: maximum number of cycles
+        check_every: number of cycles between reads of the convergence flag
+        history_size: number of cycles kept in the ring buffer (defaults to check_every)
+
+        returns:
+            dict with
+            "converged": True if the residual reached tol (in all load cases)
+            "cycles": number of cycles needed to reach tol (number of cycles performed if not)
+            "residual_norms": norms of the last cycles in the ring buffer, in order
+                (see read_residual_norms)
+            "converged_mask": numpy array telling for every load case if it reached tol
+            "case_cycles": numpy array with the number of cycles every load case needed
+        """
+        if history_size is None:
+            history_size = check_every
+        norm_reduction = self.get_finest_level().stepper.norm_reduction
+        residual_norms = self.create_residual_norm_buffer(history_size)
+        converged_cycle = wp.full(shape=self.batch_size, value=-1, dtype=wp.int32)
+        threshold = tol * self.dt
+
+        cycle = 0
+        while cycle < max_cycles:
+            slot = cycle % history_size
+            self.start_cycle(residual_norms=residual_norms, slot=slot)
+            norm_reduction.check_convergence(
+                residual_norms, slot, cycle, threshold, converged_cycle
+            )
+            cycle += 1
+            if cycle % check_every == 0 or cycle == max_cycles:
+                if (converged_cycle.numpy() >= 0).all():
+                    break
+
+        # unroll ring buffer, so that the norms of the last cycle come last
+        history = self.read_residual_norms(residual_norms)
+        num_recorded = min(cycle, history_size)
+        order = [(cycle - num_recorded + n) % history_size for n in range(num_recorded)]
+        history = {key: value[order] for key, value in history.items()}
+
+        converged_at = converged_cycle.numpy()
+        converged_mask = converged_at >= 0
+        case_cycles = np.where(converged_mask, converged_at + 1, cycle)
+        return {
+            "converged": bool(converged_mask.all()),
+            "cycles": int(case_cycles.max()),
+            "residual_norms": history,
+            "converged_mask": converged_mask,
+            "case_cycles": case_cycles,
+        }
+
+    @defines_kernels
+    def _create_krylov_operators(self, cycles_per_iteration):
+        """
+        returns:
+            MultigridLinearOperator of the finest level and MultigridPreconditioner with
+            cycles_per_iteration cycles per application
+        """
+        linear_operator = MultigridLinearOperator(self)
+        return linear_operator, MultigridPreconditioner(self, linear_operator, cycles_per_iteration)
+
+    def solve_krylov(self, tol, max_cycles, method="gmres", restart=20, cycles_per_iteration=1):
+        """
+        Solves for the steady state with a Krylov method preconditioned by multigrid cycles
+            (see multigrid_krylov.py)
+
+        tol: tolerance for L2 norm of residual divided by dt (normalised as in solve)
+        max_cycles: maximum number of preconditioner applications
+        method: "gmres" or "bicgstab"
+        restart: number of GMRES iterations between restarts
+        cycles_per_iteration: number of multigrid cycles per preconditioner application
+
+        Exits with:
+            solution written to f_1 of the finest level
+
+        returns:
+            dict with
+            "converged": True if the residual reached tol
+            "iterations": number of Krylov iterations performed
+            "residual_norms": residual norm estimates of the Krylov method after every iteration
+                (normalised as in solve)
         """
+        assert self.batch_size == 1, "Krylov solves are only supported for a single load case"
         finest_level = self.get_finest_level()
-        return finest_level(self, return_residual, timestep)
+        linear_operator, preconditioner = self._create_krylov_operators(cycles_per_iteration)
+        # Krylov norms are Euclidean norms over all entries of a field
+        normalisation = 1.0 / math.sqrt(linear_operator.shape[0])
+        residual_norms = list()
+
+        def callback(norm):
+            residual_norms.append(norm * normalisation)
+
+        atol = tol * self.dt / normalisation
+
+        b = linear_operator.rhs()
+        x0 = linear_operator.create_vector()
+        linear_operator.copy(finest_level.f_1, x0)
+        if method == "gmres":
+            x, info = gmres(
+                linear_operator,
+                b,
+                x0=x0,
+                rtol=0.0,
+                atol=atol,
+                restart=restart,
+                maxiter=max_cycles,
+                M=preconditioner,
+                callback=callback,
+            )
+        elif method == "bicgstab":
+            x, info = bicgstab(
+                linear_operator,
+                b,
+                x0=x0,
+                rtol=0.0,
+                atol=atol,
+                maxiter=max(max_cycles // 2, 1),
+                M=preconditioner,
+                callback=callback,
+            )
+        else:
+            raise ValueError("Unknown Krylov method {}".format(method))
+
+        # restore the levels: solution in f_1 of finest level, no defect correction
+        linear_operator.copy(x, finest_level.f_1)
+        shape = finest_level.defect_correction.shape
+        launch(
+            finest_level.set_population_zero,
+            inputs=[finest_level.defect_correction, shape[0]],
+            dim=shape[1:],
+        )
+        preconditioner.reset()
+        return {
+            "converged": info == 0,
+            "iterations": len(residual_norms),
+            "residual_norms": residual_norms,
+        }
@@ -3,20 +3,28 @@ import warp as wp
 import numpy as np
 import sympy
 import math
+from typing import Any
 
 import xlb
 from xlb.operator.stepper import Stepper
-from xlb.operator.stream import Stream
 from xlb.operator import Operator
 from xlb.compute_backend import ComputeBackend
+from xlb import DefaultConfig
 
 from xlb.experimental.multigrid_elastostatics.solid_collision import SolidsCollision
-from xlb.experimental.multigrid_elastostatics.solid_boundary import SolidsBoundary
+from xlb.experimental.multigrid_elastostatics.solid_boundary import (
+    SolidsBoundary,
+    get_boundary_nodes,
+)
 from xlb.experimental.multigrid_elastostatics.solid_macroscopic import SolidMacroscopics
 from xlb.experimental.multigrid_elastostatics.solid_bared_moments import SolidBaredMoments
 import xlb.experimental.multigrid_elastostatics.solid_utils as utils
-from xlb.experimental.multigrid_elastostatics.solid_simulation_params import SimulationParams
+from xlb.experimental.multigrid_elastostatics.solid_simulation_params import get_context
 from xlb.experimental.multigrid_elastostatics.kernel_provider import KernelProvider
+from xlb.experimental.multigrid_elastostatics.multigrid_reduction import NormReduction
+from xlb.experimental.multigrid_elastostatics.multigrid_launch_plan import launch
+from xlb.experimental.multigrid_elastostatics.multigrid_active_cells import ActiveCells
+from xlb.experimental.multigrid_elastostatics.solid_codegen import SympyFunction
 
 # Mapping:
 #    i  j   |   m_q
@@ -37,27 +45,79 @@ class MultigridStepper(Stepper):
 
     """
 
-    def __init__(self, grid, force_load, gamma, boundary_conditions=None, boundary_values=None):
+    def __init__(
+        self,
+        grid,
+        force_load,
+        gamma,
+        boundary_conditions=None,
+        boundary_values=None,
+        fused_smoothing=False,
+        moment_storage=False,
+        split_boundary=False,
+        skip_ghost_nodes=False,
+        precision_policy=None,
+        params=None,
+        batch_size=1,
+    ):
         """
         Initializer
 
         grid: xlb grid object, define domain size and resolution
-        force_load: expected as callable function (e.g. lambda function)
+        force_load: expected as callable function (e.g. lambda function, or SympyFunction as
+            returned by solid_utils.get_force_load, which is evaluated on the device)
+            (with batch_size > 1: sequence of one force load per load case)
         boundary_condition: when simulating with Dirichlet or VN; 4d warp array specifiying
-            boundary nodes, type of boundary conditions and missing populations (see solid_boundary.py)
-        boundary_values: when simulating with Dirichlet or VN; 4d warp array with floating point
-            values needed for reconstruction of missing populations on boundary (see solid_boundary.py)
+            boundary nodes and type of boundary conditions (see solid_boundary.py)
+        boundary_values: when simulating with Dirichlet or VN; compact boundary values listing the
+            missing populations of boundary nodes and the values needed for their reconstruction
+            (see solid_boundary.py)
+        fused_smoothing: if True, collision, streaming and relaxation are done in a single kernel
+            (collision is recomputed at the pulled neighbours, so no post-collision field is
+            written to global memory). The result of a smoothing step is then written to f_2
+            instead of f_1 (see warp_implementation)
+        moment_storage: if True, pre-collision fields (f_1 in warp_implementation, the defect
+            correction) hold moments instead of populations. Post-collision fields stay
+            populations, as they are needed for streaming
+        split_boundary: if True, smoothing steps with BC run the branch-free kernel of the periodic
+            case over all nodes and a second kernel over the precomputed list of boundary and
+            ghost nodes only, which applies the BC there (the previous post-collision populations
+            in f_3 are then only kept up to date at boundary nodes, the only ones reading them)
+        skip_ghost_nodes: if True, kernels updating the grid with BC are only launched over the
+            active cells (see ActiveCells), ghost nodes outside them keep their values (they do
+            not enter the solution at the other nodes)
+        precision_policy: precision of fields and kernels (defaults to DefaultConfig's)
+        params: ParameterContext of the material and the grid resolution (defaults to the
+            current SimulationParams)
+        batch_size: number of load cases B solved at once. All fields then hold the B cases along
+            their last index k (shape [q, nx, ny, B]) and every kernel launch covers all of them,
+            the boundary arrays are shared by the cases
         """
 
-        super().__init__(grid, boundary_conditions)
+        self.params = get_context(params)
+        # needed by the residual norm kernels, so it has to exist before they are constructed
+        self.norm_reduction = NormReduction(precision_policy=precision_policy, params=self.params)
+        self.moment_storage = moment_storage
         self.grid = grid
         self.boundary_conditions = boundary_conditions
+        # Stepper.__init__ always uses the default precision policy, so initialize the Operator
+        Operator.__init__(
+            self,
+            DefaultConfig.velocity_set,
+            precision_policy or DefaultConfig.default_precision_policy,
+            DefaultConfig.default_backend,
+        )
+        self.boundary_conditions = boundary_conditions
         self.boundary_values = boundary_values
 
         self.gamma = gamma
+        self.fused_smoothing = fused_smoothing
+        self.split_boundary = split_boundary
+        self.skip_ghost_nodes = skip_ghost_nodes
+        self._residual_norm_output = None
 
         # get simulation parameters
-        params = SimulationParams()
+        params = self.params
         theta = params.theta
         K = params.K
         mu = params.mu
@@ -77,42 +137,34 @@ class MultigridStepper(Stepper):
         omega_12 = 1 / (tau_12 + 0.5)
         omega_21 = 1 / (tau_21 + 0.5)
         omega_f = 1 / (tau_f + 0.5)
-        self.omega = KernelProvider().vec(
+        self.omega = KernelProvider(self.precision_policy, self.params).vec(
             0.0, 0.0, omega_11, omega_s, omega_d, omega_12, omega_21, omega_f, 0.0
         )
 
         # ----------handle force load---------
-        if force_load is not None:
-            b_x_scaled = (
-                lambda x_node, y_node: force_load[0](x_node * dx, y_node * dx) * dt / kappa
-            )  # force now dimensionless, and can get called with the indices of the grid nodes
-            b_y_scaled = lambda x_node, y_node: force_load[1](x_node * dx, y_node * dx) * dt / kappa
-            host_force_x = np.fromfunction(
-                b_x_scaled, shape=(self.grid.shape[0], self.grid.shape[1])
-            )  # create array with force evaluated at the grid points
-            host_force_y = np.fromfunction(
-                b_y_scaled, shape=(self.grid.shape[0], self.grid.shape[1])
-            )
-            host_force = np.array([[host_force_x, host_force_y]])
-            host_force = np.transpose(
-                host_force, (1, 2, 3, 0)
-            )  # swap dims to make array compatible with what grid_factory would have produced
-            self.force = wp.from_numpy(
-                host_force, dtype=self.precision_policy.store_precision.wp_dtype
-            )  # ...and move to device
-        else:
-            self.force = self.grid.create_field(
-                cardinality=2, dtype=self.precision_policy.store_precision
-            )
+        self.batch_size = batch_size
+        # force now dimensionless (see set_force for replacing it on the device later on, its
+        # kernel can not be launched before the operators its module refers to are defined)
+        host_force, on_device = self._evaluate_force_load(force_load)
+        self.force = wp.from_numpy(
+            host_force * dt / kappa, dtype=self.precision_policy.store_precision.wp_dtype
+        )
+        self._write_force_on_device(on_device)
+        self._set_node_index()
 
         # ---------define operators----------
-        self.collision = SolidsCollision(self.omega)
-        self.stream = Stream(self.velocity_set, self.precision_policy, self.compute_backend)
+        self.collision = SolidsCollision(
+            self.omega,
+            precision_policy=self.precision_policy,
+            moment_storage=moment_storage,
+            params=self.params,
+        )
         self.boundaries = SolidsBoundary(
             force=self.force,
             velocity_set=self.velocity_set,
             precision_policy=self.precision_policy,
             compute_backend=self.compute_backend,
+            params=self.params,
         )
         self.macroscopic = SolidMacroscopics(
             self.grid,
@@ -120,24 +172,250 @@ class MultigridStepper(Stepper):
             self.velocity_set,
             self.precision_policy,
             self.compute_backend,
+            params=self.params,
         )
         self.bared_moments = SolidBaredMoments(
-            self.grid, self.omega, self.velocity_set, self.precision_policy, self.compute_backend
+            self.grid,
+            self.omega,
+            self.velocity_set,
+            self.precision_policy,
+            self.compute_backend,
+            params=self.params,
         )
         self.equilibrium = None  # needed?
 
+    def _evaluate_force_load(self, force_load):
+        """
+        Evaluates the components of a force load that are not given as SympyFunction (see
+            solid_utils.get_force_load) at the grid nodes on the host
+
+        force_load: force load as passed to __init__, None for zero forces
+
+        returns:
+            numpy array of shape (2, nodes_x, nodes_y, batch_size) with the force load in physical
+                units (one force field per load case along the last index, as produced by
+                grid_factory for a single case), zero at the SympyFunction components
+            list of (SympyFunction, d, k) of the components to evaluate on the device (see
+                _write_force_on_device)
+        """
+        shape = (self.grid.shape[0], self.grid.shape[1])
+        force_loads = [force_load] if self.batch_size == 1 else force_load
+        force_loads = force_loads or [None] * self.batch_size
+        assert len(force_loads) == self.batch_size, "expected one force load per load case"
+        dx = self.params.dx
+        host_force = np.zeros((2,) + shape + (self.batch_size,))
+        on_device = list()
+        for k, load in enumerate(force_loads):
+            if load is not None:
+                for d in range(2):
+                    if isinstance(load[d], SympyFunction):
+                        on_device.append((load[d], d, k))
+                        continue
+                    # called with the indices of the grid nodes
+                    host_force[d, :, :, k] = np.fromfunction(
+                        lambda x_node, y_node: load[d](x_node * dx, y_node * dx), shape
+                    )
+        return host_force, on_device
+
+    def _write_force_on_device(self, on_device):
+        """
+        Evaluates force components given as SympyFunction on the device, with generated kernels
+            writing them scaled by dt / kappa to self.force (see solid_codegen.py)
+
+        on_device: list of (SympyFunction, d, k) as returned by _evaluate_force_load
+        """
+        params = self.params
+        shape = self.force.shape[1:3]
+        for function, d, k in on_device:
+            function.evaluate_on_device(
+                params.dx, shape, out=self.force, first=d, case=k, scale=params.dt / params.kappa
+            )
+
+    def set_force(self, force_load):
+        """
+        Replaces the force load on the device, the force array keeps its identity
+            (so operators and recorded launch plans referring to it stay valid)
+
+        force_load: force load as passed to __init__ (see _evaluate_force_load), or numpy or warp
+            array (float32 or float64) with the force load in physical units at the grid nodes,
+            shape (2, nodes_x, nodes_y, batch_size) or (2, nodes_x, nodes_y) for a single load case
+
+        Exits with:
+            force load scaled by dt / kappa written to self.force
+        """
+        on_device = list()
+        if not isinstance(force_load, wp.array):
+            if not isinstance(force_load, np.ndarray):
+                force_load, on_device = self._evaluate_force_load(force_load)
+                if len(on_device) == 2 * self.batch_size:
+                    # every component is written on the device
+                    self._write_force_on_device(on_device)
+                    return
+            force_load = wp.array(force_load, dtype=wp.float64, device=self.force.device)
+        if force_load.ndim == 3:
+            force_load = force_load.reshape(force_load.shape + (1,))
+        assert force_load.shape == self.force.shape, "force load does not match the grid"
+        params = self.params
+        launch(
+            self.warp_kernel[8],
+            inputs=[force_load, self.force, wp.float64(params.dt), wp.float64(params.kappa)],
+            dim=self.force.shape[1:],
+        )
+        self._write_force_on_device(on_device)
+
     def _construct_warp(self):
         # get kernels
-        kernel_provider = KernelProvider()
+        kernel_provider = KernelProvider(self.precision_policy, self.params)
+        boundary_values_struct = kernel_provider.boundary_values_struct
         copy_populations = kernel_provider.copy_populations
         read_local_population = kernel_provider.read_local_population
+        pull_population = kernel_provider.pull_population
         write_population_to_global = kernel_provider.write_population_to_global
-        read_bc_info = kernel_provider.read_bc_info
-        read_bc_vals = kernel_provider.read_bc_vals
         vec = kernel_provider.vec
-        bc_info_vec = kernel_provider.bc_info_vec
-        bc_val_vec = kernel_provider.bc_val_vec
+        zero_vec = kernel_provider.zero_vec
+        active_node = kernel_provider.active_node
         self.copy_populations = kernel_provider.copy_populations
+        self.convert_moments_to_populations = kernel_provider.convert_moments_to_populations
+        self.scatter_to_nodes = kernel_provider.scatter_to_nodes
+        _c = self.velocity_set.c
+
+        # conversion between populations and the stored pre-collision state
+        if self.moment_storage:
+            to_state = kernel_provider.calc_moments
+            to_populations = kernel_provider.calc_populations
+        else:
+            to_state = kernel_provider.identity
+            to_populations = kernel_provider.identity
+        self.to_state = to_state
+        self.to_populations = to_populations
+
+        @wp.func
+        def functional_pull_post_collision(
+            f: wp.array4d(dtype=self.store_dtype),
+            force: wp.array4d(dtype=self.store_dtype),
+            index: wp.vec3i,
+            omega: vec,
+            theta: self.compute_dtype,
+        ):
+            """
+            Functional for streaming step fused with the collision step
+            (instead of reading post-collision populations from global memory, the collision
+            is recomputed at every neighbour a population is pulled from)
+
+            f: grid of pre-collision populations (moments if moment_storage)
+            force: grid with forcing terms
+            index: index (i, j, k) of lattice point and load case
+            omega: vector of relaxation rates
+            theta: lattice parameter
+
+            returns:
+                vector of post-collision populations streamed to lattice point (periodic BC)
+            """
+            nodes_x = f.shape[1]
+            nodes_y = f.shape[2]
+            _f_post_stream = vec()
+            for l in range(self.velocity_set.q):
+                pull_i = wp.mod(index[0] - _c[0, l] + nodes_x, nodes_x)
+                pull_j = wp.mod(index[1] - _c[1, l] + nodes_y, nodes_y)
+                _f_neighbour = read_local_population(f, pull_i, pull_j, index[2])
+                _f_neighbour_post_collision = self.collision.functional_stored(
+                    _f_neighbour,
+                    self.compute_dtype(force[0, pull_i, pull_j, index[2]]),
+                    self.compute_dtype(force[1, pull_i, pull_j, index[2]]),
+                    omega,
+                    theta,
+                )
+                _f_post_stream[l] = _f_neighbour_post_collision[l]
+            return _f_post_stream
+
+        @wp.func
+        def functional_relax(
+            _f_post_stream: vec,
+            _f_pre_collision: vec,
+            _defect: vec,
+            gamma: self.compute_dtype,
+            defect_factor: self.compute_dtype,
+        ):
+            """
+            Relaxation of the streamed populations with the defect correction
+
+            returns:
+                pre-collision populations at smoothing step i+1
+            """
+            _f_out = vec()
+            for l in range(self.velocity_set.q):
+                _f_out[l] = (
+                    gamma * (_f_post_stream[l] - defect_factor * _defect[l])
+                    + (self.compute_dtype(1) - gamma) * (_f_pre_collision[l])
+                )
+            return _f_out
+
+        @wp.func
+        def functional_relax_with_bc(
+            _f_pre_collision: vec,
+            _f_post_collision: vec,
+            _f_previous_post_collision: vec,
+            _f_post_stream: vec,
+            _defect: vec,
+            force: wp.array4d(dtype=self.store_dtype),
+            boundary_info: wp.array4d(dtype=wp.int8),
+            boundary_vals: boundary_values_struct,
+            i: wp.int32,
+            j: wp.int32,
+            k: wp.int32,
+            omega: vec,
+            gamma: self.compute_dtype,
+            K: self.compute_dtype,
+            mu: self.compute_dtype,
+            theta: self.compute_dtype,
+            defect_factor: self.compute_dtype,
+        ):
+            """
+            Functional for applying the BC after streaming and relaxing at lattice point (i,j)
+            of load case k
+
+            _f_pre_collision: pre-collision populations at smoothing step i (moments if
+                moment_storage)
+            _f_post_collision: post-collision populations at smoothing step i
+            _f_previous_post_collision: post-collision populations at smoothing step i-1
+            _f_post_stream: populations streamed to the lattice point (periodic BC)
+            _defect: defect correction populations
+            other arguments: see kernel_with_bc
+
+            returns:
+                pre-collision populations at smoothing step i+1
+            """
+            if boundary_info[0, i, j, 0] == wp.int8(0):
+                # ghost node, the BC sets the streamed populations to zero
+                _f_post_stream = zero_vec()
+            else:
+                force_x = self.compute_dtype(force[0, i, j, k])
+                force_y = self.compute_dtype(force[1, i, j, k])
+                _bared_m = self.bared_moments.warp_functional(
+                    f_vec=to_populations(_f_pre_collision),
+                    force_x=force_x,
+                    force_y=force_y,
+                    omega=omega,
+                    theta=theta,
+                )
+
+                _f_post_stream = self.boundaries.warp_functional(
+                    f_post_stream_vec=_f_post_stream,
+                    f_post_collision_vec=_f_post_collision,
+                    f_previous_post_collision_vec=_f_previous_post_collision,
+                    i=i,
+                    j=j,
+                    boundary_info=boundary_info,
+                    boundary_vals=boundary_vals,
+                    force_x=force_x,
+                    force_y=force_y,
+                    bared_m_vec=_bared_m,
+                    K=K,
+                    mu=mu,
+                    theta=theta,
+                )
+            _f_post_stream = to_state(_f_post_stream)
+            return functional_relax(_f_post_stream, _f_pre_collision, _defect, gamma, defect_factor)
 
         @wp.kernel
         def kernel(
@@ -147,6 +425,7 @@ class MultigridStepper(Stepper):
             force: wp.array4d(dtype=self.store_dtype),
             gamma: self.compute_dtype,
             defect_factor: self.compute_dtype,
+            row_spans: wp.array2d(dtype=wp.int32),
         ):
             """
             Kernel for smoothing step with periodic BC
@@ -158,16 +437,19 @@ class MultigridStepper(Stepper):
             gamma: relaxation parameter
             defect_factor: factor for defect correction term
                 (usually 1.0, can be set to 0.0 to disable defect correction)
+            row_spans: spans of the nodes to update (see ActiveCells)
 
             exits with:
                 pre-collision populations at smoothing step i+1 written to f_2
             """
-            i, j, k = wp.tid()
-            index = wp.vec3i(i, j, k)
+            i, t, k = wp.tid()
+            j = active_node(row_spans, i, t)
+            if j < 0:
+                return
 
-            _f_pre_collision = read_local_population(f_2, i, j)
-            _defect = read_local_population(defect_correction, i, j)
-            _f_post_stream = self.stream.warp_functional(f_1, index)
+            _f_pre_collision = read_local_population(f_2, i, j, k)
+            _defect = read_local_population(defect_correction, i, j, k)
+            _f_post_stream = to_state(pull_population(f_1, i, j, k))
 
             _f_out = vec()
             for l in range(self.velocity_set.q):
@@ -176,7 +458,7 @@ class MultigridStepper(Stepper):
                     + (self.compute_dtype(1) - gamma) * (_f_pre_collision[l])
                 )
 
-            write_population_to_global(f_2, _f_out, i, j)
+            write_population_to_global(f_2, _f_out, i, j, k)
 
         @wp.kernel
         def kernel_with_bc(
@@ -186,13 +468,14 @@ class MultigridStepper(Stepper):
             defect_correction: wp.array4d(dtype=self.store_dtype),
             force: wp.array4d(dtype=self.store_dtype),
             boundary_info: wp.array4d(dtype=wp.int8),
-            boundary_vals: wp.array4d(dtype=self.store_dtype),
+            boundary_vals: boundary_values_struct,
             omega: vec,
             gamma: self.compute_dtype,
             K: self.compute_dtype,
             mu: self.compute_dtype,
             theta: self.compute_dtype,
             defect_factor: self.compute_dtype,
+            row_spans: wp.array2d(dtype=wp.int32),
         ):
             """
             Kernel for smoothing step with Dirichlet/VN BC
@@ -212,39 +495,78 @@ class MultigridStepper(Stepper):
             theta: lattice parameter
             defect_factor: factor for defect correction term
                 (usually 1.0, can be set to 0.0 to disable defect correction)
+            row_spans: spans of the nodes to update (see ActiveCells)
 
             exits with:
                 pre-collision populations at smoothing step i+1 written to f_2
             """
-            i, j, k = wp.tid()
-            index = wp.vec3i(i, j, k)
+            i, t, k = wp.tid()
+            j = active_node(row_spans, i, t)
+            if j < 0:
+                return
 
-            _f_pre_collision = read_local_population(f_2, i, j)
-            _f_post_collision = read_local_population(f_1, i, j)
-            _f_previous_post_collision = read_local_population(f_3, i, j)
-            _defect = read_local_population(defect_correction, i, j)
-            _f_post_stream = self.stream.warp_functional(f_1, index)
-
-            force_x = self.compute_dtype(force[0, i, j, 0])
-            force_y = self.compute_dtype(force[1, i, j, 0])
-            _bared_m = self.bared_moments.warp_functional(
-                f_vec=_f_pre_collision, force_x=force_x, force_y=force_y, omega=omega, theta=theta
+            _f_post_collision = read_local_population(f_1, i, j, k)
+            _f_out = functional_relax_with_bc(
+                read_local_population(f_2, i, j, k),
+                _f_post_collision,
+                read_local_population(f_3, i, j, k),
+                pull_population(f_1, i, j, k),
+                read_local_population(defect_correction, i, j, k),
+                force,
+                boundary_info,
+                boundary_vals,
+                i,
+                j,
+                k,
+                omega,
+                gamma,
+                K,
+                mu,
+                theta,
+                defect_factor,
             )
+            write_population_to_global(f_3, _f_post_collision, i, j, k)
+            write_population_to_global(f_2, _f_out, i, j, k)
 
-            _f_post_stream = self.boundaries.warp_functional(
-                f_post_stream_vec=_f_post_stream,
-                f_post_collision_vec=_f_post_collision,
-                f_previous_post_collision_vec=_f_previous_post_collision,
-                i=i,
-                j=j,
-                boundary_info=boundary_info,
-                boundary_vals=boundary_vals,
-                force_x=force_x,
-                force_y=force_y,
-                bared_m_vec=_bared_m,
-                K=K,
-                mu=mu,
-                theta=theta,
+        @wp.kernel
+        def kernel_fused(
+            f_1: wp.array4d(dtype=self.store_dtype),  # pre-collision
+            f_2: wp.array4d(dtype=self.store_dtype),  # output
+            defect_correction: wp.array4d(dtype=self.store_dtype),
+            force: wp.array4d(dtype=self.store_dtype),
+            omega: vec,
+            gamma: self.compute_dtype,
+            theta: self.compute_dtype,
+            defect_factor: self.compute_dtype,
+            row_spans: wp.array2d(dtype=wp.int32),
+        ):
+            """
+            Kernel for fused collide-stream-relax smoothing step with periodic BC
+
+            f_1: grid of pre-collision populations at smoothing step i
+            f_2: grid with arbitrary values (must not be the same array as f_1)
+            defect_correction: grid with defect correction populations
+            force: grid with forcing terms
+            omega: vector of omega values
+            gamma: relaxation parameter
+            theta: lattice parameter
+            defect_factor: factor for defect correction term
+                (usually 1.0, can be set to 0.0 to disable defect correction)
+            row_spans: spans of the nodes to update (see ActiveCells)
+
+            exits with:
+                pre-collision populations at smoothing step i+1 written to f_2
+            """
+            i, t, k = wp.tid()
+            j = active_node(row_spans, i, t)
+            if j < 0:
+                return
+            index = wp.vec3i(i, j, k)
+
+            _f_pre_collision = read_local_population(f_1, i, j, k)
+            _defect = read_local_population(defect_correction, i, j, k)
+            _f_post_stream = to_state(
+                functional_pull_post_collision(f_1, force, index, omega, theta)
             )
 
             _f_out = vec()
@@ -253,25 +575,292 @@ class MultigridStepper(Stepper):
                     gamma * (_f_post_stream[l] - defect_factor * _defect[l])
                     + (self.compute_dtype(1) - gamma) * (_f_pre_collision[l])
                 )
-            write_population_to_global(f_3, _f_post_collision, i, j)
-            write_population_to_global(f_2, _f_out, i, j)
+
+            write_population_to_global(f_2, _f_out, i, j, k)
+
+        @wp.func
+        def functional_fused_step_with_bc(
+            f_1: wp.array4d(dtype=self.store_dtype),
+            f_2: wp.array4d(dtype=self.store_dtype),
+            f_3: wp.array4d(dtype=self.store_dtype),
+            defect_correction: wp.array4d(dtype=self.store_dtype),
+            force: wp.array4d(dtype=self.store_dtype),
+            boundary_info: wp.array4d(dtype=wp.int8),
+            boundary_vals: boundary_values_struct,
+            i: wp.int32,
+            j: wp.int32,
+            k: wp.int32,
+            omega: vec,
+            gamma: self.compute_dtype,
+            K: self.compute_dtype,
+            mu: self.compute_dtype,
+            theta: self.compute_dtype,
+            defect_factor: self.compute_dtype,
+            f_3_uninitialized: wp.bool,
+        ):
+            """
+            Functional for fused collide-stream-relax smoothing step with Dirichlet/VN BC
+                at lattice point (i,j) of load case k (see kernel_fused_with_bc for the arguments)
+            """
+            force_x = self.compute_dtype(force[0, i, j, k])
+            force_y = self.compute_dtype(force[1, i, j, k])
+
+            _f_pre_collision = read_local_population(f_1, i, j, k)
+            _f_post_collision = self.collision.functional_stored(
+                _f_pre_collision, force_x, force_y, omega, theta
+            )
+            _f_previous_post_collision = _f_post_collision
+            if not f_3_uninitialized:
+                _f_previous_post_collision = read_local_population(f_3, i, j, k)
+            _f_out = functional_relax_with_bc(
+                _f_pre_collision,
+                _f_post_collision,
+                _f_previous_post_collision,
+                functional_pull_post_collision(f_1, force, wp.vec3i(i, j, k), omega, theta),
+                read_local_population(defect_correction, i, j, k),
+                force,
+                boundary_info,
+                boundary_vals,
+                i,
+                j,
+                k,
+                omega,
+                gamma,
+                K,
+                mu,
+                theta,
+                defect_factor,
+            )
+            write_population_to_global(f_3, _f_post_collision, i, j, k)
+            write_population_to_global(f_2, _f_out, i, j, k)
 
         @wp.kernel
-        def kernel_residual_norm_squared_with_bc(
+        def kernel_fused_with_bc(
+            f_1: wp.array4d(dtype=self.store_dtype),  # pre-collision
+            f_2: wp.array4d(dtype=self.store_dtype),  # output
+            f_3: wp.array4d(dtype=self.store_dtype),  # previous post collision
+            defect_correction: wp.array4d(dtype=self.store_dtype),
+            force: wp.array4d(dtype=self.store_dtype),
+            boundary_info: wp.array4d(dtype=wp.int8),
+            boundary_vals: boundary_values_struct,
+            omega: vec,
+            gamma: self.compute_dtype,
+            K: self.compute_dtype,
+            mu: self.compute_dtype,
+            theta: self.compute_dtype,
+            defect_factor: self.compute_dtype,
+            f_3_uninitialized: wp.bool,
+            row_spans: wp.array2d(dtype=wp.int32),
+        ):
+            """
+            Kernel for fused collide-stream-relax smoothing step with Dirichlet/VN BC
+
+            f_1: grid of pre-collision populations at smoothing step i
+            f_2: grid with arbitrary values (must not be the same array as f_1)
+            f_3: grid of post-collision populations at smoothing step i-1
+            defect_correction: grid with defect correction populations
+            force: grid with forcing terms
+            boundary_info: array encoding node type and populations to reconstruct for BC
+                (see solid_boundary.py)
+            boundary_vals: array encoding boundary values for BC
+            omega: vector of omega values
+            gamma: relaxation parameter
+            K, mu: material parameters
+            theta: lattice parameter
+            defect_factor: factor for defect correction term
+            f_3_uninitialized: if True, the post-collision populations at smoothing step i
+                are used in place of f_3
+            row_spans: spans of the nodes to update (see ActiveCells)
+
+            exits with:
+                pre-collision populations at smoothing step i+1 written to f_2
+                post-collision populations at smoothing step i written to f_3
+            """
+            i, t, k = wp.tid()
+            j = active_node(row_spans, i, t)
+            if j < 0:
+                return
+            functional_fused_step_with_bc(
+                f_1,
+                f_2,
+                f_3,
+                defect_correction,
+                force,
+                boundary_info,
+                boundary_vals,
+                i,
+                j,
+                k,
+                omega,
+                gamma,
+                K,
+                mu,
+                theta,
+                defect_factor,
+                f_3_uninitialized,
+            )
+
+        @wp.kernel
+        def kernel_boundary(
+            f_1: wp.array4d(dtype=self.store_dtype),  # post-collision
+            f_2: wp.array4d(dtype=self.store_dtype),  # old pre-collision (for relaxation)
+            f_3: wp.array4d(dtype=self.store_dtype),  # previous post collision
+            defect_correction: wp.array4d(dtype=self.store_dtype),
+            force: wp.array4d(dtype=self.store_dtype),
+            boundary_info: wp.array4d(dtype=wp.int8),
+            boundary_vals: boundary_values_struct,
+            boundary_nodes: wp.array1d(dtype=wp.int32),
+            boundary_output: wp.array4d(dtype=self.store_dtype),
+            omega: vec,
+            gamma: self.compute_dtype,
+            K: self.compute_dtype,
+            mu: self.compute_dtype,
+            theta: self.compute_dtype,
+            defect_factor: self.compute_dtype,
+            f_3_uninitialized: wp.bool,
+        ):
+            """
+            Kernel for the boundary part of a split smoothing step with Dirichlet/VN BC
+            (one thread per listed node and load case, see split_boundary)
+
+            boundary_nodes: linear indices of the boundary and ghost nodes
+                (see solid_boundary.get_boundary_nodes)
+            boundary_output: array with arbitrary values,
+                shape (9, number of listed nodes, 1, number of load cases)
+            f_3_uninitialized: if True, the post-collision populations at smoothing step i
+                are used in place of f_3
+            other arguments: see kernel_with_bc
+
+            exits with:
+                pre-collision populations at smoothing step i+1 of the listed nodes written to
+                    boundary_output (f_2 is left unchanged, so it can be read by kernel)
+                post-collision populations at smoothing step i of the listed nodes (except ghost
+                    nodes) written to f_3
+            """
+            b, k = wp.tid()
+            nodes_y = f_1.shape[2]
+            i = boundary_nodes[b] // nodes_y
+            j = boundary_nodes[b] % nodes_y
+
+            _f_pre_collision = read_local_population(f_2, i, j, k)
+            _defect = read_local_population(defect_correction, i, j, k)
+            if boundary_info[0, i, j, 0] == wp.int8(0):
+                # ghost node, the BC sets the streamed populations to zero
+                _f_out = functional_relax(
+                    zero_vec(), _f_pre_collision, _defect, gamma, defect_factor
+                )
+            else:
+                _f_post_collision = read_local_population(f_1, i, j, k)
+                _f_previous_post_collision = _f_post_collision
+                if not f_3_uninitialized:
+                    _f_previous_post_collision = read_local_population(f_3, i, j, k)
+                _f_out = functional_relax_with_bc(
+                    _f_pre_collision,
+                    _f_post_collision,
+                    _f_previous_post_collision,
+                    pull_population(f_1, i, j, k),
+                    _defect,
+                    force,
+                    boundary_info,
+                    boundary_vals,
+                    i,
+                    j,
+                    k,
+                    omega,
+                    gamma,
+                    K,
+                    mu,
+                    theta,
+                    defect_factor,
+                )
+                write_population_to_global(f_3, _f_post_collision, i, j, k)
+            write_population_to_global(boundary_output, _f_out, b, 0, k)
+
+        @wp.kernel
+        def kernel_fused_boundary(
+            f_1: wp.array4d(dtype=self.store_dtype),  # pre-collision
+            f_2: wp.array4d(dtype=self.store_dtype),  # output
+            f_3: wp.array4d(dtype=self.store_dtype),  # previous post collision
+            defect_correction: wp.array4d(dtype=self.store_dtype),
+            force: wp.array4d(dtype=self.store_dtype),
+            boundary_info: wp.array4d(dtype=wp.int8),
+            boundary_vals: boundary_values_struct,
+            boundary_nodes: wp.array1d(dtype=wp.int32),
+            omega: vec,
+            gamma: self.compute_dtype,
+            K: self.compute_dtype,
+            mu: self.compute_dtype,
+            theta: self.compute_dtype,
+            defect_factor: self.compute_dtype,
+            f_3_uninitialized: wp.bool,
+        ):
+            """
+            Kernel for the boundary part of a split fused smoothing step with Dirichlet/VN BC
+            (one thread per listed node and load case, see split_boundary)
+
+            boundary_nodes: linear indices of the boundary and ghost nodes
+                (see solid_boundary.get_boundary_nodes)
+            other arguments: see kernel_fused_with_bc
+
+            exits with:
+                pre-collision populations at smoothing step i+1 of the listed nodes written to f_2
+                post-collision populations at smoothing step i of the listed nodes (except ghost
+                    nodes) written to f_3
+            """
+            b, k = wp.tid()
+            nodes_y = f_1.shape[2]
+            i = boundary_nodes[b] // nodes_y
+            j = boundary_nodes[b] % nodes_y
+
+            if boundary_info[0, i, j, 0] == wp.int8(0):
+                # ghost node, the BC sets the streamed populations to zero
+                _f_out = functional_relax(
+                    zero_vec(),
+                    read_local_population(f_1, i, j, k),
+                    read_local_population(defect_correction, i, j, k),
+                    gamma,
+                    defect_factor,
+                )
+                write_population_to_global(f_2, _f_out, i, j, k)
+                return
+            functional_fused_step_with_bc(
+                f_1,
+                f_2,
+                f_3,
+                defect_correction,
+                force,
+                boundary_info,
+                boundary_vals,
+                i,
+                j,
+                k,
+                omega,
+                gamma,
+                K,
+                mu,
+                theta,
+                defect_factor,
+                f_3_uninitialized,
+            )
+
+        @wp.func
+        def functional_residual_with_bc(
             f_1: wp.array4d(dtype=self.store_dtype),  # post-collision
             f_2: wp.array4d(dtype=self.store_dtype),  # pre-collision
             f_3: wp.array4d(dtype=self.store_dtype),  # previous post collision
             force: wp.array4d(dtype=self.store_dtype),
             boundary_info: wp.array4d(dtype=wp.int8),
-            boundary_vals: wp.array4d(dtype=self.store_dtype),
+            boundary_vals: boundary_values_struct,
+            i: wp.int32,
+            j: wp.int32,
+            k: wp.int32,
             omega: vec,
             K: self.compute_dtype,
             mu: self.compute_dtype,
             theta: self.compute_dtype,
-            res_norm: wp.array1d(dtype=self.store_dtype),
         ):
             """
-            Computes squared L2 norm of residual of elastostatic LSE
+            Computes residual of elastostatic LSE at lattice point (i,j) of load case k
             (with Dirichlet/VN BC)
 
             f_1: grid of post-collision populations at smoothing step i
@@ -281,24 +870,26 @@ class MultigridStepper(Stepper):
             boundary_info: array encoding node type and populations to reconstruct for BC
                 (see solid_boundary.py)
             boundary_vals: array encoding boundary values for BC
+            i, j: indices of lattice point
+            k: index of load case
             omega: vec of omega values
             K, mu: material parameters
             theta: lattice parameter
-            res_norm: 1d warp array to store result
 
-            exits with:
-                squared L2 norm of residual written to res_norm[0]
+            returns:
+                vector with residual at lattice point (zero for ghost nodes)
             """
-            i, j, k = wp.tid()
-            index = wp.vec3i(i, j, k)
+            _res = vec()
+            if boundary_info[0, i, j, 0] == wp.int8(0):
+                return _res
 
-            _f_old = read_local_population(f_2, i, j)
-            _f_post_collision = read_local_population(f_1, i, j)
-            _f_post_stream = self.stream.warp_functional(f_1, index)
-            _f_previous_post_collision = read_local_population(f_3, i, j)
+            _f_old = to_populations(read_local_population(f_2, i, j, k))
+            _f_post_collision = read_local_population(f_1, i, j, k)
+            _f_post_stream = pull_population(f_1, i, j, k)
+            _f_previous_post_collision = read_local_population(f_3, i, j, k)
 
-            force_x = self.compute_dtype(force[0, i, j, 0])
-            force_y = self.compute_dtype(force[1, i, j, 0])
+            force_x = self.compute_dtype(force[0, i, j, k])
+            force_y = self.compute_dtype(force[1, i, j, k])
             _bared_m = self.bared_moments.warp_functional(
                 f_vec=_f_old, force_x=force_x, force_y=force_y, omega=omega, theta=theta
             )
@@ -319,47 +910,131 @@ class MultigridStepper(Stepper):
                 theta=theta,
             )
 
-            _local_res = self.compute_dtype(0)
-            if boundary_info[0, i, j, 0] != wp.int8(0):
-                for l in range(self.velocity_set.q):
-                    _local_res += (_f_new[l] - _f_old[l]) * (_f_new[l] - _f_old[l])
+            for l in range(self.velocity_set.q):
+                _res[l] = _f_new[l] - _f_old[l]
+            return _res
+
+        @wp.kernel
+        def kernel_residual_norm_with_bc(
+            f_1: wp.array4d(dtype=self.store_dtype),  # post-collision
+            f_2: wp.array4d(dtype=self.store_dtype),  # pre-collision
+            f_3: wp.array4d(dtype=self.store_dtype),  # previous post collision
+            force: wp.array4d(dtype=self.store_dtype),
+            boundary_info: wp.array4d(dtype=wp.int8),
+            boundary_vals: boundary_values_struct,
+            omega: vec,
+            K: self.compute_dtype,
+            mu: self.compute_dtype,
+            theta: self.compute_dtype,
+            partials: wp.array2d(dtype=self.norm_reduction.stats_vec),
+            block_size: wp.int32,
+        ):
+            """
+            First pass of the residual norm reduction of elastostatic LSE
+            (with Dirichlet/VN BC, see multigrid_reduction.py)
 
-            wp.atomic_add(res_norm, 0, self.store_dtype(_local_res))
+            f_1, f_2, f_3, force, boundary_info, boundary_vals, omega, K, mu, theta:
+                see functional_residual_with_bc
+            partials: array with arbitrary values, one row per load case and one entry per block
+                of nodes
+            block_size: number of nodes per block
+
+            exits with:
+                residual statistics of each block of nodes of load case k written to partials[k]
+            """
+            k, b = wp.tid()
+            nodes_y = f_1.shape[2]
+            num_nodes = f_1.shape[1] * nodes_y
+
+            _stats = self.norm_reduction.stats_vec()
+            for n in range(b * block_size, wp.min((b + 1) * block_size, num_nodes)):
+                _res = functional_residual_with_bc(
+                    f_1,
+                    f_2,
+                    f_3,
+                    force,
+                    boundary_info,
+                    boundary_vals,
+                    n // nodes_y,
+                    n % nodes_y,
+                    k,
+                    omega,
+                    K,
+                    mu,
+                    theta,
+                )
+                _stats = self.norm_reduction.warp_functional(_stats, _res)
+            partials[k, b] = _stats
 
         @wp.kernel
-        def kernel_residual_norm_squared_no_bc(
+        def kernel_residual_norm_no_bc(
             f_1: wp.array4d(dtype=self.store_dtype),  # post-collision
             f_2: wp.array4d(dtype=self.store_dtype),  # pre-collision
-            res_norm: wp.array1d(dtype=self.store_dtype),
+            partials: wp.array2d(dtype=self.norm_reduction.stats_vec),
+            block_size: wp.int32,
         ):
             """
-            Computes squared L2 norm of residual of elastostatic LSE
-            (with Dirichlet/VN BC)
+            First pass of the residual norm reduction of elastostatic LSE
+            (with periodic BC, see multigrid_reduction.py)
 
             f_1: grid of post-collision populations at smoothing step i
             f_2: grid of pre-collision populations at smoothing step i
-            res_norm: 1d warp array to store result
+            partials: array with arbitrary values, one row per load case and one entry per block
+                of nodes
+            block_size: number of nodes per block
 
             exits with:
-                squared L2 norm of residual written to res_norm[0]
+                residual statistics of each block of nodes of load case k written to partials[k]
             """
-            i, j, k = wp.tid()
-            index = wp.vec3i(i, j, k)
+            k, b = wp.tid()
+            nodes_y = f_1.shape[2]
+            num_nodes = f_1.shape[1] * nodes_y
 
-            _f_old = read_local_population(f_2, i, j)
-            _f_new = self.stream.warp_functional(f_1, index)
+            _stats = self.norm_reduction.stats_vec()
+            for n in range(b * block_size, wp.min((b + 1) * block_size, num_nodes)):
+                i = n // nodes_y
+                j = n % nodes_y
+                _f_old = to_populations(read_local_population(f_2, i, j, k))
+                _f_new = pull_population(f_1, i, j, k)
+                _stats = self.norm_reduction.warp_functional(_stats, _f_new - _f_old)
+            partials[k, b] = _stats
 
-            _local_res = self.compute_dtype(0)
-            for l in range(self.velocity_set.q):
-                _local_res += (_f_new[l] - _f_old[l]) * (_f_new[l] - _f_old[l])
+        @wp.kernel
+        def kernel_set_force(
+            force_load: wp.array4d(dtype=Any),
+            force: wp.array4d(dtype=self.store_dtype),
+            dt: wp.float64,
+            kappa: wp.float64,
+        ):
+            """
+            Makes a force load dimensionless (in double precision, as it is done on the host)
+
+            force_load: grid with force load in physical units
+            force: grid with arbitrary values
+
+            exits with:
+                force load scaled by dt / kappa written to force
+            """
+            i, j, k = wp.tid()
+            for d in range(2):
+                force[d, i, j, k] = self.store_dtype(
+                    wp.float64(force_load[d, i, j, k]) * dt / kappa
+                )
 
-            wp.atomic_add(res_norm, 0, self.store_dtype(_local_res))
+        # overloads for host and device force loads are defined up front, not on first launch
+        for dtype in (wp.float32, wp.float64):
+            wp.overload(kernel_set_force, {"force_load": wp.array4d(dtype=dtype)})
 
-        return None, (
+        return functional_pull_post_collision, (
             kernel,
             kernel_with_bc,
-            kernel_residual_norm_squared_no_bc,
-            kernel_residual_norm_squared_with_bc,
+            kernel_residual_norm_no_bc,
+            kernel_residual_norm_with_bc,
+            kernel_fused,
+            kernel_fused_with_bc,
+            kernel_boundary,
+            kernel_fused_boundary,
+            kernel_set_force,
         )
 
     @Operator.register_backend(ComputeBackend.WARP)
@@ -388,24 +1063,84 @@ class MultigridStepper(Stepper):
 
         Exits with:
             pre-collision populations at smoothing step i+1 written to f_1
+            (with fused_smoothing: written to f_2 instead, f_1 is left unchanged)
+
+        returns:
+            the grid the pre-collision populations at smoothing step i+1 were written to
         """
         if gamma is None:
             gamma = self.gamma
-        self.collision(f_1, f_2, self.force, self.omega)
+        if self.fused_smoothing:
+            return self._fused_step(
+                f_1, f_2, f_3, defect_correction, f_3_uninitialized, gamma, defect_factor
+            )
+        self.collision(f_1, f_2, self.force, self.omega, self.active_cells)
         if self.boundary_conditions is None:
-            wp.launch(
+            launch(
+                self.warp_kernel[0],
+                inputs=[
+                    f_2,
+                    f_1,
+                    defect_correction,
+                    self.force,
+                    gamma,
+                    defect_factor,
+                    self.active_cells.row_spans,
+                ],
+                dim=self.active_cells.dim,
+            )
+        elif self.split_boundary:
+            # the boundary kernel reads f_1 before the periodic kernel overwrites it in place,
+            # so its results are buffered and scattered afterwards
+            params = self.params
+            launch(
+                self.warp_kernel[6],
+                inputs=[
+                    f_2,
+                    f_1,
+                    f_3,
+                    defect_correction,
+                    self.force,
+                    self.boundary_conditions,
+                    self.boundary_values,
+                    self.boundary_nodes,
+                    self.boundary_output,
+                    self.omega,
+                    gamma,
+                    params.K,
+                    params.mu,
+                    params.theta,
+                    defect_factor,
+                    f_3_uninitialized,
+                ],
+                dim=(self.boundary_nodes.shape[0], self.batch_size),
+            )
+            launch(
                 self.warp_kernel[0],
-                inputs=[f_2, f_1, defect_correction, self.force, gamma, defect_factor],
-                dim=f_2.shape[1:],
+                inputs=[
+                    f_2,
+                    f_1,
+                    defect_correction,
+                    self.force,
+                    gamma,
+                    defect_factor,
+                    self.active_cells.row_spans,
+                ],
+                dim=self.active_cells.dim,
+            )
+            launch(
+                self.scatter_to_nodes,
+                inputs=[self.boundary_output, self.boundary_nodes, f_1],
+                dim=(self.boundary_nodes.shape[0], self.batch_size),
             )
         else:
-            params = SimulationParams()
+            params = self.params
             K = params.K
             theta = params.theta
             mu = params.mu
             if f_3_uninitialized:
-                wp.launch(self.copy_populations, inputs=[f_2, f_3, 9], dim=f_2.shape[1:])
-            wp.launch(
+                launch(self.copy_populations, inputs=[f_2, f_3, f_2.shape[0]], dim=f_2.shape[1:])
+            launch(
                 self.warp_kernel[1],
                 inputs=[
                     f_2,
@@ -416,40 +1151,156 @@ class MultigridStepper(Stepper):
                     self.boundary_conditions,
                     self.boundary_values,
                     self.omega,
-                    self.gamma,
+                    gamma,
                     K,
                     mu,
                     theta,
                     defect_factor,
+                    self.active_cells.row_spans,
                 ],
-                dim=f_1.shape[1:],
+                dim=self.active_cells.dim,
             )
+        return f_1
+
+    def _fused_step(
+        self, f_1, f_2, f_3, defect_correction, f_3_uninitialized, gamma, defect_factor
+    ):
+        """
+        Performs one smoothing step with a single fused collide-stream-relax kernel
+            (with split_boundary: the periodic one, followed by the boundary kernel)
+
+        f_1: grid of pre-collision populations at smoothing step i
+        f_2: grid with arbitrary values
+        f_3: grid of post-collision populations at smoothing step i-1 (only needed for BC)
+        defect_correction: grid with defect correction values
+        f_3_uninitialized: set to True if no post-collision populations from previous step available
+        gamma: relaxation parameter
+        defect_factor: multiplicative factor for defect correction
+
+        Exits with:
+            pre-collision populations at smoothing step i+1 written to f_2
+
+        returns:
+            f_2
+        """
+        params = self.params
+        theta = params.theta
+        if self.boundary_conditions is None or self.split_boundary:
+            launch(
+                self.warp_kernel[4],
+                inputs=[
+                    f_1,
+                    f_2,
+                    defect_correction,
+                    self.force,
+                    self.omega,
+                    gamma,
+                    theta,
+                    defect_factor,
+                    self.active_cells.row_spans,
+                ],
+                dim=self.active_cells.dim,
+            )
+        if self.boundary_conditions is None:
+            return f_2
+        K = params.K
+        mu = params.mu
+        if self.split_boundary:
+            # f_1 is left unchanged, so the listed nodes can be overwritten in f_2 directly
+            launch(
+                self.warp_kernel[7],
+                inputs=[
+                    f_1,
+                    f_2,
+                    f_3,
+                    defect_correction,
+                    self.force,
+                    self.boundary_conditions,
+                    self.boundary_values,
+                    self.boundary_nodes,
+                    self.omega,
+                    gamma,
+                    K,
+                    mu,
+                    theta,
+                    defect_factor,
+                    f_3_uninitialized,
+                ],
+                dim=(self.boundary_nodes.shape[0], self.batch_size),
+            )
+        else:
+            launch(
+                self.warp_kernel[5],
+                inputs=[
+                    f_1,
+                    f_2,
+                    f_3,
+                    defect_correction,
+                    self.force,
+                    self.boundary_conditions,
+                    self.boundary_values,
+                    self.omega,
+                    gamma,
+                    K,
+                    mu,
+                    theta,
+                    defect_factor,
+                    f_3_uninitialized,
+                    self.active_cells.row_spans,
+                ],
+                dim=self.active_cells.dim,
+            )
+        return f_2
 
     def get_residual_norm(self, f_1, f_2):
         """
         Get residual of elastostatic LSE for current approximation f_1
-
+        (synchronizes with the device, see get_residual_norms for recording norms on the device)
 
         f_1: grid with pre-collision population at smoothing step i
         f_2: grid with arbitrary values
 
         returns:
-            norm of residual, normalised by grid shape
+            L2 norm of residual, normalised by grid shape
+            (numpy array with one norm per load case if batch_size > 1)
+        """
+        if self._residual_norm_output is None:
+            self._residual_norm_output = self.norm_reduction.create_output(
+                batch_size=self.batch_size
+            )
+        self.get_residual_norms(f_1, f_2, self._residual_norm_output)
+        l2 = self.norm_reduction.read(self._residual_norm_output)["l2"][0]
+        return float(l2) if self.batch_size == 1 else l2
+
+    def get_residual_norms(self, f_1, f_2, output, slot=0):
+        """
+        Get L2, Linf and moment norms of residual of elastostatic LSE for current approximation f_1
+
+        f_1: grid with pre-collision population at smoothing step i
+        f_2: grid with arbitrary values
+        output: device buffer created by self.norm_reduction.create_output
+        slot: entry of output to write to
+
+        Exits with:
+            norms of residual written to output[slot] (see multigrid_reduction.py),
+            without synchronizing with the host
         """
-        self.collision(f_1, f_2, self.force, self.omega)
-        res_norm = wp.zeros(shape=(1), dtype=self.store_dtype)
+        self.collision(f_1, f_2, self.force, self.omega, self.active_cells)
+        num_nodes = f_1.shape[1] * f_1.shape[2]
+        partials = self.norm_reduction.get_partials(num_nodes, self.batch_size)
+        block_size = self.norm_reduction.block_size
         if self.boundary_conditions is None:
-            wp.launch(
+            launch(
                 self.warp_kernel[2],
-                inputs=[f_2, f_1, res_norm],
-                dim=f_1.shape[1:],
+                inputs=[f_2, f_1, partials, block_size],
+                dim=partials.shape,
             )
         else:
-            params = SimulationParams()
+            params = self.params
             K = params.K
             theta = params.theta
             mu = params.mu
-            wp.launch(
+            launch(
                 self.warp_kernel[3],
                 inputs=[
                     f_2,
@@ -462,23 +1313,30 @@ class MultigridStepper(Stepper):
                     K,
                     mu,
                     theta,
-                    res_norm,
+                    partials,
+                    block_size,
                 ],
-                dim=f_2.shape[1:],
+                dim=partials.shape,
             )
-
-        return math.sqrt(1 / (f_1.shape[0] * f_1.shape[1] * f_1.shape[2]) * res_norm.numpy()[0])
+        return self.norm_reduction(partials, num_nodes, output, slot)
 
     def get_macroscopics(self, f, output_array):
         """
         Gets macroscopic values
 
-        f: grid with pre-collision populations at smoothing step i
+        f: grid with pre-collision populations at smoothing step i (moments if moment_storage)
         output_array: grid with arbitary values
 
         exits with:
             macroscopics written to output_array
         """
+        if self.moment_storage:
+            wp.launch(
+                self.convert_moments_to_populations,
+                inputs=[f, output_array],
+                dim=f.shape[1:],
+            )
+            f = output_array
         self.bared_moments(f=f, output_array=output_array, force=self.force)
         return self.macroscopic(
             bared_moments=output_array, output_array=output_array, force=self.force
@@ -495,10 +1353,37 @@ class MultigridStepper(Stepper):
             velocity_set=self.velocity_set,
             precision_policy=self.precision_policy,
             compute_backend=self.compute_backend,
+            params=self.params,
         )
+        self._set_node_index()
+
+    def _set_node_index(self):
+        """
+        Sets up the active cells the kernels are launched over (all nodes unless skip_ghost_nodes)
+            and, with split_boundary and BC, lists the boundary and ghost nodes and allocates the
+            buffer of the boundary kernel
+        """
+        nodes_x, nodes_y = self.grid.shape[0], self.grid.shape[1]
+        if self.skip_ghost_nodes and self.boundary_conditions is not None:
+            self.active_cells = ActiveCells(
+                nodes_x, nodes_y, self.boundary_conditions, batch_size=self.batch_size
+            )
+        else:
+            self.active_cells = ActiveCells(
+                nodes_x, nodes_y, device=self.force.device, batch_size=self.batch_size
+            )
+        self.boundary_nodes = None
+        self.boundary_output = None
+        if self.split_boundary and self.boundary_conditions is not None:
+            self.boundary_nodes = get_boundary_nodes(self.boundary_conditions, self.active_cells)
+            self.boundary_output = wp.zeros(
+                (self.velocity_set.q, self.boundary_nodes.shape[0], 1, self.batch_size),
+                dtype=self.store_dtype,
+                device=self.boundary_conditions.device,
+            )
 
     def collide(self, f_1, f_2):
         """
         Perform collision step
         """
-        self.collision(f_1, f_2, self.force, self.omega)
+        self.collision(f_1, f_2, self.force, self.omega, self.active_cells)
@@ -0,0 +1,46 @@
+import math
+import warp as wp
+
+
+class Workspace:
+    """
+    Arena of scratch fields shared by the levels of a multigrid hierarchy
+
+    Scratch fields are grouped into slots by their lifetime. All fields borrowed from one slot
+        are views of the same memory, so fields of a slot may only be used by one level at a time.
+        A level's smoothing step and residual evaluation are finished before the next level starts,
+        so e.g. the temporaries of all smoothing steps of the hierarchy can share one slot.
+    Each slot is allocated on first use with the capacity of the largest (finest) field.
+    """
+
+    def __init__(self, capacity, dtype):
+        """
+        capacity: maximum number of values of a field borrowed from the workspace
+            (cardinality * nodes_x * nodes_y of finest level)
+        dtype: warp dtype of the fields
+        """
+        self.capacity = capacity
+        self.dtype = dtype
+        self.buffers = dict()
+
+    def get_field(self, slot, shape):
+        """
+        Borrows a field from the workspace
+
+        slot: name of the slot (fields with overlapping lifetimes need different slots)
+        shape: shape of the field, e.g. (9, nodes_x, nodes_y, 1)
+
+        returns:
+            warp array of shape shape, aliasing all other fields of the slot
+        """
+        size = math.prod(shape)
+        assert size <= self.capacity, "Field does not fit into workspace"
+        if slot not in self.buffers:
+            self.buffers[slot] = wp.zeros(shape=self.capacity, dtype=self.dtype)
+        return self.buffers[slot][0:size].reshape(shape)
+
+    def free(self):
+        """
+        Free device memory of all slots (borrowed fields must not be used afterwards)
+        """
+        self.buffers.clear()
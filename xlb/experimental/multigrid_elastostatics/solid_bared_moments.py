@@ -8,14 +8,28 @@ from xlb.compute_backend import ComputeBackend
 from xlb.precision_policy import PrecisionPolicy
 from xlb.operator.operator import Operator
 import xlb.experimental.multigrid_elastostatics.solid_utils as utils
-from xlb.experimental.multigrid_elastostatics.solid_simulation_params import SimulationParams
+from xlb.experimental.multigrid_elastostatics.solid_simulation_params import get_context
 from xlb.experimental.multigrid_elastostatics.kernel_provider import KernelProvider
 
 
 class SolidBaredMoments(Operator):
     """Operator which calculates bared moments"""
 
-    def __init__(self, grid, omega, velocity_set=None, precision_policy=None, compute_backend=None):
+    def __init__(
+        self,
+        grid,
+        omega,
+        velocity_set=None,
+        precision_policy=None,
+        compute_backend=None,
+        params=None,
+    ):
+        """
+        grid: grid object
+        omega: vector of relaxation rates
+        params: ParameterContext of the material (defaults to the current SimulationParams)
+        """
+        self.params = get_context(params)
         super().__init__(
             velocity_set=velocity_set,
             precision_policy=precision_policy,
@@ -35,7 +49,7 @@ class SolidBaredMoments(Operator):
 
     def _construct_warp(self):
         # get warp funcs
-        kernel_provider = KernelProvider()
+        kernel_provider = KernelProvider(self.precision_policy, self.params)
         vec = kernel_provider.vec
         read_local_population = kernel_provider.read_local_population
         calc_moments = kernel_provider.calc_moments
@@ -99,22 +113,21 @@ class SolidBaredMoments(Operator):
                 bared moments written to bared_moments
             """
             i, j, k = wp.tid()
-            f_vec = read_local_population(f, i, j)
-            force_x = self.compute_dtype(force[0, i, j, 0])
-            force_y = self.compute_dtype(force[1, i, j, 0])
+            f_vec = read_local_population(f, i, j, k)
+            force_x = self.compute_dtype(force[0, i, j, k])
+            force_y = self.compute_dtype(force[1, i, j, k])
 
             bared_m = functional(
                 f_vec=f_vec, force_x=force_x, force_y=force_y, omega=omega, theta=theta
             )
 
-            write_population_to_global(bared_moments, bared_m, i, j)
+            write_population_to_global(bared_moments, bared_m, i, j, k)
 
         return functional, kernel
 
     @Operator.register_backend(ComputeBackend.WARP)
     def warp_implementation(self, f, output_array, force):
-        params = SimulationParams()
-        theta = params.theta
+        theta = self.params.theta
         wp.launch(
             self.warp_kernel,
             inputs=[output_array, f, force, self.omega, theta],
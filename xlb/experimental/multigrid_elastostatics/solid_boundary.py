@@ -9,8 +9,11 @@ from xlb.utils import save_image
 from xlb.compute_backend import ComputeBackend
 from xlb.operator.operator import Operator
 import xlb.experimental.multigrid_elastostatics.solid_utils as utils
-from xlb.experimental.multigrid_elastostatics.solid_simulation_params import SimulationParams
-from xlb.experimental.multigrid_elastostatics.kernel_provider import KernelProvider
+from xlb.experimental.multigrid_elastostatics.solid_simulation_params import get_context
+from xlb.experimental.multigrid_elastostatics.kernel_provider import (
+    KernelProvider,
+    get_boundary_values_struct,
+)
 from xlb import DefaultConfig
 
 
@@ -25,7 +28,13 @@ class SolidsBoundary(Operator):
         velocity_set: VelocitySet = None,
         precision_policy: PrecisionPolicy = None,
         compute_backend: ComputeBackend = None,
+        params=None,
     ):
+        """
+        force: grid with the force load
+        params: ParameterContext of the material (defaults to the current SimulationParams)
+        """
+        self.params = get_context(params)
         super().__init__(
             velocity_set,
             precision_policy,
@@ -35,17 +44,19 @@ class SolidsBoundary(Operator):
 
     def _construct_warp(self):
         opp_indices = self.velocity_set.opp_indices
-        w = self.velocity_set.w
-        c = self.velocity_set.c_float
         q = self.velocity_set.q
+        # lattice weights and velocities in compute precision (the velocity set's constants are
+        # in the default precision, which may differ from the precision policy of this operator)
+        w = wp.constant(wp.vec(q, dtype=self.compute_dtype)(self.velocity_set._w))
+        c = wp.constant(
+            wp.mat((self.velocity_set.d, q), dtype=self.compute_dtype)(self.velocity_set._c_float)
+        )
 
-        kernel_provider = KernelProvider()
+        kernel_provider = KernelProvider(self.precision_policy, self.params)
+        boundary_values_struct = kernel_provider.boundary_values_struct
         vec = kernel_provider.vec
-        bc_info_vec = kernel_provider.bc_info_vec
-        bc_val_vec = kernel_provider.bc_val_vec
-        read_bc_info = kernel_provider.read_bc_info
-        read_bc_vals = kernel_provider.read_bc_vals
         read_local_population = kernel_provider.read_local_population
+        find_boundary_node = kernel_provider.find_boundary_node
         calc_moments = kernel_provider.calc_moments
         calc_equilibrium = kernel_provider.calc_equilibrium
         calc_populations = kernel_provider.calc_populations
@@ -94,20 +105,20 @@ class SolidsBoundary(Operator):
             f_out = f_current_vec
 
             # bounceback with zero order correction
-            f_out[new_direction] = self.store_dtype(
+            f_out[new_direction] = self.compute_dtype(
                 self.compute_dtype(f_previous_post_collision_vec[old_direction])
                 + self.compute_dtype(6.0) * weight * (x_dir * u_x + y_dir * u_y)
             )
             # add first order correction
             if wp.abs(wp.abs(x_dir) + wp.abs(y_dir) - self.compute_dtype(1.0)) < 1e-3:
-                f_out[new_direction] += self.store_dtype(
+                f_out[new_direction] += self.compute_dtype(
                     self.compute_dtype(6.0)
                     * weight
                     * (q_ij - self.compute_dtype(0.5))
                     * (wp.abs(x_dir) * dx_u_x + wp.abs(y_dir) * dy_u_y)
                 )
             if wp.abs(wp.abs(x_dir) + wp.abs(y_dir) - self.compute_dtype(2.0)) < 1e-3:
-                f_out[new_direction] += self.store_dtype(
+                f_out[new_direction] += self.compute_dtype(
                     self.compute_dtype(6.0)
                     * weight
                     * (q_ij - self.compute_dtype(0.5))
@@ -274,7 +285,7 @@ class SolidsBoundary(Operator):
             i: wp.int32,
             j: wp.int32,
             boundary_info: wp.array4d(dtype=wp.int8),
-            boundary_vals: wp.array4d(dtype=self.store_dtype),
+            boundary_vals: boundary_values_struct,
             force_x: self.compute_dtype,
             force_y: self.compute_dtype,
             bared_m_vec: vec,
@@ -292,9 +303,8 @@ class SolidsBoundary(Operator):
             f_previous_post_collision_vec: vector of populations after collision at time t - Delta t
             i,j: indices of lattice point
             boundary_info: array encoding the type of node (interior, boundary, ghost)
-                and which incoming populations to reconstruct
-            boundary_vals: array storing values needed for reconstructing
-                missing populations at boundary
+            boundary_vals: compact boundary values, listing the missing links of boundary nodes
+                and the values needed for reconstructing their populations
             force_x, force_y: forcing terms at lattice point
             bared_m_vec: vector of bared moments
             K, mu: material params
@@ -304,22 +314,27 @@ class SolidsBoundary(Operator):
                 vector of populations after streaming at time t, with boundary conditions applied
             """
             f_out_vec = f_post_stream_vec
+            node_type = boundary_info[0, i, j, 0]
             # -------------outside domain--------------
-            if boundary_info[0, i, j, 0] == wp.int8(0):  # if outside domain, just set to 0
+            if node_type == wp.int8(0):  # if outside domain, just set to 0
                 for l in range(self.velocity_set.q):
                     f_out_vec[l] = self.compute_dtype(0)
-            # -------------Dirichlet BC---------------
-            elif boundary_info[0, i, j, 0] == wp.int8(
-                2
-            ):  # for boundary nodes: check which directions need to be given by dirichlet BC
+            elif node_type == wp.int8(2) or node_type == wp.int8(3):
+                # links of the boundary node, ordered by direction
+                node = find_boundary_node(boundary_vals, i, j, boundary_info.shape[2])
+                link = boundary_vals.offsets[node]
+                end = boundary_vals.offsets[node + 1]
                 for l in range(self.velocity_set.q):
-                    if (
-                        boundary_info[l + 1, i, j, 0] == wp.int8(1)
-                    ):  # this means the interior node is connected to a ghost node in direction l; the bounce back bc needs to be applied
-                        # get values from value array
-                        u_x = self.compute_dtype(boundary_vals[l * 7, i, j, 0])
-                        u_y = self.compute_dtype(boundary_vals[l * 7 + 1, i, j, 0])
-                        q_ij = self.compute_dtype(boundary_vals[l * 7 + 6, i, j, 0])
+                    # the interior node is connected to a ghost node in direction l
+                    missing = False
+                    if link < end:
+                        missing = wp.int32(boundary_vals.directions[link]) == l
+                    # -------------Dirichlet BC---------------
+                    if missing and node_type == wp.int8(2):
+                        # the bounce back bc needs to be applied, get values from value table
+                        u_x = self.compute_dtype(boundary_vals.values[link, 0])
+                        u_y = self.compute_dtype(boundary_vals.values[link, 1])
+                        q_ij = self.compute_dtype(boundary_vals.values[link, 4])
                         f_out_vec = dirichlet_functional(
                             old_direction=l,
                             f_current_vec=f_out_vec,
@@ -331,18 +346,13 @@ class SolidsBoundary(Operator):
                             K=K,
                             mu=mu,
                         )
-            # -------------VN BC--------------------
-            elif boundary_info[0, i, j, 0] == wp.int8(
-                3
-            ):  # for boundary nodes: check which directions need to be given VN BC
-                for l in range(q):
-                    if boundary_info[l + 1, i, j, 0] == wp.int8(1):
-                        # print("Calling Von Neumann")
-                        n_x = self.compute_dtype(boundary_vals[l * 7, i, j, 0])
-                        n_y = self.compute_dtype(boundary_vals[l * 7 + 1, i, j, 0])
-                        T_x = self.compute_dtype(boundary_vals[l * 7 + 2, i, j, 0])
-                        T_y = self.compute_dtype(boundary_vals[l * 7 + 3, i, j, 0])
-                        q_ij = self.compute_dtype(boundary_vals[l * 7 + 6, i, j, 0])
+                    # -------------VN BC--------------------
+                    elif missing:
+                        n_x = self.compute_dtype(boundary_vals.values[link, 0])
+                        n_y = self.compute_dtype(boundary_vals.values[link, 1])
+                        T_x = self.compute_dtype(boundary_vals.values[link, 2])
+                        T_y = self.compute_dtype(boundary_vals.values[link, 3])
+                        q_ij = self.compute_dtype(boundary_vals.values[link, 4])
                         f_out_vec = vn_functional(
                             old_direction=l,
                             f_post_stream_vec=f_out_vec,
@@ -360,6 +370,8 @@ class SolidsBoundary(Operator):
                             tau_t=self.compute_dtype(0.5),
                             theta=theta,
                         )
+                    if missing:
+                        link += 1
             return f_out_vec
 
         # Kernel is not implemented. Boundary conditions are to be applied from
@@ -385,6 +397,7 @@ def init_bc_from_lambda(
     x,
     y,
     precision_policy=None,
+    params=None,
 ):
     """
     Initialize boundary conditions from a level set function given as a sympy expression
@@ -397,58 +410,158 @@ def init_bc_from_lambda(
     indicator: function taking x and y coordinates and returning <0 for Dirichlet BC and >0 for VN BC
     x, y: sympy symbols
     precision_policy: precision policy object (if None, default precision policy is used)
+    params: ParameterContext of the grid (if None, the current SimulationParams are used)
+
+    returns:
+        boundary_info: warp array encoding the type of node (interior, boundary, ghost)
+        boundary_values: compact boundary values (see get_boundary_values_struct), listing the
+            missing neighbors of the boundary nodes and the values needed for reconstructing
+            missing populations (e.g. boundary displacement, distance to boundary, normal vector,
+            traction, etc.)
+    """
+    potential = sympy.lambdify([x, y], potential_sympy)
+
+    # get gradients of potential
+    dx_potential = sympy.lambdify([x, y], sympy.diff(potential_sympy, x))
+    dy_potential = sympy.lambdify([x, y], sympy.diff(potential_sympy, y))
+
+    return _init_bc_from_functions(
+        potential,
+        (dx_potential, dy_potential),
+        grid,
+        dx,
+        velocity_set,
+        manufactured_displacement,
+        indicator,
+        x,
+        y,
+        precision_policy,
+        params=params,
+    )
+
+
+def init_bc_from_signed_distance(
+    signed_distance,
+    grid,
+    dx,
+    velocity_set,
+    manufactured_displacement,
+    indicator,
+    x,
+    y,
+    precision_policy=None,
+    params=None,
+):
+    """
+    Initialize boundary conditions from a level set function given as an array of node values
+        (e.g. a signed distance field, see solid_geometry.py)
+
+    The wall distance q_ij of a link is the root of the quadratic along the link matching the
+        values at both nodes and the gradient (central differences) at the inner node; normals
+        are the bilinearly interpolated gradient at the wall. Both are resolved below the grid
+        spacing.
+
+    signed_distance: numpy array with the shape of the grid, <= 0 inside the domain
+    grid, dx, velocity_set, manufactured_displacement, indicator, x, y, precision_policy, params:
+        see init_bc_from_lambda
 
     returns:
-        boundary_info: warp array encoding the type of node (interior, boundary, ghost), as well as missing neighbors
-        boundary_values: warp array storing values needed for reconstructing missing populations at boundary
-            (e.g. boundary displacement, distance to boundary, normal vector, traction, etc.)
+        boundary_info, boundary_values: see init_bc_from_lambda
+    """
+    signed_distance = np.asarray(signed_distance, dtype=np.float64).reshape(grid.shape[:2])
+    gradient = np.gradient(signed_distance, dx)
+
+    def wall_distance(i, j, x_direction, y_direction):
+        phi_0 = signed_distance[i, j]
+        phi_1 = signed_distance[i + x_direction, j + y_direction]
+        # quadratic phi_0 + slope * t + curvature * t^2 along the link
+        slope = (gradient[0][i, j] * x_direction + gradient[1][i, j] * y_direction) * dx
+        curvature = phi_1 - phi_0 - slope
+        discriminant = slope**2 - 4.0 * curvature * phi_0
+        with np.errstate(divide="ignore", invalid="ignore"):
+            q_ij = -2.0 * phi_0 / (slope + np.sqrt(discriminant))
+            q_linear = phi_0 / (phi_0 - phi_1)
+        # fall back to linear interpolation where the quadratic has no root on the link
+        valid = (discriminant >= 0) & (q_ij >= 0) & (q_ij <= 1)
+        return np.where(valid, q_ij, q_linear)
+
+    return _init_bc_from_functions(
+        _bilinear_interpolation(signed_distance, dx),
+        (_bilinear_interpolation(gradient[0], dx), _bilinear_interpolation(gradient[1], dx)),
+        grid,
+        dx,
+        velocity_set,
+        manufactured_displacement,
+        indicator,
+        x,
+        y,
+        precision_policy,
+        wall_distance=wall_distance,
+        params=params,
+    )
+
+
+def _init_bc_from_functions(
+    potential,
+    potential_gradient,
+    grid,
+    dx,
+    velocity_set,
+    manufactured_displacement,
+    indicator,
+    x,
+    y,
+    precision_policy=None,
+    wall_distance=None,
+    params=None,
+):
+    """
+    Initialize boundary conditions from a level set function given as a function of (x, y)
+        taking arrays of coordinates
+
+    potential: level set function
+    potential_gradient: tuple of functions giving the x and y derivative of the level set function
+    wall_distance: function (i, j, x_direction, y_direction) giving q_ij of the links from nodes
+        (i, j) (arrays) to their ghost neighbors (if None, found by bisection on potential)
+    other arguments and returns: see init_bc_from_lambda
     """
-    # Mapping for boundary_info[0]:
+    # Mapping for boundary_info[0] (the only entry, one byte per node):
     # 0: ghost node
     # 1: interior node
     # 2: boundary node with dirichlet bc
     # 3: boundary node with VN bc
 
-    # Mapping for boundary_info[1...q]:
-    # 0: no missing neighbor in this direction
-    # 1: missing neighbor in this direction (i.e. connected to ghost node)
-
-    # Mapping for boundary values, Dirichlet:
+    # Boundary values are only stored for the missing links of boundary nodes (i.e. links
+    # connected to a ghost node or leaving the grid), see get_boundary_values_struct in
+    # kernel_provider.py. Mapping for the values of a link, Dirichlet:
     # 0: u_x
     # 1: u_y
     # 2:
     # 3:
-    # previoui 4:
-    # 5:
-    # 6: q_ij
+    # 4: q_ij
 
-    # Mapping for boundary values, VN:
+    # Mapping for the values of a link, VN:
     # 0: n_x
     # 1: n_y
     # 2: T_x
     # 3: T_y
-    # 4:
-    # 5:
-    # 6: q_ij
+    # 4: q_ij
 
     if precision_policy is None:
         precision_policy = DefaultConfig.default_precision_policy
+    dx_potential, dy_potential = potential_gradient
 
-    potential = sympy.lambdify([x, y], potential_sympy)
-
-    params = SimulationParams()
+    params = get_context(params)
     T = params.T
     L = params.L
     K = params.K
     mu = params.mu
     kappa = params.kappa
 
-    values_per_direction = 7
-    host_boundary_info = np.zeros(shape=(10, grid.shape[0], grid.shape[1], 1), dtype=np.int8)
-    host_boundary_values = np.zeros(
-        shape=(velocity_set.q * values_per_direction, grid.shape[0], grid.shape[1], 1),
-        dtype=np.float64,
-    )
+    values_per_link = 5
+    host_boundary_info = np.zeros(shape=(1, grid.shape[0], grid.shape[1], 1), dtype=np.int8)
+    # missing links: linear index of the node, direction and values
+    link_nodes, link_directions, link_values = list(), list(), list()
 
     # lambdify bc
     bc_dirichlet = [
@@ -468,118 +581,216 @@ def init_bc_from_lambda(
         bc_dirichlet_devs[i] = sympy.lambdify([x, y], bc_dirichlet_devs[i])
 
     # concatenate with non-derivative BC
-    bc_dirichlet = np.concatenate((bc_dirichlet, bc_dirichlet_devs))
+    bc_dirichlet = bc_dirichlet + bc_dirichlet_devs
+
+    # all steps work on whole arrays of nodes (or links) at once
+    nodes_x, nodes_y = grid.shape[0], grid.shape[1]
+    node_i, node_j = np.meshgrid(np.arange(nodes_x), np.arange(nodes_y), indexing="ij")
+
+    # step 1: set all nodes with non-positive potential to interior
+    interior = _evaluate_on_arrays(potential, node_i * dx, node_j * dx) <= 0
+    host_boundary_info[0, :, :, 0][interior] = 1
+
+    # step 2: for each interior node and direction, check if the neighbor is a ghost node or
+    # outside of the grid; if so, the node is a boundary node with a missing neighbor
+    for direction in range(velocity_set.q):
+        x_direction = int(velocity_set._c[0, direction])
+        y_direction = int(velocity_set._c[1, direction])
+        neighbor_i = node_i + x_direction
+        neighbor_j = node_j + y_direction
+        outside_x = (neighbor_i < 0) | (neighbor_i >= nodes_x)
+        outside_y = (neighbor_j < 0) | (neighbor_j >= nodes_y)
+        on_boundary = outside_x | outside_y  # edge of grid automatically counts as boundary
+        neighbor_ghost = np.zeros_like(interior)
+        neighbor_ghost[~on_boundary] = ~interior[neighbor_i[~on_boundary], neighbor_j[~on_boundary]]
+        i, j = np.nonzero(interior & (on_boundary | neighbor_ghost))
+        if i.size == 0:
+            continue
+
+        # distance to boundary: 0.5 on the edge of the grid, else the zero of the potential
+        # along the link
+        on_edge = on_boundary[i, j]
+        q_ij = np.full(i.shape, 0.5)
+        if wall_distance is None:
+            q_ij[~on_edge] = _find_wall_distance(
+                potential, i[~on_edge] * dx, j[~on_edge] * dx, x_direction, y_direction, dx
+            )
+        else:
+            q_ij[~on_edge] = wall_distance(i[~on_edge], j[~on_edge], x_direction, y_direction)
+        bc_x = (i + q_ij * x_direction) * dx
+        bc_y = (j + q_ij * y_direction) * dx
+        indicator_values = _evaluate_on_arrays(indicator, bc_x, bc_y)
+
+        # if dirichlet bc: set values
+        dirichlet = indicator_values < 0
+        d_i, d_j = i[dirichlet], j[dirichlet]
+        host_boundary_info[0, d_i, d_j, 0] = 2
+        values = np.zeros((d_i.size, values_per_link))
+        for k in range(2):
+            values[:, k] = _evaluate_on_arrays(bc_dirichlet[k], bc_x[dirichlet], bc_y[dirichlet])
+        values[:, 4] = q_ij[dirichlet]
+        link_nodes.append(d_i * nodes_y + d_j)
+        link_directions.append(np.full(d_i.size, direction))
+        link_values.append(values)
+
+        # if VN: find T
+        neumann = indicator_values > 0
+        n_i, n_j = i[neumann], j[neumann]
+        b_x, b_y = bc_x[neumann], bc_y[neumann]
+        host_boundary_info[0, n_i, n_j, 0] = 3
+        # find n
+        n_x = _evaluate_on_arrays(dx_potential, b_x, b_y)
+        n_y = _evaluate_on_arrays(dy_potential, b_x, b_y)
+        norm = np.sqrt(n_x**2 + n_y**2)
+        with np.errstate(divide="ignore", invalid="ignore"):  # edge normals are replaced below
+            n_x, n_y = n_x / norm, n_y / norm  # normalise
+        # if on edge of domain: normals cant be calculated with potential
+        edge_x = outside_x[n_i, n_j]
+        n_x = np.where(edge_x, x_direction, n_x)
+        n_y = np.where(edge_x, 0.0, n_y)
+        edge_y = outside_y[n_i, n_j]
+        n_x = np.where(edge_y, 0.0, n_x)
+        n_y = np.where(edge_y, y_direction, n_y)
+
+        # find T
+        dx_ux = _evaluate_on_arrays(bc_dirichlet[2], b_x, b_y)
+        dy_ux = _evaluate_on_arrays(bc_dirichlet[3], b_x, b_y)
+        dx_uy = _evaluate_on_arrays(bc_dirichlet[4], b_x, b_y)
+        dy_uy = _evaluate_on_arrays(bc_dirichlet[5], b_x, b_y)
+        T_x = (
+            ((K - mu) * (dx_ux + dy_uy) * n_x + mu * (2 * dx_ux * n_x + (dx_uy + dy_ux) * n_y))
+            * L
+            / kappa
+        )
+        T_y = (
+            ((K - mu) * (dx_ux + dy_uy) * n_y + mu * ((dx_uy + dy_ux) * n_x + 2 * dy_uy * n_y))
+            * L
+            / kappa
+        )
 
-    # step 1: set all nodes with negative potential to interior
-    for i in range(grid.shape[0]):
-        for j in range(grid.shape[1]):
-            if potential(i * dx, j * dx) <= 0:
-                host_boundary_info[0, i, j, 0] = 1
+        # write to link table
+        link_nodes.append(n_i * nodes_y + n_j)
+        link_directions.append(np.full(n_i.size, direction))
+        link_values.append(np.stack((n_x, n_y, T_x, T_y, q_ij[neumann]), axis=1))
 
-    # get gradients of potential
-    dx_potential = sympy.lambdify([x, y], sympy.diff(potential_sympy, x))
-    dy_potential = sympy.lambdify([x, y], sympy.diff(potential_sympy, y))
+    # move to device
+    return wp.from_numpy(host_boundary_info, dtype=wp.int8), _pack_boundary_values(
+        np.concatenate([np.zeros(0, dtype=np.int64)] + link_nodes),
+        np.concatenate([np.zeros(0, dtype=np.int64)] + link_directions),
+        np.concatenate([np.zeros((0, values_per_link))] + link_values),
+        precision_policy.store_precision.wp_dtype,
+    )
 
-    # step 2: for each interior node, check if all neighbor nodes are also interior; if not, set to boundary
-    for i in range(grid.shape[0]):
-        for j in range(grid.shape[1]):
-            if host_boundary_info[0, i, j, 0] == 1:
-                for direction in range(velocity_set.q):
-                    x_direction = velocity_set._c[0, direction]
-                    y_direction = velocity_set._c[1, direction]
-                    on_boundary = False
-                    on_boundary = (
-                        on_boundary or i + x_direction < 0 or i + x_direction >= grid.shape[0]
-                    )  # check if on edge of grid, automatically counts as boundary node too
-                    on_boundary = (
-                        on_boundary or j + y_direction < 0 or j + y_direction >= grid.shape[1]
-                    )
 
-                    # check if boundary node
-                    boundary_node = False
-                    cur_x, cur_y = i * dx, j * dx
-                    bc_x, bc_y = cur_x, cur_y
-                    q_ij = 0.5
-
-                    if on_boundary:  # if already on boundary of grid, just move the 0.5 to the side
-                        boundary_node = True
-                        bc_x = cur_x + 0.5 * dx * x_direction
-                        bc_y = cur_y + 0.5 * dx * y_direction
-                    elif host_boundary_info[0, (i + x_direction), (j + y_direction), 0] == 0:
-                        boundary_node = True
-                        max_steps = 1000
-                        stepsize = dx / max_steps
-                        counter = 0
-                        while (
-                            potential(bc_x, bc_y) < 0
-                        ):  # otherwise distance to boundary needs to be found, move along direction of pathway until on boundary
-                            bc_x += stepsize * x_direction
-                            bc_y += stepsize * y_direction
-                            counter += 1
-                            assert counter <= (max_steps + 1)
-                        q_ij = counter / max_steps
-
-                    # if dirichlet bc: set values
-                    if boundary_node and indicator(bc_x, bc_y) < 0:
-                        host_boundary_info[direction + 1, i, j, 0] = 1
-                        host_boundary_info[0, i, j, 0] = 2
-                        for k in range(values_per_direction - 1):
-                            host_boundary_values[direction * values_per_direction + k, i, j, 0] = (
-                                bc_dirichlet[k](bc_x, bc_y)
-                            )
-                        host_boundary_values[
-                            (direction + 1) * values_per_direction - 1, i, j, 0
-                        ] = q_ij
-                    elif boundary_node and indicator(bc_x, bc_y) > 0:  # if VN: find T
-                        host_boundary_info[direction + 1, i, j, 0] = 1
-                        opposite_direction = velocity_set.opp_indices[direction]
-                        # host_boundary_info[1 + 9 + opposite_direction, i, j, 0] = 1
-                        host_boundary_info[0, i, j, 0] = 3
-                        # find n
-                        n = [dx_potential(bc_x, bc_y), dy_potential(bc_x, bc_y)]
-                        n = n / (np.linalg.norm(n))  # normalise
-                        # if on edge of domain: normals cant be calculated with potential
-                        if on_boundary:
-                            n = [0.0, 0.0]
-                            if i + x_direction < 0 or i + x_direction >= grid.shape[0]:
-                                n[0] = x_direction
-                                n[1] = 0
-                            if j + y_direction < 0 or j + y_direction >= grid.shape[1]:
-                                n[0] = 0
-                                n[1] = y_direction
-
-                        # find T
-                        dx_ux = bc_dirichlet[2](bc_x, bc_y)
-                        dy_ux = bc_dirichlet[3](bc_x, bc_y)
-                        dx_uy = bc_dirichlet[4](bc_x, bc_y)
-                        dy_uy = bc_dirichlet[5](bc_x, bc_y)
-                        T_x = (
-                            (
-                                (K - mu) * (dx_ux + dy_uy) * n[0]
-                                + mu * (2 * dx_ux * n[0] + (dx_uy + dy_ux) * n[1])
-                            )
-                            * L
-                            / kappa
-                        )
-                        T_y = (
-                            (
-                                (K - mu) * (dx_ux + dy_uy) * n[1]
-                                + mu * ((dx_uy + dy_ux) * n[0] + 2 * dy_uy * n[1])
-                            )
-                            * L
-                            / kappa
-                        )
+def get_boundary_nodes(boundary_info, active_cells=None):
+    """
+    Lists the nodes the boundary conditions act on, i.e. all nodes that are not interior nodes
+        (boundary and ghost nodes), for kernels that treat them separately from the interior
 
-                        # write to array
-                        host_boundary_values[direction * values_per_direction, i, j, 0] = n[0]
-                        host_boundary_values[direction * values_per_direction + 1, i, j, 0] = n[1]
-                        host_boundary_values[direction * values_per_direction + 2, i, j, 0] = T_x
-                        host_boundary_values[direction * values_per_direction + 3, i, j, 0] = T_y
-                        host_boundary_values[
-                            (direction + 1) * values_per_direction - 1, i, j, 0
-                        ] = q_ij
+    boundary_info: 4d warp array with the node types (see _init_bc_from_functions)
+    active_cells: if given, ghost nodes outside of the ActiveCells are left out
 
-    # move to device
-    return wp.from_numpy(host_boundary_info, dtype=wp.int8), wp.from_numpy(
-        host_boundary_values, dtype=precision_policy.store_precision.wp_dtype
+    returns:
+        1d warp int32 array with the sorted linear indices i * nodes_y + j of the nodes
+    """
+    node_types = boundary_info.numpy()[0, :, :, 0]
+    listed = node_types != 1
+    if active_cells is not None:
+        i, j = np.indices(node_types.shape)
+        listed &= (node_types != 0) | active_cells.contains(i, j)
+    nodes = np.flatnonzero(listed)
+    return wp.array(nodes.astype(np.int32), dtype=wp.int32, device=boundary_info.device)
+
+
+def _pack_boundary_values(link_nodes, link_directions, link_values, store_dtype):
+    """
+    Packs the missing links into the compact boundary values (see get_boundary_values_struct)
+
+    link_nodes: linear node index (i * nodes_y + j) of every link
+    link_directions: direction of every link
+    link_values: array of shape (number of links, 5) with the values of every link
+    store_dtype: warp dtype of the values
+
+    returns:
+        instance of the boundary values struct on the device
+    """
+    # order links by node, then by direction
+    order = np.lexsort((link_directions, link_nodes))
+    link_nodes, link_directions = link_nodes[order], link_directions[order]
+    nodes, links_per_node = np.unique(link_nodes, return_counts=True)
+    offsets = np.concatenate(([0], np.cumsum(links_per_node)))
+
+    boundary_values = get_boundary_values_struct(store_dtype)()
+    boundary_values.nodes = wp.array(nodes.astype(np.int32), dtype=wp.int32)
+    boundary_values.offsets = wp.array(offsets.astype(np.int32), dtype=wp.int32)
+    boundary_values.directions = wp.array(link_directions.astype(np.int8), dtype=wp.int8)
+    boundary_values.values = wp.array(
+        np.ascontiguousarray(link_values[order]).reshape(-1, link_values.shape[1]),
+        dtype=store_dtype,
     )
+    return boundary_values
+
+
+def _bilinear_interpolation(values, dx):
+    """
+    Returns a function of (x, y) interpolating values given at the nodes (i * dx, j * dx)
+        bilinearly (constant extrapolation outside of the grid)
+    """
+
+    def interpolate(x, y):
+        nodes_x, nodes_y = values.shape
+        t_x = np.clip(np.asarray(x, dtype=np.float64) / dx, 0.0, nodes_x - 1)
+        t_y = np.clip(np.asarray(y, dtype=np.float64) / dx, 0.0, nodes_y - 1)
+        i = np.minimum(np.floor(t_x).astype(np.int64), max(nodes_x - 2, 0))
+        j = np.minimum(np.floor(t_y).astype(np.int64), max(nodes_y - 2, 0))
+        w_x, w_y = t_x - i, t_y - j
+        i_1, j_1 = np.minimum(i + 1, nodes_x - 1), np.minimum(j + 1, nodes_y - 1)
+        return (1.0 - w_x) * ((1.0 - w_y) * values[i, j] + w_y * values[i, j_1]) + w_x * (
+            (1.0 - w_y) * values[i_1, j] + w_y * values[i_1, j_1]
+        )
+
+    return interpolate
+
+
+def _evaluate_on_arrays(function, x, y):
+    """
+    Evaluates a function of (x, y) (lambdified sympy expression or python function) on arrays
+        of coordinates; functions which can not take arrays are evaluated point by point
+
+    returns:
+        float64 array with the shape of x
+    """
+    try:
+        values = function(x, y)
+    except (TypeError, ValueError):
+        values = np.vectorize(function, otypes=[np.float64])(x, y)
+    return np.broadcast_to(np.asarray(values, dtype=np.float64), np.shape(x))
+
+
+def _find_wall_distance(potential, x, y, x_direction, y_direction, dx, bisection_steps=50):
+    """
+    Finds the distance to the boundary (zero of the potential) from nodes at (x, y) along
+        direction (x_direction, y_direction) by bisection, for all nodes at once
+
+    potential: lambdified level set function, <= 0 at the nodes and > 0 at their neighbors
+    x, y: arrays of node coordinates
+    x_direction, y_direction: lattice direction of the link
+    dx: lattice spacing
+    bisection_steps: number of bisection steps (the error is 2^-bisection_steps)
+
+    returns:
+        array of q_ij in [0, 1], the fraction of the link inside the domain
+    """
+    lower = np.zeros(np.shape(x))
+    upper = np.ones(np.shape(x))
+    for step in range(bisection_steps):
+        middle = 0.5 * (lower + upper)
+        inside = (
+            _evaluate_on_arrays(
+                potential, x + middle * dx * x_direction, y + middle * dx * y_direction
+            )
+            < 0
+        )
+        lower = np.where(inside, middle, lower)
+        upper = np.where(inside, upper, middle)
+    return upper
@@ -0,0 +1,242 @@
+import hashlib
+import linecache
+import sys
+import types
+import numpy as np
+import sympy
+import warp as wp
+from xlb.experimental.multigrid_elastostatics.kernel_provider import kernel_lock
+
+# Code generation for sympy expressions of (x, y) (force loads, manufactured displacements and
+# stresses), so they can be evaluated on whole grids without a python call per node:
+#   - SympyFunction: callable lambdified as a numpy expression, evaluated on arrays at once
+#   - evaluate_on_device: writes the expressions at the grid nodes to a warp array, with a kernel
+#     generated from the expressions (evaluated in float64)
+# The generated kernels live in python modules of their own, created in memory and named after
+# the hash of their source, so warp's kernel cache serves them to later processes as well.
+
+# sympy functions with a warp counterpart of the same arguments
+_WARP_FUNCTIONS = {
+    sympy.sin: "wp.sin",
+    sympy.cos: "wp.cos",
+    sympy.tan: "wp.tan",
+    sympy.asin: "wp.asin",
+    sympy.acos: "wp.acos",
+    sympy.atan: "wp.atan",
+    sympy.atan2: "wp.atan2",
+    sympy.sinh: "wp.sinh",
+    sympy.cosh: "wp.cosh",
+    sympy.tanh: "wp.tanh",
+    sympy.exp: "wp.exp",
+    sympy.log: "wp.log",
+    sympy.Abs: "wp.abs",
+    sympy.floor: "wp.floor",
+    sympy.ceiling: "wp.ceil",
+    sympy.sign: "wp.sign",
+}
+
+_RELATIONS = {"<": "<", "<=": "<=", ">": ">", ">=": ">=", "==": "==", "!=": "!="}
+
+# generated kernels by source
+_kernels = {}
+
+
+def to_warp_expression(expression, symbols, constants):
+    """
+    Translates a sympy expression into the source of a float64 warp expression
+
+    expression: sympy expression
+    symbols: dict mapping the free symbols of expression to the names of warp variables
+    constants: dict mapping the values of the numbers in the expression to the names of float64
+        warp constants, extended by the numbers not in it yet (warp turns float literals into
+        float32, so numbers are not written as literals)
+
+    returns:
+        string with the warp expression
+    """
+    expression = sympy.sympify(expression)
+    if expression in symbols:
+        return symbols[expression]
+    if expression.is_Number or expression.is_NumberSymbol:
+        value = float(expression)
+        if value not in constants:
+            constants[value] = "c_{}".format(len(constants))
+        return constants[value]
+    if expression.is_Symbol:
+        raise ValueError("expression depends on unknown symbol " + str(expression))
+    if isinstance(expression, sympy.Piecewise):
+        # nested selects, starting from the last piece (its condition is True for sympy's
+        # default branch)
+        result = to_warp_expression(expression.args[-1].expr, symbols, constants)
+        for piece in reversed(expression.args[:-1]):
+            condition = to_warp_expression(piece.cond, symbols, constants)
+            value = to_warp_expression(piece.expr, symbols, constants)
+            result = "wp.select({}, {}, {})".format(condition, result, value)
+        return result
+    args = [to_warp_expression(arg, symbols, constants) for arg in expression.args]
+    if expression.is_Add:
+        return "(" + " + ".join(args) + ")"
+    if expression.is_Mul:
+        return "(" + " * ".join(args) + ")"
+    if expression.is_Pow:
+        base, exponent = args[0], expression.exp
+        if exponent == sympy.Rational(1, 2):
+            return "wp.sqrt({})".format(base)
+        if exponent == -1:
+            return "(wp.float64(1) / {})".format(base)
+        if exponent == 2:
+            return "({0} * {0})".format(base)
+        return "wp.pow({}, {})".format(base, args[1])
+    if expression.func in _WARP_FUNCTIONS:
+        return "{}({})".format(_WARP_FUNCTIONS[expression.func], ", ".join(args))
+    if isinstance(expression, (sympy.Min, sympy.Max)):
+        name = "wp.min" if isinstance(expression, sympy.Min) else "wp.max"
+        result = args[0]
+        for arg in args[1:]:
+            result = "{}({}, {})".format(name, result, arg)
+        return result
+    if isinstance(expression, sympy.core.relational.Relational):
+        return "({} {} {})".format(args[0], _RELATIONS[expression.rel_op], args[1])
+    if isinstance(expression, (sympy.And, sympy.Or)):
+        operator = " and " if isinstance(expression, sympy.And) else " or "
+        return "(" + operator.join(args) + ")"
+    if expression is sympy.true or expression is sympy.false:
+        return str(bool(expression))
+    raise NotImplementedError("no warp counterpart of " + str(expression.func))
+
+
+def get_grid_kernel(expressions, x, y, dtype=wp.float64):
+    """
+    Generates (or returns the already generated) kernel evaluating expressions at grid nodes
+
+    expressions: sequence of sympy expressions of x and y
+    x, y: sympy variables
+    dtype: warp dtype of the output array
+
+    returns:
+        warp kernel with inputs (dx: float64, scale: float64, first: int, case: int,
+        out: array4d(dtype=dtype)) and launch dim (nodes_x, nodes_y), writing
+        scale * expressions[c](i * dx, j * dx) to out[first + c, i, j, case]
+    """
+    symbols = {sympy.sympify(x): "x", sympy.sympify(y): "y"}
+    constants = dict()
+    dtype_name = "wp." + dtype.__name__
+    assignments = [
+        "    out[first + {}, i, j, case] = {}(scale * {})".format(
+            c, dtype_name, to_warp_expression(expression, symbols, constants)
+        )
+        for c, expression in enumerate(expressions)
+    ]
+    lines = ["import warp as wp", ""]
+    lines += [
+        "{} = wp.constant(wp.float64({!r}))".format(name, value)
+        for value, name in constants.items()
+    ]
+    lines += [
+        "",
+        "",
+        "@wp.kernel",
+        "def evaluate_on_grid(",
+        "    dx: wp.float64,",
+        "    scale: wp.float64,",
+        "    first: int,",
+        "    case: int,",
+        "    out: wp.array4d(dtype={}),".format(dtype_name),
+        "):",
+        "    i, j = wp.tid()",
+        "    x = wp.float64(i) * dx",
+        "    y = wp.float64(j) * dx",
+    ]
+    lines += assignments
+    source = "\n".join(lines) + "\n"
+
+    with kernel_lock:
+        kernel = _kernels.get(source)
+        if kernel is None:
+            kernel = _load_generated_module(source).evaluate_on_grid
+            _kernels[source] = kernel
+    return kernel
+
+
+def _load_generated_module(source):
+    """
+    Creates a python module from source in memory (its source is registered with linecache, where
+        warp reads the source of kernels from)
+    """
+    digest = hashlib.sha256(source.encode()).hexdigest()[:16]
+    name = __name__.rsplit(".", 1)[0] + ".generated_" + digest
+    module = sys.modules.get(name)
+    if module is None:
+        filename = "<{}>".format(name)
+        # entries without modification time are kept by linecache.checkcache
+        linecache.cache[filename] = (len(source), None, source.splitlines(True), filename)
+        module = types.ModuleType(name)
+        module.__file__ = filename
+        sys.modules[name] = module
+        exec(compile(source, filename, "exec"), module.__dict__)
+    return module
+
+
+def evaluate_on_device(
+    expressions, x, y, dx, shape, out=None, first=0, case=0, scale=1.0, device=None
+):
+    """
+    Evaluates sympy expressions at the nodes of a grid on the device
+    Note: no grid displacement assumed (node (i, j) at (i * dx, j * dx))
+
+    expressions: sequence of sympy expressions of x and y
+    x, y: sympy variables
+    dx: grid spacing
+    shape: number of nodes (nodes_x, nodes_y)
+    out: warp array4d (float32 or float64) to write to, shape (>= first + len(expressions),
+        nodes_x, nodes_y, >= case + 1) (allocated as float64 with shape (len(expressions),
+        nodes_x, nodes_y, 1) if None)
+    first: index of the first expression in the first dimension of out
+    case: index along the last dimension of out (load case)
+    scale: factor the values are multiplied with (in float64) before they are written to out
+
+    returns:
+        out
+    """
+    if out is None:
+        out = wp.empty((len(expressions),) + tuple(shape) + (1,), dtype=wp.float64, device=device)
+    kernel = get_grid_kernel(expressions, x, y, out.dtype)
+    with kernel_lock:
+        wp.load_module(kernel.module, device=out.device)
+    wp.launch(
+        kernel,
+        inputs=[wp.float64(dx), wp.float64(scale), first, case, out],
+        dim=tuple(shape),
+        device=out.device,
+    )
+    return out
+
+
+class SympyFunction:
+    """
+    Sympy expression of (x, y) as callable, lambdified as numpy expression: called with arrays
+        of coordinates, it is evaluated on them at once (constants are broadcast to their shape),
+        and steppers evaluate it on the device (see evaluate_on_device)
+    """
+
+    def __init__(self, expression, x, y):
+        """
+        expression: sympy expression of x and y
+        x, y: sympy variables
+        """
+        self.expression = expression
+        self.x = x
+        self.y = y
+        self._function = sympy.lambdify([x, y], expression, "numpy")
+
+    def __call__(self, x, y):
+        values = self._function(x, y)
+        return np.broadcast_to(np.asarray(values, dtype=np.float64), np.broadcast(x, y).shape)
+
+    def evaluate_on_device(self, dx, shape, out=None, first=0, case=0, scale=1.0, device=None):
+        """
+        Evaluates the expression at the grid nodes on the device, see evaluate_on_device
+        """
+        return evaluate_on_device(
+            [self.expression], self.x, self.y, dx, shape, out, first, case, scale, device
+        )
@@ -11,8 +11,9 @@ from xlb.velocity_set import VelocitySet
 from functools import partial
 
 import xlb.experimental.multigrid_elastostatics.solid_utils as utils
-from xlb.experimental.multigrid_elastostatics.solid_simulation_params import SimulationParams
+from xlb.experimental.multigrid_elastostatics.solid_simulation_params import get_context
 from xlb.experimental.multigrid_elastostatics.kernel_provider import KernelProvider
+from xlb.experimental.multigrid_elastostatics.multigrid_launch_plan import launch
 
 
 class SolidsCollision(Collision):
@@ -26,7 +27,17 @@ class SolidsCollision(Collision):
         velocity_set=None,
         precision_policy=None,
         compute_backend=None,
+        moment_storage=False,
+        params=None,
     ):
+        """
+        omega: vector of relaxation rates
+        moment_storage: if True, the kernel reads pre-collision moments instead of populations
+            (the post-collision populations are written as populations in both cases)
+        params: ParameterContext of the material (defaults to the current SimulationParams)
+        """
+        self.moment_storage = moment_storage
+        self.params = get_context(params)
         super().__init__(
             velocity_set=velocity_set,
             precision_policy=precision_policy,
@@ -36,26 +47,27 @@ class SolidsCollision(Collision):
         self.omega = omega
 
     def _construct_warp(self):
-        kernel_provider = KernelProvider()
+        kernel_provider = KernelProvider(self.precision_policy, self.params)
         vec = kernel_provider.vec
         read_local_population = kernel_provider.read_local_population
         calc_moments = kernel_provider.calc_moments
         calc_equilibrium = kernel_provider.calc_equilibrium
         calc_populations = kernel_provider.calc_populations
         write_population_to_global = kernel_provider.write_population_to_global
+        active_node = kernel_provider.active_node
 
         @wp.func
-        def functional(
-            f_vec: vec,
+        def functional_moments(
+            m: vec,
             force_x: self.compute_dtype,
             force_y: self.compute_dtype,
             omega: vec,
             theta: self.compute_dtype,
         ):
             """
-            Functional for performing collision step
+            Functional for performing collision step, starting from the moments
 
-            f_vec: vector of the 8 pre-collision populations on lattice point
+            m: vector of pre-collision moments on lattice point
             force_x, force_y: forcing terms at lattice point
             omega: vector of relaxation rates
             theta: lattice parameter
@@ -63,27 +75,53 @@ class SolidsCollision(Collision):
             returns:
                 vector of post collision populations
             """
-            m = calc_moments(f_vec)
+            _m = m
 
             # apply half-forcing and get displacement
-            m[0] += self.compute_dtype(0.5) * force_x
-            m[1] += self.compute_dtype(0.5) * force_y
+            _m[0] += self.compute_dtype(0.5) * force_x
+            _m[1] += self.compute_dtype(0.5) * force_y
 
-            m_eq = calc_equilibrium(m, self.compute_dtype(theta))
+            m_eq = calc_equilibrium(_m, self.compute_dtype(theta))
 
             # get post-collision populations
             for l in range(self.velocity_set.q):
-                m[l] = omega[l] * m_eq[l] + (self.compute_dtype(1.0) - omega[l]) * m[l]
+                _m[l] = omega[l] * m_eq[l] + (self.compute_dtype(1.0) - omega[l]) * _m[l]
 
             # half-forcing
-            m[0] += self.compute_dtype(0.5) * force_x
-            m[1] += self.compute_dtype(0.5) * force_y
+            _m[0] += self.compute_dtype(0.5) * force_x
+            _m[1] += self.compute_dtype(0.5) * force_y
 
             # get populations
-            f_vec_out = calc_populations(m)
+            f_vec_out = calc_populations(_m)
 
             return f_vec_out
 
+        @wp.func
+        def functional(
+            f_vec: vec,
+            force_x: self.compute_dtype,
+            force_y: self.compute_dtype,
+            omega: vec,
+            theta: self.compute_dtype,
+        ):
+            """
+            Functional for performing collision step
+
+            f_vec: vector of the 8 pre-collision populations on lattice point
+            force_x, force_y: forcing terms at lattice point
+            omega: vector of relaxation rates
+            theta: lattice parameter
+
+            returns:
+                vector of post collision populations
+            """
+            return functional_moments(calc_moments(f_vec), force_x, force_y, omega, theta)
+
+        # collision of the stored pre-collision state (populations or moments)
+        collide_stored = functional_moments if self.moment_storage else functional
+        self.functional_moments = functional_moments
+        self.functional_stored = collide_stored
+
         @wp.kernel
         def kernel(
             f: wp.array4d(dtype=self.store_dtype),
@@ -91,36 +129,43 @@ class SolidsCollision(Collision):
             force: wp.array4d(dtype=self.store_dtype),
             omega: vec,
             theta: self.compute_dtype,
+            row_spans: wp.array2d(dtype=wp.int32),
         ):
             """
             Kernel to compute the collision step for solids
-            f: grid pre-collision populations
+            f: grid pre-collision populations (moments if moment_storage)
             f_out: grid to write post-collision populations to
+            row_spans: spans of the nodes to collide (see ActiveCells)
 
             exits with:
-                f_out: post-collision populations
+                f_out: post-collision populations (at the nodes in row_spans)
             """
 
-            i, j, k = wp.tid()  # for 2d, k will equal 1
+            i, t, k = wp.tid()  # for 2d, k will equal 1
+            j = active_node(row_spans, i, t)
+            if j < 0:
+                return
 
-            f_vec = read_local_population(f, i, j)
-            force_x = self.compute_dtype(force[0, i, j, 0])
-            force_y = self.compute_dtype(force[1, i, j, 0])
+            f_vec = read_local_population(f, i, j, k)
+            force_x = self.compute_dtype(force[0, i, j, k])
+            force_y = self.compute_dtype(force[1, i, j, k])
 
-            f_vec_out = functional(f_vec, force_x, force_y, omega, theta)
+            f_vec_out = collide_stored(f_vec, force_x, force_y, omega, theta)
 
-            write_population_to_global(f_out, f_vec_out, i, j)
+            write_population_to_global(f_out, f_vec_out, i, j, k)
 
         return functional, kernel
 
     @Operator.register_backend(ComputeBackend.WARP)
-    def warp_implementation(self, f, f_out, force, omega):
-        params = SimulationParams()
-        theta = params.theta
+    def warp_implementation(self, f, f_out, force, omega, active_cells):
+        """
+        active_cells: ActiveCells of the grid, the nodes outside them are skipped
+        """
+        theta = self.params.theta
         # Launch the warp kernel
-        wp.launch(
+        launch(
             self.warp_kernel,
-            inputs=[f, f_out, force, omega, theta],
-            dim=f.shape[1:],
+            inputs=[f, f_out, force, omega, theta, active_cells.row_spans],
+            dim=active_cells.dim,
         )
         return f_out
@@ -0,0 +1,95 @@
+import numpy as np
+from xlb.utils import load_image
+
+try:
+    import scipy.ndimage
+except ImportError:
+    scipy = None
+
+
+# --------------geometry input for init_bc_from_signed_distance----------------
+# All functions return a signed distance field on the nodes (i * dx, j * dx) of a grid,
+# negative inside the domain and positive outside (the sign convention of the potentials
+# used in solid_boundary.py).
+
+
+def signed_distance_from_mask(mask, dx):
+    """
+    Computes the signed distance field of a voxel mask
+
+    The boundary is placed halfway between inside and outside nodes, i.e. the distance of a
+        node is the distance to the nearest node of the other kind minus dx / 2.
+
+    mask: boolean array with the shape of the grid, True inside the domain
+    dx: lattice spacing
+
+    returns:
+        array with the signed distance at every node
+    """
+    if scipy is None:
+        raise ImportError("signed_distance_from_mask requires scipy")
+    mask = np.asarray(mask, dtype=bool)
+    if mask.all() or not mask.any():
+        raise ValueError("mask has to contain nodes inside and outside of the domain")
+    distance_inside = scipy.ndimage.distance_transform_edt(mask)
+    distance_outside = scipy.ndimage.distance_transform_edt(~mask)
+    return np.where(mask, 0.5 - distance_inside, distance_outside - 0.5) * dx
+
+
+def mask_from_image(fname, grid, threshold=0.5, inside_dark=True):
+    """
+    Reads a voxel mask from an image (e.g. a PNG raster, see xlb.utils.load_image)
+
+    fname: name of the image file, with one pixel per node of grid
+    grid: grid object
+    threshold: grey value separating inside and outside pixels
+    inside_dark: if True, pixels darker than threshold are inside the domain, else brighter ones
+
+    returns:
+        boolean array with the shape of the grid, True inside the domain
+    """
+    image = load_image(fname)
+    if image.shape != tuple(grid.shape[:2]):
+        raise ValueError(
+            "image of shape {} does not match grid of shape {}".format(image.shape, grid.shape)
+        )
+    return image < threshold if inside_dark else image > threshold
+
+
+def signed_distance_from_polygon(vertices, grid, dx):
+    """
+    Computes the exact signed distance field of a polygon
+
+    vertices: array of shape (number of vertices, 2) with the physical coordinates of the
+        corners of a closed polygon (the last vertex is connected to the first one)
+    grid: grid object
+    dx: lattice spacing
+
+    returns:
+        array with the signed distance at every node (negative inside the polygon)
+    """
+    vertices = np.asarray(vertices, dtype=np.float64)
+    node_x, node_y = np.meshgrid(
+        np.arange(grid.shape[0]) * dx, np.arange(grid.shape[1]) * dx, indexing="ij"
+    )
+    distance = np.full(node_x.shape, np.inf)
+    inside = np.zeros(node_x.shape, dtype=bool)
+    for start, end in zip(vertices, np.roll(vertices, -1, axis=0)):
+        # distance to the edge from start to end
+        edge = end - start
+        length_squared = max(edge @ edge, np.finfo(np.float64).tiny)
+        t = np.clip(
+            ((node_x - start[0]) * edge[0] + (node_y - start[1]) * edge[1]) / length_squared,
+            0.0,
+            1.0,
+        )
+        distance = np.minimum(
+            distance,
+            np.hypot(node_x - (start[0] + t * edge[0]), node_y - (start[1] + t * edge[1])),
+        )
+        # even-odd rule: count crossings of the edge with a ray in +x direction
+        crosses = (start[1] > node_y) != (end[1] > node_y)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            crossing_x = start[0] + (node_y - start[1]) * edge[0] / edge[1]
+        inside ^= crosses & (node_x < crossing_x)
+    return np.where(inside, -distance, distance)
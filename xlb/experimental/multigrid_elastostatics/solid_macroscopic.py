@@ -8,7 +8,7 @@ from xlb.compute_backend import ComputeBackend
 from xlb.precision_policy import PrecisionPolicy
 from xlb.operator.operator import Operator
 import xlb.experimental.multigrid_elastostatics.solid_utils as utils
-from xlb.experimental.multigrid_elastostatics.solid_simulation_params import SimulationParams
+from xlb.experimental.multigrid_elastostatics.solid_simulation_params import get_context
 from xlb.experimental.multigrid_elastostatics.kernel_provider import KernelProvider
 
 
@@ -28,7 +28,21 @@ class SolidMacroscopics(Operator):
         #  8: dx_sxy
     """
 
-    def __init__(self, grid, omega, velocity_set=None, precision_policy=None, compute_backend=None):
+    def __init__(
+        self,
+        grid,
+        omega,
+        velocity_set=None,
+        precision_policy=None,
+        compute_backend=None,
+        params=None,
+    ):
+        """
+        grid: grid object
+        omega: vector of relaxation rates
+        params: ParameterContext of the material (defaults to the current SimulationParams)
+        """
+        self.params = get_context(params)
         super().__init__(
             velocity_set=velocity_set,
             precision_policy=precision_policy,
@@ -38,7 +52,7 @@ class SolidMacroscopics(Operator):
 
     def _construct_warp(self):
         # get warp funcs
-        kernel_provider = KernelProvider()
+        kernel_provider = KernelProvider(self.precision_policy, self.params)
         vec = kernel_provider.vec
         read_local_population = kernel_provider.read_local_population
         calc_moments = kernel_provider.calc_moments
@@ -130,9 +144,9 @@ class SolidMacroscopics(Operator):
                 macroscopics written to output_array
             """
             i, j, k = wp.tid()
-            bared_m = read_local_population(bared_moments, i, j)
-            force_x = self.compute_dtype(force[0, i, j, 0])
-            force_y = self.compute_dtype(force[1, i, j, 0])
+            bared_m = read_local_population(bared_moments, i, j, k)
+            force_x = self.compute_dtype(force[0, i, j, k])
+            force_y = self.compute_dtype(force[1, i, j, k])
 
             macro = functional(
                 bared_m=bared_m,
@@ -145,13 +159,13 @@ class SolidMacroscopics(Operator):
                 kappa=kappa,
             )
 
-            write_population_to_global(macroscopics, macro, i, j)
+            write_population_to_global(macroscopics, macro, i, j, k)
 
         return functional, kernel
 
     @Operator.register_backend(ComputeBackend.WARP)
     def warp_implementation(self, bared_moments, output_array, force):
-        params = SimulationParams()
+        params = self.params
         T = params.T
         L = params.L
         theta = params.theta
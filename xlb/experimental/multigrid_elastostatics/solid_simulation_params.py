@@ -3,9 +3,80 @@ from xlb.precision_policy import PrecisionPolicy
 from typing import Any
 import sympy
 import numpy as np
+import dataclasses
 import xlb.experimental.multigrid_elastostatics.solid_utils as utils
 
 
+@dataclasses.dataclass(frozen=True)
+class ParameterContext:
+    """
+    Immutable material and scaling parameters of one solver (or one level of a multigrid solver)
+
+    Holds the same values as SimulationParams, computed once (see from_material). Solvers and
+        their operators read their own context instead of the process-wide SimulationParams, so
+        solvers with different materials or resolutions can exist, and run concurrently, in one
+        process. The context of a coarser level is derived with with_resolution.
+    """
+
+    E_unscaled: float
+    nu_unscaled: float
+    K_unscaled: float
+    mu_unscaled: float
+    lamb_unscaled: float
+    # dimensionless material parameters
+    E: float
+    nu: float
+    K: float
+    mu: float
+    lamb: float
+    # resolution and scaling
+    dx: float
+    dt: float
+    L: float
+    T: float
+    kappa: float
+    theta: float
+
+    @classmethod
+    def from_material(cls, E, nu, dx, dt, L, T, kappa, theta=1.0 / 3.0):
+        """
+        Creates the context for the material E, nu (see SimulationParams.set_all_parameters)
+        """
+        K_unscaled = E / (2 * (1 - nu))
+        mu_unscaled = E / (2 * (1 + nu))
+        lamb_unscaled = K_unscaled - mu_unscaled
+        # make material params dimensionless
+        scale = L * L * kappa
+        return cls(
+            E_unscaled=E,
+            nu_unscaled=nu,
+            K_unscaled=K_unscaled,
+            mu_unscaled=mu_unscaled,
+            lamb_unscaled=lamb_unscaled,
+            E=E * T / scale,
+            nu=nu,
+            K=K_unscaled * T / scale,
+            mu=mu_unscaled * T / scale,
+            lamb=lamb_unscaled * T / scale,
+            dx=dx,
+            dt=dt,
+            L=L,
+            T=T,
+            kappa=kappa,
+            theta=theta,
+        )
+
+    def with_resolution(self, dx, dt):
+        """
+        Returns the context for the spatial and temporal resolution dx, dt
+        (diffusive scaling has to be maintained, the dimensionless parameters stay the same)
+        """
+        assert np.isclose(
+            dx * dx / (dt), self.dx * self.dx / (self.dt)
+        )  # assert that the ratio of dx^2/dt is constant
+        return dataclasses.replace(self, dx=dx, dt=dt, T=dt, L=dx)
+
+
 # these are the global variables needed throughout the simulation
 class SimulationParams:
     """
@@ -18,126 +89,103 @@ class SimulationParams:
     def __new__(cls):
         if cls._instance is None:
             cls._instance = super().__new__(cls)
-            cls._instance._E = None
-            cls._instance._nu = None
-            cls._instance._T = None
-            cls._instance._L = None
-            cls._instance._kappa = None
-            cls._instance._theta = None
-            cls._instance._K = None
-            cls._instance._mu = None
-            cls._instance._lamb = None
+            cls._instance._context = None
 
         return cls._instance
 
-    def set_all_parameters(self, E, nu, dx, dt, L, T, kappa, theta=None):
-        self._E_unscaled = E
-        self._E = E
-        self._nu_unscaled = nu
-        self._nu = nu
-        self._dx = dx
-        self._dt = dt
-        self._T = T
-        self._L = L
-        self._kappa = kappa
-        self._theta = 1.0 / 3.0
-        # self._precision_policy = precision_policy
-
-        # Calculate derived parameters
-        self._K_unscaled = E / (2 * (1 - nu))
-        self._mu_unscaled = E / (2 * (1 + nu))
-        self._lamb_unscaled = self._K_unscaled - self._mu_unscaled
-
-        # Make material params dimensionless
-        self._mu = self._mu_unscaled * self._T / (self._L * self._L * self._kappa)
-        self._lamb = self._lamb_unscaled * self._T / (self._L * self._L * self._kappa)
-        self._K = self._K_unscaled * self._T / (self._L * self._L * self._kappa)
-        self._E = self._E * self._T / (self._L * self._L * self._kappa)
+    def set_all_parameters(self, E, nu, dx, dt, L, T, kappa, theta=1.0 / 3.0):
+        """
+        Sets the material E, nu and the resolution and scaling dx, dt, L, T, kappa
+        (the parameters are computed by ParameterContext.from_material, so SimulationParams and
+        the contexts created directly agree for the same arguments)
+        """
+        if theta is None:
+            theta = 1.0 / 3.0
+        self._context = ParameterContext.from_material(E, nu, dx, dt, L, T, kappa, theta)
+
+    def get_context(self):
+        """
+        Returns the ParameterContext with the current parameters
+        """
+        return self._context
 
     def set_dx_dt(self, dx, dt):
         """
         Allows setting of spatial and temporal resolution
         Maintaining diffusive scaling is enforced
         """
-        assert np.isclose(
-            dx * dx / (dt), self._dx * self._dx / (self._dt)
-        )  # assert that the ratio of dx^2/dt is constant
-        self._dx = dx
-        self._dt = dt
-        self._T = dt
-        self._L = dx
+        self._context = self._context.with_resolution(dx, dt)
 
     @property
     def K_unscaled(self):
-        return self._K_unscaled
+        return self._context.K_unscaled
 
     @property
     def mu_unscaled(self):
-        return self._mu_unscaled
+        return self._context.mu_unscaled
 
     @property
     def lamb_unscaled(self):
-        return self._lamb_unscaled
+        return self._context.lamb_unscaled
 
     @property
     def E_unscaled(self):
-        return self._E_unscaled
+        return self._context.E_unscaled
 
     @property
     def nu_unscaled(self):
-        return self._nu_unscaled
+        return self._context.nu_unscaled
 
-    # Getter for E
     @property
     def E(self):
-        return self._E
+        return self._context.E
 
-    # Getter for dx
     @property
     def dx(self):
-        return self._dx
+        return self._context.dx
 
-    # Getter for dt
     @property
     def dt(self):
-        return self._dt
+        return self._context.dt
 
-    # Getter for nu
     @property
     def nu(self):
-        return self._nu
+        return self._context.nu
 
-    # Getter for T
     @property
     def T(self):
-        return self._T
+        return self._context.T
 
-    # Getter for L
     @property
     def L(self):
-        return self._L
+        return self._context.L
 
-    # Getter for kappa
     @property
     def kappa(self):
-        return self._kappa
+        return self._context.kappa
 
-    # Getter for theta
     @property
     def theta(self):
-        return self._theta
+        return self._context.theta
 
-    # Getter for K
     @property
     def K(self):
-        return self._K
+        return self._context.K
 
-    # Getter for mu
     @property
     def mu(self):
-        return self._mu
+        return self._context.mu
 
-    # Getter for lamb
     @property
     def lamb(self):
-        return self._lamb
+        return self._context.lamb
+
+
+def get_context(params=None):
+    """
+    Returns params, or a ParameterContext of the current SimulationParams if params is None
+        (default of the operators and solvers taking a context)
+    """
+    if params is None:
+        return SimulationParams().get_context()
+    return params
@@ -5,17 +5,19 @@ import sympy
 
 import xlb
 from xlb.operator.stepper import Stepper
-from xlb.operator.stream import Stream
 from xlb.operator import Operator
 from xlb.compute_backend import ComputeBackend
 
 from xlb.experimental.multigrid_elastostatics.solid_collision import SolidsCollision
-from xlb.experimental.multigrid_elastostatics.solid_boundary import SolidsBoundary
+from xlb.experimental.multigrid_elastostatics.solid_boundary import (
+    SolidsBoundary,
+    get_boundary_nodes,
+)
 from xlb.experimental.multigrid_elastostatics.solid_macroscopic import SolidMacroscopics
 from xlb.experimental.multigrid_elastostatics.solid_bared_moments import SolidBaredMoments
 import xlb.experimental.multigrid_elastostatics.solid_utils as utils
-from xlb.experimental.multigrid_elastostatics.solid_simulation_params import SimulationParams
-from xlb.experimental.multigrid_elastostatics.kernel_provider import KernelProvider
+from xlb.experimental.multigrid_elastostatics.solid_simulation_params import get_context
+from xlb.experimental.multigrid_elastostatics.kernel_provider import KernelProvider, defines_kernels
 
 # Mapping:
 #    i  j   |   m_q
@@ -35,25 +37,43 @@ class SolidsStepper(Stepper):
     Performs timesteps for standard LB scheme for electrostatics
     """
 
-    def __init__(self, grid, force_load, boundary_conditions=None, boundary_values=None):
+    @defines_kernels
+    def __init__(
+        self,
+        grid,
+        force_load,
+        boundary_conditions=None,
+        boundary_values=None,
+        split_boundary=False,
+        params=None,
+    ):
         """
         Initializer
 
         grid: xlb grid object, define domain size and resolution
         force_load: expected as callable function (e.g. lambda function)
         boundary_condition: when simulating with Dirichlet or VN; 4d warp array specifiying
-            boundary nodes, type of boundary conditions and missing populations (see solid_boundary.py)
-        boundary_values: when simulating with Dirichlet or VN; 4d warp array with floating point
-            values needed for reconstruction of missing populations on boundary (see solid_boundary.py)
+            boundary nodes and type of boundary conditions (see solid_boundary.py)
+        boundary_values: when simulating with Dirichlet or VN; compact boundary values listing the
+            missing populations of boundary nodes and the values needed for their reconstruction
+            (see solid_boundary.py)
+        split_boundary: if True, timesteps with BC run a branch-free kernel over all nodes and
+            a second kernel over the precomputed list of boundary and ghost nodes only, which
+            applies the BC there
+        params: ParameterContext of the material and the grid resolution (defaults to the
+            current SimulationParams)
         """
 
+        self.params = get_context(params)
         super().__init__(grid, boundary_conditions)
         self.grid = grid
         self.boundary_conditions = boundary_conditions
         self.boundary_values = boundary_values
+        self.split_boundary = split_boundary
+        self._set_boundary_nodes()
 
         # get simulation parameters
-        params = SimulationParams()
+        params = self.params
         theta = params.theta
         K = params.K
         mu = params.mu
@@ -73,7 +93,7 @@ class SolidsStepper(Stepper):
         omega_12 = 1 / (tau_12 + 0.5)
         omega_21 = 1 / (tau_21 + 0.5)
         omega_f = 1 / (tau_f + 0.5)
-        self.omega = KernelProvider().vec(
+        self.omega = KernelProvider(params=self.params).vec(
             0.0, 0.0, omega_11, omega_s, omega_d, omega_12, omega_21, omega_f, 0.0
         )
 
@@ -95,13 +115,13 @@ class SolidsStepper(Stepper):
         )  # ...and move to device
 
         # ---------define operators----------
-        self.collision = SolidsCollision(self.omega)
-        self.stream = Stream(self.velocity_set, self.precision_policy, self.compute_backend)
+        self.collision = SolidsCollision(self.omega, params=self.params)
         self.boundaries = SolidsBoundary(
             force=self.force,
             velocity_set=self.velocity_set,
             precision_policy=self.precision_policy,
             compute_backend=self.compute_backend,
+            params=self.params,
         )
         self.macroscopic = SolidMacroscopics(
             self.grid,
@@ -109,24 +129,30 @@ class SolidsStepper(Stepper):
             self.velocity_set,
             self.precision_policy,
             self.compute_backend,
+            params=self.params,
         )
         self.bared_moments = SolidBaredMoments(
-            self.grid, self.omega, self.velocity_set, self.precision_policy, self.compute_backend
+            self.grid,
+            self.omega,
+            self.velocity_set,
+            self.precision_policy,
+            self.compute_backend,
+            params=self.params,
         )
         self.equilibrium = None  # needed?
 
     def _construct_warp(self):
         # get kernels
-        kernel_provider = KernelProvider()
+        kernel_provider = KernelProvider(params=self.params)
+        boundary_values_struct = kernel_provider.boundary_values_struct
         copy_populations = kernel_provider.copy_populations
         read_local_population = kernel_provider.read_local_population
+        pull_population = kernel_provider.pull_population
         write_population_to_global = kernel_provider.write_population_to_global
-        read_bc_info = kernel_provider.read_bc_info
-        read_bc_vals = kernel_provider.read_bc_vals
         vec = kernel_provider.vec
-        bc_info_vec = kernel_provider.bc_info_vec
-        bc_val_vec = kernel_provider.bc_val_vec
         self.copy_populations = kernel_provider.copy_populations
+        self.stream_populations = kernel_provider.stream
+        self.scatter_to_nodes = kernel_provider.scatter_to_nodes
 
         @wp.kernel
         def kernel_no_bc(
@@ -146,54 +172,58 @@ class SolidsStepper(Stepper):
                 post-collision populations at time t + dt written to f_2
             """
             i, j, k = wp.tid()
-            index = wp.vec3i(i, j, k)
 
-            _f_post_collision = read_local_population(f_1, i, j)
-            _f_post_stream = self.stream.warp_functional(f_1, index)
+            _f_post_collision = read_local_population(f_1, i, j, k)
+            _f_post_stream = pull_population(f_1, i, j, k)
 
-            force_x = self.compute_dtype(force[0, i, j, 0])
-            force_y = self.compute_dtype(force[1, i, j, 0])
+            force_x = self.compute_dtype(force[0, i, j, k])
+            force_y = self.compute_dtype(force[1, i, j, k])
 
             _f_new_post_collision = self.collision.warp_functional(
                 f_vec=_f_post_stream, force_x=force_x, force_y=force_y, omega=omega, theta=theta
             )
 
-            write_population_to_global(f_2, _f_new_post_collision, i, j)
+            write_population_to_global(f_2, _f_new_post_collision, i, j, k)
 
-        @wp.kernel
-        def kernel_bc(
+        @wp.func
+        def functional_bc(
             f_1: wp.array4d(dtype=self.store_dtype),
             f_2: wp.array4d(dtype=self.store_dtype),
             f_3: wp.array4d(dtype=self.store_dtype),
             force: wp.array4d(dtype=self.store_dtype),
             boundary_info: wp.array4d(dtype=wp.int8),
-            boundary_vals: wp.array4d(dtype=self.store_dtype),
+            boundary_vals: boundary_values_struct,
+            i: wp.int32,
+            j: wp.int32,
+            k: wp.int32,
             omega: vec,
             K: self.compute_dtype,
             mu: self.compute_dtype,
             theta: self.compute_dtype,
+            f_post_collision_out: wp.array4d(dtype=self.store_dtype),
+            f_pre_collision_out: wp.array4d(dtype=self.store_dtype),
+            out_i: wp.int32,
+            out_j: wp.int32,
         ):
             """
-            Kernel for timestep with Dirichlet/VN BC
+            Functional for timestep with Dirichlet/VN BC at lattice point (i,j,k)
 
-            f_1: post-collision population at time t
-            f_2: post-collision populations at time t - dt
-            f_3: pre-collision population at time t
+            f_1, f_2, f_3, force, boundary_info, boundary_vals, omega, K, mu, theta:
+                see kernel_bc
+            f_post_collision_out, f_pre_collision_out: arrays to write the results to
+            out_i, out_j: index to write the results to
 
             exits with:
-                post-collision populations at time t + dt written to f_2
-                pre-collision populations at time t + dt written to f_3
+                post-collision populations at time t + dt written to f_post_collision_out
+                pre-collision populations at time t + dt written to f_pre_collision_out
             """
-            i, j, k = wp.tid()
-            index = wp.vec3i(i, j, k)
-
-            _f_post_collision = read_local_population(f_1, i, j)
-            _f_previous_post_collision = read_local_population(f_2, i, j)
-            _f_pre_collision = read_local_population(f_3, i, j)
-            _f_post_stream = self.stream.warp_functional(f_1, index)
+            _f_post_collision = read_local_population(f_1, i, j, k)
+            _f_previous_post_collision = read_local_population(f_2, i, j, k)
+            _f_pre_collision = read_local_population(f_3, i, j, k)
+            _f_post_stream = pull_population(f_1, i, j, k)
 
-            force_x = self.compute_dtype(force[0, i, j, 0])
-            force_y = self.compute_dtype(force[1, i, j, 0])
+            force_x = self.compute_dtype(force[0, i, j, k])
+            force_y = self.compute_dtype(force[1, i, j, k])
 
             _bared_m = self.bared_moments.warp_functional(
                 f_vec=_f_pre_collision, force_x=force_x, force_y=force_y, omega=omega, theta=theta
@@ -219,10 +249,143 @@ class SolidsStepper(Stepper):
                 f_vec=_f_post_stream, force_x=force_x, force_y=force_y, omega=omega, theta=theta
             )
 
-            write_population_to_global(f_2, _f_new_post_collision, i, j)
-            write_population_to_global(f_3, _f_post_stream, i, j)
+            write_population_to_global(f_post_collision_out, _f_new_post_collision, out_i, out_j, k)
+            write_population_to_global(f_pre_collision_out, _f_post_stream, out_i, out_j, k)
+
+        @wp.kernel
+        def kernel_bc(
+            f_1: wp.array4d(dtype=self.store_dtype),
+            f_2: wp.array4d(dtype=self.store_dtype),
+            f_3: wp.array4d(dtype=self.store_dtype),
+            force: wp.array4d(dtype=self.store_dtype),
+            boundary_info: wp.array4d(dtype=wp.int8),
+            boundary_vals: boundary_values_struct,
+            omega: vec,
+            K: self.compute_dtype,
+            mu: self.compute_dtype,
+            theta: self.compute_dtype,
+        ):
+            """
+            Kernel for timestep with Dirichlet/VN BC
+
+            f_1: post-collision population at time t
+            f_2: post-collision populations at time t - dt
+            f_3: pre-collision population at time t
+
+            exits with:
+                post-collision populations at time t + dt written to f_2
+                pre-collision populations at time t + dt written to f_3
+            """
+            i, j, k = wp.tid()
+            functional_bc(
+                f_1,
+                f_2,
+                f_3,
+                force,
+                boundary_info,
+                boundary_vals,
+                i,
+                j,
+                k,
+                omega,
+                K,
+                mu,
+                theta,
+                f_2,
+                f_3,
+                i,
+                j,
+            )
+
+        @wp.kernel
+        def kernel_interior(
+            f_1: wp.array4d(dtype=self.store_dtype),
+            f_2: wp.array4d(dtype=self.store_dtype),
+            f_3: wp.array4d(dtype=self.store_dtype),
+            force: wp.array4d(dtype=self.store_dtype),
+            omega: vec,
+            theta: self.compute_dtype,
+        ):
+            """
+            Kernel for timestep with periodic BC that also keeps the pre-collision populations
+            (interior part of a split timestep, see split_boundary)
+
+            f_1: post-collision population at time t
+            f_2, f_3: grids with arbitrary values
+
+            exits with:
+                post-collision populations at time t + dt written to f_2
+                pre-collision populations at time t + dt written to f_3
+            """
+            i, j, k = wp.tid()
+
+            _f_post_stream = pull_population(f_1, i, j, k)
+
+            force_x = self.compute_dtype(force[0, i, j, k])
+            force_y = self.compute_dtype(force[1, i, j, k])
+
+            _f_new_post_collision = self.collision.warp_functional(
+                f_vec=_f_post_stream, force_x=force_x, force_y=force_y, omega=omega, theta=theta
+            )
+
+            write_population_to_global(f_2, _f_new_post_collision, i, j, k)
+            write_population_to_global(f_3, _f_post_stream, i, j, k)
 
-        return None, (kernel_no_bc, kernel_bc)
+        @wp.kernel
+        def kernel_boundary(
+            f_1: wp.array4d(dtype=self.store_dtype),
+            f_2: wp.array4d(dtype=self.store_dtype),
+            f_3: wp.array4d(dtype=self.store_dtype),
+            force: wp.array4d(dtype=self.store_dtype),
+            boundary_info: wp.array4d(dtype=wp.int8),
+            boundary_vals: boundary_values_struct,
+            boundary_nodes: wp.array1d(dtype=wp.int32),
+            omega: vec,
+            K: self.compute_dtype,
+            mu: self.compute_dtype,
+            theta: self.compute_dtype,
+            f_post_collision_out: wp.array4d(dtype=self.store_dtype),
+            f_pre_collision_out: wp.array4d(dtype=self.store_dtype),
+        ):
+            """
+            Kernel for the boundary part of a split timestep with Dirichlet/VN BC
+            (one thread per listed node, see split_boundary)
+
+            boundary_nodes: linear indices of the boundary and ghost nodes
+                (see solid_boundary.get_boundary_nodes)
+            f_post_collision_out, f_pre_collision_out: arrays with arbitrary values,
+                shape (9, number of listed nodes, 1, 1)
+            other arguments: see kernel_bc
+
+            exits with:
+                post-collision populations at time t + dt of the listed nodes written to
+                    f_post_collision_out
+                pre-collision populations at time t + dt of the listed nodes written to
+                    f_pre_collision_out
+            """
+            b = wp.tid()
+            nodes_y = f_1.shape[2]
+            functional_bc(
+                f_1,
+                f_2,
+                f_3,
+                force,
+                boundary_info,
+                boundary_vals,
+                boundary_nodes[b] // nodes_y,
+                boundary_nodes[b] % nodes_y,
+                0,
+                omega,
+                K,
+                mu,
+                theta,
+                f_post_collision_out,
+                f_pre_collision_out,
+                b,
+                0,
+            )
+
+        return None, (kernel_no_bc, kernel_bc, kernel_interior, kernel_boundary)
 
     @Operator.register_backend(ComputeBackend.WARP)
     def warp_implementation(self, f_1, f_2, f_3=None):
@@ -238,7 +401,7 @@ class SolidsStepper(Stepper):
             pre-collision populations at time t + Delta t written to f_3 (if not simulating with periodic BC)
         """
 
-        params = SimulationParams()
+        params = self.params
         theta = params.theta
         if self.boundary_conditions is None:
             wp.launch(
@@ -246,6 +409,39 @@ class SolidsStepper(Stepper):
                 inputs=[f_1, f_2, self.force, self.omega, theta],
                 dim=f_1.shape[1:],
             )
+        elif self.split_boundary:
+            # the boundary kernel reads f_2 and f_3 before the interior kernel overwrites them,
+            # so its results are buffered and scattered afterwards
+            wp.launch(
+                self.warp_kernel[3],
+                inputs=[
+                    f_1,
+                    f_2,
+                    f_3,
+                    self.force,
+                    self.boundary_conditions,
+                    self.boundary_values,
+                    self.boundary_nodes,
+                    self.omega,
+                    params.K,
+                    params.mu,
+                    theta,
+                    self.boundary_output[0],
+                    self.boundary_output[1],
+                ],
+                dim=self.boundary_nodes.shape[0],
+            )
+            wp.launch(
+                self.warp_kernel[2],
+                inputs=[f_1, f_2, f_3, self.force, self.omega, theta],
+                dim=f_1.shape[1:],
+            )
+            for f, output in zip((f_2, f_3), self.boundary_output):
+                wp.launch(
+                    self.scatter_to_nodes,
+                    inputs=[output, self.boundary_nodes, f],
+                    dim=self.boundary_nodes.shape[0],
+                )
         else:
             K = params.K
             mu = params.mu
@@ -277,7 +473,7 @@ class SolidsStepper(Stepper):
         """
         if f_is_post_collision:
             assert self.boundary_conditions is None
-            self.stream(f, output_array)
+            wp.launch(self.stream_populations, inputs=[f, output_array], dim=f.shape[1:])
             self.bared_moments(f=output_array, output_array=output_array, force=self.force)
         else:
             self.bared_moments(f=f, output_array=output_array, force=self.force)
@@ -298,4 +494,25 @@ class SolidsStepper(Stepper):
             velocity_set=self.velocity_set,
             precision_policy=self.precision_policy,
             compute_backend=self.compute_backend,
+            params=self.params,
         )
+        self._set_boundary_nodes()
+
+    def _set_boundary_nodes(self):
+        """
+        Lists the boundary and ghost nodes and allocates the buffers of the boundary kernel
+            (only with split_boundary and BC)
+        """
+        self.boundary_nodes = None
+        self.boundary_output = None
+        if self.split_boundary and self.boundary_conditions is not None:
+            self.boundary_nodes = get_boundary_nodes(self.boundary_conditions)
+            # post- and pre-collision populations of the listed nodes
+            self.boundary_output = [
+                wp.zeros(
+                    (self.velocity_set.q, self.boundary_nodes.shape[0], 1, 1),
+                    dtype=self.store_dtype,
+                    device=self.boundary_conditions.device,
+                )
+                for _ in range(2)
+            ]
@@ -6,23 +6,27 @@ import numpy as np
 from xlb.utils import save_fields_vtk, save_image
 from xlb.experimental.multigrid_elastostatics.solid_simulation_params import SimulationParams
 from xlb.experimental.multigrid_elastostatics.kernel_provider import KernelProvider
+from xlb.experimental.multigrid_elastostatics.solid_codegen import SympyFunction, evaluate_on_device
 import matplotlib.pyplot as plt
 import statistics
 import math
 
 
-def get_force_load(manufactured_displacement, x, y):
+def get_force_load(manufactured_displacement, x, y, params=None):
     """ "
     Calculates the force load arising from a given manufactured displacement
 
     manufactured_displacement[0]: sympy function, dependent on x and y, giving displacement in x direction
     manufactured_displacement[1]: sympy function, dependent on x and y, giving displacement in x direction
     x, y: sympy variables
+    params: ParameterContext with the material parameters (defaults to the current SimulationParams)
 
     returns:
-        callable lambda func
+        SympyFunction of the force in x and y direction (callable with arrays of coordinates,
+        evaluated on the device by the steppers)
     """
-    params = SimulationParams()
+    if params is None:
+        params = SimulationParams()
     mu = params.mu_unscaled
     K = params.K_unscaled
     man_u = manufactured_displacement[0]
@@ -33,10 +37,7 @@ def get_force_load(manufactured_displacement, x, y):
     b_y = -mu * (sympy.diff(man_v, x, x) + sympy.diff(man_v, y, y)) - K * sympy.diff(
         sympy.diff(man_u, x) + sympy.diff(man_v, y), y
     )
-    return (
-        np.vectorize(sympy.lambdify([x, y], b_x, "numpy")),
-        np.vectorize(sympy.lambdify([x, y], b_y, "numpy")),
-    )
+    return SympyFunction(b_x, x, y), SympyFunction(b_y, x, y)
 
 
 def get_function_on_grid(f, x, y, dx, grid):
@@ -44,7 +45,8 @@ def get_function_on_grid(f, x, y, dx, grid):
     Takes sympy function and evaluates it on given grid
     Note: no grid displacement assumed
 
-    f: sympy func
+    f: sympy func (evaluated on the device, see solid_codegen.py, or as numpy expression on the
+        host if it contains functions without warp counterpart)
     x,y: sympy variables
     dx: grid spacing
     grid: grid to evaluate f on
@@ -52,10 +54,29 @@ def get_function_on_grid(f, x, y, dx, grid):
     returns:
         array with evaluated entries of f
     """
-    f = np.vectorize(sympy.lambdify([x, y], f, "numpy"))
-    f_scaled = lambda x_node, y_node: f(x_node * dx, y_node * dx)
-    f_on_grid = np.fromfunction(f_scaled, shape=grid.shape)
-    return f_on_grid
+    return get_functions_on_grid([f], x, y, dx, grid)[0]
+
+
+def get_functions_on_grid(functions, x, y, dx, grid):
+    """
+    Evaluates several sympy functions on given grid (on the device, with a single kernel)
+
+    functions: sequence of sympy funcs
+    x,y,dx,grid: see get_function_on_grid
+
+    returns:
+        array with the evaluated entries of functions[c] at index c
+    """
+    shape = tuple(grid.shape[:2])
+    try:
+        return evaluate_on_device(functions, x, y, dx, shape).numpy()[:, :, :, 0]
+    except NotImplementedError:
+        return np.array([
+            np.fromfunction(
+                lambda x_node, y_node: SympyFunction(f, x, y)(x_node * dx, y_node * dx), shape
+            )
+            for f in functions
+        ])
 
 
 def get_error_norms(current_macroscopics, expected_macroscopics, dx, timestep=0):
@@ -83,18 +104,20 @@ def get_error_norms(current_macroscopics, expected_macroscopics, dx, timestep=0)
     return l2_disp, linf_disp, l2_stress, linf_stress
 
 
-def get_expected_stress(manufactured_displacement, x, y):
+def get_expected_stress(manufactured_displacement, x, y, params=None):
     """
     Calculates expected stress from manufactured displacement
 
     manufactured_displacement[0]: sympy function, dependent on x and y, giving displacement in x direction
     manufactured_displacement[1]: sympy function, dependent on x and y, giving displacement in x direction
     x, y: sympy variables
+    params: ParameterContext with the material parameters (defaults to the current SimulationParams)
 
     returns:
         stress xx, stress yy, stress xy as sympy funcs
     """
-    params = SimulationParams()
+    if params is None:
+        params = SimulationParams()
     lamb = params.lamb_unscaled  # unscaled, because we want the expected stress in normal unit
     mu = params.mu_unscaled
     man_u = manufactured_displacement[0]
@@ -108,6 +131,22 @@ def get_expected_stress(manufactured_displacement, x, y):
     return s_xx, s_yy, s_xy
 
 
+def get_expected_macroscopics(manufactured_displacement, x, y, dx, grid, params=None):
+    """
+    Evaluates the manufactured displacement and its expected stress on given grid
+
+    manufactured_displacement, x, y, params: see get_expected_stress
+    dx: grid spacing
+    grid: grid to evaluate on
+
+    returns:
+        array with displacement x, displacement y, stress xx, stress yy, stress xy
+    """
+    s_xx, s_yy, s_xy = get_expected_stress(manufactured_displacement, x, y, params)
+    functions = list(manufactured_displacement) + [s_xx, s_yy, s_xy]
+    return get_functions_on_grid(functions, x, y, dx, grid)
+
+
 def restrict_solution_to_domain(
     array, potential, dx
 ):  # ToDo: make more efficient (fancy numpy funcs)
@@ -0,0 +1,194 @@
+import argparse
+import os
+import subprocess
+import sys
+import warp as wp
+import sympy
+import xlb
+import xlb.velocity_set
+from xlb.compute_backend import ComputeBackend
+from xlb.precision_policy import PrecisionPolicy
+from xlb.grid import grid_factory
+import xlb.experimental.multigrid_elastostatics.solid_boundary as bc
+from xlb.experimental.multigrid_elastostatics.solid_simulation_params import SimulationParams
+from xlb.experimental.multigrid_elastostatics.multigrid_solver import MultigridSolver
+from xlb.experimental.multigrid_elastostatics.solid_stepper import SolidsStepper
+from xlb.experimental.multigrid_elastostatics.kernel_provider import load_kernel_modules
+
+# Pre-compiles the warp kernels of the solvers into warp's kernel cache, so that later processes
+# load them instead of compiling them on their first launch, e.g.
+#
+#     python -m xlb.experimental.multigrid_elastostatics.warmup --precision fp64 --bc dirichlet
+#
+# Warp compiles one binary per python module, hashed over all kernels the module defines in the
+# process, and the kernels bake in the precision and the material constants K and theta (see
+# KernelProvider). The cache therefore only serves runs with the same precision, E, nu and kappa
+# (and the diffusive scaling dt = dx^2 used by all runners); the grid size, the number of levels,
+# the BC and the smoothing options (fused, split_boundary, skip_ghost_nodes) do not matter.
+# Every solver variant is warmed up in a process of its own, as a run only ever defines the
+# kernels of one of them. MultigridSolver(..., require_cached_kernels=True) checks at start-up
+# that nothing is left to compile.
+
+PRECISION_POLICIES = {
+    "fp32": PrecisionPolicy.FP32FP32,
+    "fp64": PrecisionPolicy.FP64FP64,
+    "fp64/fp32": PrecisionPolicy.FP64FP32,
+}
+
+# multigrid solver with the three storage layouts, standard LB stepper
+VARIANTS = ("populations", "compact", "moments", "standard")
+
+
+def parse_arguments(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Compile the warp kernels of the elastostatics solvers ahead of time"
+    )
+    parser.add_argument("--precision", choices=PRECISION_POLICIES, default="fp64")
+    parser.add_argument(
+        "--bc",
+        choices=("none", "dirichlet", "vn"),
+        default="dirichlet",
+        help="boundary conditions of the warm-up domain",
+    )
+    parser.add_argument("--E", type=float, default=0.5, help="Young's modulus")
+    parser.add_argument("--nu", type=float, default=0.8, help="Poisson ratio")
+    parser.add_argument("--kappa", type=float, default=1.0)
+    parser.add_argument(
+        "--variant",
+        choices=("all",) + VARIANTS,
+        default="all",
+        help="solver variant to warm up (all: each one in a separate process)",
+    )
+    return parser.parse_args(argv)
+
+
+def setup(precision_policy, E, nu, kappa, nodes):
+    """
+    Initializes xlb and the simulation parameters for a warm-up grid of nodes x nodes nodes
+
+    returns:
+        grid, dx, dt
+    """
+    compute_backend = ComputeBackend.WARP
+    velocity_set = xlb.velocity_set.D2Q9(
+        precision_policy=precision_policy, compute_backend=compute_backend
+    )
+    xlb.init(
+        velocity_set=velocity_set,
+        default_backend=compute_backend,
+        default_precision_policy=precision_policy,
+    )
+    grid = grid_factory((nodes, nodes), compute_backend=compute_backend)
+    dx = 1.0 / nodes
+    dt = dx * dx
+    SimulationParams().set_all_parameters(
+        E=E, nu=nu, dx=dx, dt=dt, L=dx, T=dt, kappa=kappa, theta=1.0 / 3.0
+    )
+    return grid, dx, dt
+
+
+def get_cache_entries():
+    """
+    Returns the set of module binaries in warp's kernel cache
+    """
+    wp.init()
+    if not os.path.isdir(wp.config.kernel_cache_dir):
+        return set()
+    return set(os.listdir(wp.config.kernel_cache_dir))
+
+
+def warm_up(variant, precision_policy, boundary="dirichlet", E=0.5, nu=0.8, kappa=1.0, nodes=16):
+    """
+    Compiles the kernels of one solver variant into warp's kernel cache
+
+    variant: one of VARIANTS
+    precision_policy: precision of the solver
+    boundary: "none", "dirichlet" or "vn", BC on a circular domain
+    E, nu, kappa: material parameters (baked into the kernels)
+    nodes: number of nodes in x and y direction of the warm-up grid
+
+    returns:
+        names of the module binaries that had to be compiled
+    """
+    cache_entries = get_cache_entries()
+    grid, dx, dt = setup(precision_policy, E, nu, kappa, nodes)
+    force_load = (lambda x, y: 0.0 * x, lambda x, y: 0.0 * y)
+    kw = {}
+    if boundary != "none":
+        x, y = sympy.symbols("x y")
+        potential = (0.5 - x) ** 2 + (0.5 - y) ** 2 - 0.15
+        sign = -1.0 if boundary == "dirichlet" else 1.0
+        boundary_array, boundary_values = bc.init_bc_from_lambda(
+            potential,
+            grid,
+            dx,
+            xlb.DefaultConfig.velocity_set,
+            (0 * x + 0 * y, 0 * x + 0 * y),
+            lambda x, y: sign,
+            x,
+            y,
+            precision_policy=precision_policy,
+        )
+        kw = dict(boundary_conditions=boundary_array, boundary_values=boundary_values)
+
+    if variant == "standard":
+        SolidsStepper(grid, force_load, **kw)
+        load_kernel_modules()
+        return sorted(get_cache_entries() - cache_entries)
+
+    if boundary != "none":
+        kw["potential"] = potential
+    multigrid_solver = MultigridSolver(
+        nodes_x=nodes,
+        nodes_y=nodes,
+        length_x=1.0,
+        length_y=1.0,
+        dt=dt,
+        force_load=force_load,
+        gamma=0.8,
+        v1=1,
+        v2=1,
+        compact_storage=(variant == "compact"),
+        moment_storage=(variant == "moments"),
+        precision_policy=precision_policy,
+        **kw,
+    )
+    # kernels defined at start-up, as checked by require_cached_kernels
+    load_kernel_modules()
+    # kernels defined on first use (FMG restriction, Krylov operators, macroscopics)
+    multigrid_solver.start_fmg(return_residual=True)
+    multigrid_solver.solve_krylov(tol=0.0, max_cycles=1, method="gmres")
+    multigrid_solver.solve_krylov(tol=0.0, max_cycles=1, method="bicgstab")
+    output_array = grid.create_field(cardinality=9, dtype=precision_policy.store_precision)
+    multigrid_solver.get_macroscopics(output_array=output_array)
+    load_kernel_modules()
+    wp.synchronize()
+    multigrid_solver.free()
+    return sorted(get_cache_entries() - cache_entries)
+
+
+if __name__ == "__main__":
+    args = parse_arguments()
+    if args.variant == "all":
+        # one process per variant, see above
+        for variant in VARIANTS:
+            command = [sys.executable, "-m", "xlb.experimental.multigrid_elastostatics.warmup"]
+            command += sys.argv[1:] + ["--variant", variant]
+            subprocess.run(command, check=True)
+    else:
+        compiled = warm_up(
+            args.variant,
+            PRECISION_POLICIES[args.precision],
+            boundary=args.bc,
+            E=args.E,
+            nu=args.nu,
+            kappa=args.kappa,
+        )
+        print(
+            "{} ({}, {}): {}".format(
+                args.variant,
+                args.precision,
+                args.bc,
+                "compiled " + ", ".join(compiled) if compiled else "all kernels already cached",
+            )
+        )
@@ -21,6 +21,8 @@ class Operator:
         self.velocity_set = velocity_set or DefaultConfig.velocity_set
         self.precision_policy = precision_policy or DefaultConfig.default_precision_policy
         self.compute_backend = compute_backend or DefaultConfig.default_backend
+        # backend method resolved per call shape (see __call__)
+        self._dispatch_cache = {}
 
         # Check if the compute compute_backend is supported
         if self.compute_backend not in ComputeBackend:
@@ -53,31 +55,70 @@ class Operator:
         return decorator
 
     def __call__(self, *args, callback=None, **kwargs):
+        # Fast path: call the backend method resolved for the last call with the same number of
+        # positional arguments and keyword names, without binding its signature again. Only call
+        # shapes binding to a single candidate are cached, so argument binding can not fail here
+        # and exceptions raised by the method propagate unchanged
+        call_shape = (len(args), tuple(kwargs))
+        cached_method = self._dispatch_cache.get(call_shape)
+        if cached_method is not None:
+            result = cached_method(self, *args, **kwargs)
+            callback_arg = result if result is not None else (args, kwargs)
+            if callback and callable(callback):
+                callback(callback_arg)
+            return result
+
+        key = None
         method_candidates = [
             (key, method)
             for key, method in self._backends.items()
             if key[0] == self.__class__.__name__ and key[1] == self.compute_backend
         ]
         bound_arguments = None
+        single_candidate = self._binds_single_candidate(method_candidates, args, kwargs)
         for key, backend_method in method_candidates:
             try:
                 # This attempts to bind the provided args and kwargs to the compute_backend method's signature
                 bound_arguments = inspect.signature(backend_method).bind(self, *args, **kwargs)
                 bound_arguments.apply_defaults()  # This fills in any default values
-                result = backend_method(self, *args, **kwargs)
-                callback_arg = result if result is not None else (args, kwargs)
-                if callback and callable(callback):
-                    callback(callback_arg)
-                return result
-            except Exception as e:
+            except TypeError as e:
                 error = e
                 traceback_str = traceback.format_exc()
                 continue  # This skips to the next candidate if binding fails
+            if single_candidate:
+                # no other candidate takes the arguments, so errors of the method propagate
+                result = backend_method(self, *args, **kwargs)
+                self._dispatch_cache[call_shape] = backend_method
+            else:
+                try:
+                    result = backend_method(self, *args, **kwargs)
+                except Exception as e:
+                    error = e
+                    traceback_str = traceback.format_exc()
+                    continue
+            callback_arg = result if result is not None else (args, kwargs)
+            if callback and callable(callback):
+                callback(callback_arg)
+            return result
 
         raise Exception(
             f"Error captured for backend with key {key} for operator {self.__class__.__name__}: {error}\n {traceback_str}"
         )
 
+    def _binds_single_candidate(self, method_candidates, args, kwargs):
+        """
+        Returns True if args and kwargs bind to the signature of exactly one of method_candidates
+            (the call shape then always resolves to the same method, see __call__)
+        """
+        num_bound = 0
+        for _, method in method_candidates:
+            try:
+                inspect.signature(method).bind(self, *args, **kwargs)
+            except TypeError:
+                continue
+            num_bound += 1
+        return num_bound == 1
+
     @property
     def supported_compute_backend(self):
         """
@@ -1,6 +1,7 @@
 from .utils import (
     downsample_field,
     save_image,
+    load_image,
     save_fields_vtk,
     save_BCs_vtk,
     rotate_geometry,
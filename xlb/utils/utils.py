@@ -87,6 +87,34 @@ def save_image(fld, timestep=None, prefix=None, **kwargs):
     plt.imsave(fname + ".png", fld.T, cmap=cm.nipy_spectral, origin="lower", **kwargs)
 
 
+def load_image(fname):
+    """
+    Load a 2D field from an image file.
+
+    Parameters
+    ----------
+    fname : str
+        The name of the image file (e.g. a PNG written by save_image).
+
+    Returns
+    -------
+    numpy.ndarray
+        The field as a 2D array of grey values in [0, 1], indexed as (x, y).
+
+    Notes
+    -----
+    The orientation is the one used by save_image: the first index runs along the image width and
+    the second one from the bottom to the top of the image (origin set to 'lower').
+    Color images are converted to grey values by averaging the color channels (alpha is ignored).
+    """
+    img = plt.imread(fname)
+    if img.ndim == 3:
+        img = img[..., :3].mean(axis=-1)
+    if np.issubdtype(img.dtype, np.integer):
+        img = img / np.iinfo(img.dtype).max
+    return np.asarray(img[::-1].T, dtype=np.float64)
+
+
 def save_fields_vtk(fields, timestep, output_dir=".", prefix="fields"):
     """
     Save VTK fields to the specified directory.